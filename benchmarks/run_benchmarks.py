@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import contextlib
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+# Modules of the toolchain live in three script directories
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for directory in ('superquadric_fitting', 'superquadrics_fitting_tools', 'superquadric_library'):
+    sys.path.append(os.path.join(REPOSITORY, directory))
+
+from fps_sampling import farthest_point_sampling
+from benchmark_fps import synthetic_surface
+from reconstruct import load_point_cloud, apply_transformation, reconstruct_shape
+from ply_writer import write_ply
+from rescale import process_directory
+
+# Problem sizes of each preset: cloud sizes in points and numbers of fitting JSONs
+PRESETS = {
+    'quick': {'points': [1000, 10000], 'fits': [1, 10]},
+    'default': {'points': [1000, 10000, 100000, 1000000], 'fits': [1, 10, 100]},
+    'full': {'points': [1000, 10000, 100000, 1000000, 5000000], 'fits': [1, 10, 100, 1000]},
+}
+
+# Samples drawn by the FPS benchmarks, as in the dataset conversion
+FPS_SAMPLES = 2000
+
+# Exact FPS is O(points * samples) and only benchmarked up to this many points
+EXACT_FPS_LIMIT = 1000000
+
+# Primitives per synthetic fitting, the typical count of the GUI fittings
+PRIMITIVES_PER_FIT = 3
+
+# Points per file of the synthetic library that process_directory rescales
+RESCALE_POINTS = 10000
+
+# Untimed runs before every measurement, which take lazy imports and cold caches out of the timings
+WARMUP_RUNS = 1
+
+
+def synthetic_fitting_info(num_primitives, seed=0):
+    """
+    Generates a random fitting in the fitting info record schema.
+    """
+    rng = np.random.default_rng(seed)
+    eps = ['0', '0.5', '1.0', '1.5', '2.0']
+    fitting_info = []
+    for _ in range(num_primitives):
+        fitting_info.append({
+            'primitive': f'{rng.choice(eps)}_{rng.choice(eps)}.ply',
+            'a1': float(rng.uniform(0.5, 2.0)), 'a2': float(rng.uniform(0.5, 2.0)), 'a3': float(rng.uniform(0.5, 2.0)),
+            'scale': float(rng.uniform(0.2, 1.0)),
+            'tx': float(rng.uniform(-0.1, 0.1)), 'ty': float(rng.uniform(-0.1, 0.1)), 'tz': float(rng.uniform(-0.1, 0.1)),
+            'roll': float(rng.uniform(-np.pi, np.pi)), 'pitch': float(rng.uniform(-np.pi, np.pi)),
+            'yaw': float(rng.uniform(-np.pi, np.pi)),
+            'object': '0'
+        })
+    return fitting_info
+
+
+def measure(function, repeat, warmup=WARMUP_RUNS):
+    """
+    Runs a function warmup times untimed, then repeat times, and returns the wall times in seconds.
+
+    Progress messages of the toolchain are still printed, but into a buffer.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            function()
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name, parameters, times, work, unit):
+    """
+    Builds a result entry; throughput is work units per second of the median run.
+    """
+    median = float(np.median(times))
+    return {'name': name, 'parameters': parameters, 'median_seconds': median, 'min_seconds': float(min(times)),
+            'throughput': work / median if median > 0 else None, 'unit': unit}
+
+
+def benchmark_fps(points, repeat):
+    results = []
+    for num_points in points:
+        vertices = synthetic_surface(num_points)
+        samples = min(FPS_SAMPLES, num_points // 2)
+        if num_points <= EXACT_FPS_LIMIT:
+            times = measure(lambda: farthest_point_sampling(vertices, samples, seed=0), repeat)
+            results.append(result('fps_exact', {'points': num_points, 'samples': samples}, times, num_points, 'points/s'))
+        times = measure(lambda: farthest_point_sampling(vertices, samples, seed=0, approximate=True), repeat)
+        results.append(result('fps_approximate', {'points': num_points, 'samples': samples}, times, num_points, 'points/s'))
+    return results
+
+
+def benchmark_ply_load(points, repeat, work_directory):
+    results = []
+    for num_points in points:
+        for binary in (True, False):
+            path = os.path.join(work_directory, f'cloud_{num_points}_{"binary" if binary else "ascii"}.ply')
+            write_ply(path, synthetic_surface(num_points), binary=binary)
+            times = measure(lambda: load_point_cloud(path), repeat)
+            results.append(result('ply_load', {'points': num_points, 'binary': binary, 'bytes': os.path.getsize(path)},
+                                  times, num_points, 'points/s'))
+    return results
+
+
+def benchmark_apply_transformation(points, repeat):
+    info = synthetic_fitting_info(1)[0]
+    results = []
+    for num_points in points:
+        vertices = synthetic_surface(num_points)
+        times = measure(lambda: apply_transformation(vertices, info), repeat)
+        results.append(result('apply_transformation', {'points': num_points}, times, num_points, 'points/s'))
+    return results
+
+
+def benchmark_reconstruct(fits, repeat, work_directory):
+    results = []
+    for num_fits in fits:
+        fittings = [synthetic_fitting_info(PRIMITIVES_PER_FIT, seed) for seed in range(num_fits)]
+        for binary in (True, False):
+            def reconstruct_all():
+                for i, fitting_info in enumerate(fittings):
+                    reconstruct_shape(fitting_info, None, os.path.join(work_directory, f'reconstruct_{i}.ply'),
+                                      binary=binary, verbose=False)
+            times = measure(reconstruct_all, repeat)
+            results.append(result('reconstruct_shape', {'fits': num_fits, 'primitives': PRIMITIVES_PER_FIT,
+                                                        'binary': binary}, times, num_fits, 'fits/s'))
+    return results
+
+
+def benchmark_rescale(fits, repeat, work_directory):
+    results = []
+    for num_files in fits:
+        input_directory = os.path.join(work_directory, f'library_{num_files}')
+        os.makedirs(input_directory, exist_ok=True)
+        vertices = synthetic_surface(RESCALE_POINTS)
+        for i in range(num_files):
+            write_ply(os.path.join(input_directory, f'{i}.ply'), vertices, binary=False)
+        parameters = {'files': num_files, 'points_per_file': RESCALE_POINTS}
+
+        # A full build writes into a new directory every run, warm-up included; an incremental one
+        # finds everything up to date after its warm-up run
+        output_directories = iter(tempfile.mkdtemp(dir=work_directory) for _ in range(WARMUP_RUNS + repeat))
+        times = measure(lambda: process_directory(input_directory, next(output_directories)), repeat)
+        results.append(result('rescale_process_directory', parameters, times, num_files, 'files/s'))
+        output_directory = os.path.join(work_directory, f'library_{num_files}_rescaled')
+        times = measure(lambda: process_directory(input_directory, output_directory), repeat)
+        results.append(result('rescale_incremental', parameters, times, num_files, 'files/s'))
+    return results
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(['git', '-C', REPOSITORY, 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_benchmarks(preset='default', repeat=3, only=None):
+    """
+    Runs the benchmark suite on synthetic data in a temporary directory.
+
+    :param preset: Problem sizes, one of PRESETS.
+    :param repeat: Runs per measurement; the median is reported.
+    :param only: Optional list of benchmark names to run.
+    :return: Dictionary with 'machine', 'preset' and 'results'.
+    """
+    sizes = PRESETS[preset]
+    work_directory = tempfile.mkdtemp(prefix='sq_benchmarks_')
+    benchmarks = {
+        'fps': lambda: benchmark_fps(sizes['points'], repeat),
+        'ply_load': lambda: benchmark_ply_load(sizes['points'], repeat, work_directory),
+        'apply_transformation': lambda: benchmark_apply_transformation(sizes['points'], repeat),
+        'reconstruct_shape': lambda: benchmark_reconstruct(sizes['fits'], repeat, work_directory),
+        'rescale': lambda: benchmark_rescale(sizes['fits'], repeat, work_directory),
+    }
+
+    results = []
+    try:
+        for name, benchmark in benchmarks.items():
+            if only and name not in only:
+                continue
+            print(f"Running {name}...")
+            for entry in benchmark():
+                print(f"  {entry['name']:<28} {json.dumps(entry['parameters']):<60} "
+                      f"{entry['median_seconds']:>9.4f} s  {entry['throughput']:>14,.0f} {entry['unit']}")
+                results.append(entry)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+    return {'machine': machine_info(), 'preset': preset, 'results': results}
+
+
+def result_key(entry):
+    return entry['name'], json.dumps(entry['parameters'], sort_keys=True)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Prints the change of every benchmark against a baseline run.
+
+    :param tolerance: Relative slowdown of the median time above which a result counts as a regression.
+    :return: Number of regressions.
+    """
+    baseline_entries = {result_key(entry): entry for entry in baseline['results']}
+    regressions = 0
+    print(f"{'benchmark':<28} {'parameters':<60} {'baseline s':>10} {'current s':>10} {'speedup':>8}")
+    for entry in results['results']:
+        reference = baseline_entries.get(result_key(entry))
+        if reference is None:
+            continue
+        speedup = reference['median_seconds'] / entry['median_seconds']
+        regression = entry['median_seconds'] > reference['median_seconds'] * (1 + tolerance)
+        regressions += regression
+        print(f"{entry['name']:<28} {json.dumps(entry['parameters']):<60} {reference['median_seconds']:>10.4f} "
+              f"{entry['median_seconds']:>10.4f} {speedup:>7.2f}x{'  REGRESSION' if regression else ''}")
+    print(f"{regressions} regressions beyond {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the superquadric fitting toolchain on synthetic data.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='default', help='Problem sizes to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement; the median is reported')
+    parser.add_argument('--only', nargs='+', default=None,
+                        choices=['fps', 'ply_load', 'apply_transformation', 'reconstruct_shape', 'rescale'],
+                        help='Run only these benchmarks')
+    parser.add_argument('--output', default='benchmark_results.json', help='Path to save the results JSON to')
+    parser.add_argument('--baseline', default=None, help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative slowdown reported as a regression in the comparison')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.preset, args.repeat, args.only)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
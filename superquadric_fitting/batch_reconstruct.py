@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from reconstruct import reconstruct_shape
+from primitive_library import load_library
+from superquadric_sampler import primitive_eps, sample_superquadric
+from fit_store import FitStore
+from profiling import enable as enable_profiling
+
+
+def find_fitting_files(input_directory, pattern='*_fitting_info*.json'):
+    """
+    Lists the fitting info JSON files of a directory, including the _NN variants saved by the GUI.
+    """
+    return sorted(glob.glob(os.path.join(input_directory, pattern)))
+
+
+def read_manifest(manifest_path):
+    """
+    Reads the fitting info paths of a manifest: a JSON list, or a text file with one path per line.
+
+    Relative paths are resolved against the directory of the manifest.
+    """
+    with open(manifest_path, 'r') as f:
+        content = f.read()
+    if manifest_path.endswith('.json'):
+        paths = json.loads(content)
+    else:
+        paths = [line.strip() for line in content.splitlines() if line.strip() and not line.startswith('#')]
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    return [os.path.join(base, path) for path in paths]
+
+
+def load_fitting(source):
+    """
+    Loads a fitting from a fitting info JSON path, or from a (store path, object ID) tuple, which
+    reads the latest revision of the object from a fit store.
+    """
+    if isinstance(source, tuple):
+        with FitStore(source[0]) as store:
+            fitting_info = store.load(source[1])
+        if fitting_info is None:
+            raise KeyError(f"No fitting of object {source[1]} in {source[0]}")
+        return fitting_info
+    with open(source, 'r') as f:
+        return json.load(f)
+
+
+def source_label(source):
+    return f'{os.path.basename(source[0])}:{source[1]}' if isinstance(source, tuple) else source
+
+
+def output_name(fitting_info_path):
+    """
+    Maps e.g. 8_obj_fitting_info_01.json to 8_reconstruct_01.ply, and a stored object 8 to
+    8_reconstruct.ply.
+    """
+    if isinstance(fitting_info_path, tuple):
+        return f'{fitting_info_path[1]}_reconstruct.ply'
+    stem = os.path.splitext(os.path.basename(fitting_info_path))[0]
+    name, count = re.subn(r'_obj_fitting_info', '_reconstruct', stem)
+    return f'{name}.ply' if count else f'{stem}_reconstruct.ply'
+
+
+def _warm_library(superquadric_library_path, shapes):
+    """
+    Loads the shared primitive data once per process.
+
+    With a library path, this memory-maps the binary cache, whose pages are shared between all
+    workers through the OS page cache. Otherwise it fills the sampler cache; with the fork start
+    method, workers inherit the samples already drawn by the parent.
+    """
+    if superquadric_library_path is not None:
+        load_library(superquadric_library_path)
+        return
+    for eps1, eps2 in shapes:
+        sample_superquadric(eps1, eps2)
+
+
+def _reconstruct_job(fitting_info_path, superquadric_library_path, output_ply_path, binary, library_scale_factor):
+    start = time.perf_counter()
+    try:
+        fitting_info = load_fitting(fitting_info_path)
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        return {'file': source_label(fitting_info_path), 'primitives': 0, 'points': 0,
+                'seconds': time.perf_counter() - start, 'status': f'error: {e}'}
+
+    num_points = reconstruct_shape(fitting_info, superquadric_library_path, output_ply_path,
+                                   binary=binary, verbose=False, library_scale_factor=library_scale_factor)
+    return {'file': source_label(fitting_info_path), 'primitives': len(fitting_info), 'points': num_points or 0,
+            'seconds': time.perf_counter() - start, 'status': 'ok' if num_points is not None else 'failed'}
+
+
+def batch_reconstruct(fitting_info_paths, superquadric_library_path, output_directory, num_workers=None,
+                      binary=True, library_scale_factor=1):
+    """
+    Reconstructs every fitting info JSON into a point cloud .ply, in parallel worker processes.
+
+    The primitive library (or the analytic samples) is prepared once in the parent before the
+    workers start.
+
+    :param fitting_info_paths: List of fitting info JSON paths, or of (store path, object ID) tuples.
+    :param superquadric_library_path: Directory of the baked PLY library, or None to sample the
+                                      primitives analytically.
+    :param output_directory: Directory to write the reconstructed .ply files to.
+    :param num_workers: Number of worker processes, defaults to the number of CPUs.
+    :param binary: Write binary little-endian PLY; set to False for ASCII output.
+    :param library_scale_factor: Factor the library coordinates are divided by, see reconstruct_shape.
+    :return: List of per-file summary dictionaries, in input order.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+
+    shapes = set()
+    if superquadric_library_path is None:
+        for fitting_info_path in fitting_info_paths:
+            try:
+                shapes.update(primitive_eps(info) for info in load_fitting(fitting_info_path))
+            except (OSError, ValueError, KeyError):
+                continue  # Reported by the worker
+    shapes = sorted(shapes)
+    _warm_library(superquadric_library_path, shapes)
+
+    output_paths = [os.path.join(output_directory, output_name(path)) for path in fitting_info_paths]
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_warm_library,
+                             initargs=(superquadric_library_path, shapes)) as executor:
+        results = list(executor.map(_reconstruct_job, fitting_info_paths,
+                                    [superquadric_library_path] * len(fitting_info_paths),
+                                    output_paths, [binary] * len(fitting_info_paths),
+                                    [library_scale_factor] * len(fitting_info_paths)))
+    return results
+
+
+def print_summary(results):
+    print(f"{'file':<40} {'primitives':>10} {'points':>10} {'seconds':>8}  status")
+    for result in results:
+        print(f"{os.path.basename(result['file']):<40} {result['primitives']:>10} {result['points']:>10} "
+              f"{result['seconds']:>8.3f}  {result['status']}")
+    total_points = sum(result['points'] for result in results)
+    total_seconds = sum(result['seconds'] for result in results)
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f"{len(results)} files, {total_points} points, {total_seconds:.2f} s worker time, {failed} failed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconstruct superquadric point clouds from fitting info JSON files.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input-dir', help='Directory of fitting info JSON files')
+    source.add_argument('--manifest', help='JSON list or text file of fitting info JSON paths')
+    source.add_argument('--store', help='Fit store to reconstruct the latest fitting of every object from')
+    parser.add_argument('--objects', nargs='+', default=None, help='Object IDs to reconstruct with --store')
+    parser.add_argument('--pattern', default='*_fitting_info*.json', help='Glob pattern used with --input-dir')
+    parser.add_argument('--output-dir', required=True, help='Directory to write the reconstructed .ply files to')
+    parser.add_argument('--library', default=None,
+                        help='superquadric_lib_rescale directory; primitives are sampled analytically if omitted')
+    parser.add_argument('--library-scale', type=float, default=1,
+                        help='Factor to divide the library coordinates by, e.g. 10 for the unscaled superquadric_library')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--ascii', action='store_true', help='Write ASCII instead of binary .ply files')
+    parser.add_argument('--summary', default=None, help='Optional path to save the per-file summary as JSON')
+    parser.add_argument('--profile', default=None, help='Record a Chrome trace of the pipeline stages to this path')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        enable_profiling(args.profile)
+
+    if args.input_dir:
+        fitting_info_paths = find_fitting_files(args.input_dir, args.pattern)
+    elif args.store:
+        with FitStore(args.store) as store:
+            object_ids = args.objects or store.objects()
+        fitting_info_paths = [(args.store, object_id) for object_id in object_ids]
+    else:
+        fitting_info_paths = read_manifest(args.manifest)
+    print(f"Reconstructing {len(fitting_info_paths)} fittings...")
+
+    start = time.perf_counter()
+    results = batch_reconstruct(fitting_info_paths, args.library, args.output_dir, args.workers,
+                                binary=not args.ascii, library_scale_factor=args.library_scale)
+    print_summary(results)
+    print(f"Wall time: {time.perf_counter() - start:.2f} s")
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
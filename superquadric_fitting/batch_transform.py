@@ -0,0 +1,112 @@
+import numpy as np
+from profiling import traced
+
+# Per-primitive parameter arrays produced by pack_fitting_info
+PARAMETER_KEYS = ('a1', 'a2', 'a3', 'scale', 'tx', 'ty', 'tz', 'roll', 'pitch', 'yaw')
+
+
+def pack_fitting_info(fitting_info):
+    """
+    Packs K fitting info records, possibly from several fittings, into parameter arrays.
+
+    :param fitting_info: List of fitting info records.
+    :return: Dictionary with 'axes' (K, 3), 'scale' (K,), 'translation' (K, 3) and 'angles' (K, 3),
+             the angles ordered as (roll, pitch, yaw).
+    """
+    values = np.array([[info[key] for key in PARAMETER_KEYS] for info in fitting_info], dtype=float)
+    values = values.reshape(-1, len(PARAMETER_KEYS))
+    return {
+        'axes': values[:, 0:3],
+        'scale': values[:, 3],
+        'translation': values[:, 4:7],
+        'angles': values[:, 7:10],
+    }
+
+
+def rotation_matrices(roll, pitch, yaw):
+    """
+    Builds R = R_z(yaw) R_y(pitch) R_x(roll) for K angle triples at once.
+
+    :return: (K, 3, 3) array; entry k equals rotation_matrix(roll[k], pitch[k], yaw[k]).
+    """
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+
+    R = np.empty((len(cr), 3, 3))
+    R[:, 0, 0] = cy * cp
+    R[:, 0, 1] = cy * sp * sr - sy * cr
+    R[:, 0, 2] = cy * sp * cr + sy * sr
+    R[:, 1, 0] = sy * cp
+    R[:, 1, 1] = sy * sp * sr + cy * cr
+    R[:, 1, 2] = sy * sp * cr - cy * sr
+    R[:, 2, 0] = -sp
+    R[:, 2, 1] = cp * sr
+    R[:, 2, 2] = cp * cr
+    return R
+
+
+def rotation_angles(R):
+    """
+    Recovers (roll, pitch, yaw) of K rotation matrices, the inverse of rotation_matrices.
+
+    At pitch = +-90 degrees only roll - yaw (or roll + yaw) is determined; roll is then set to 0.
+
+    :param R: (K, 3, 3) array of rotation matrices.
+    :return: (K, 3) array of angles ordered as (roll, pitch, yaw).
+    """
+    pitch = -np.arcsin(np.clip(R[:, 2, 0], -1.0, 1.0))
+    roll = np.arctan2(R[:, 2, 1], R[:, 2, 2])
+    yaw = np.arctan2(R[:, 1, 0], R[:, 0, 0])
+    locked = np.abs(R[:, 2, 0]) > 1.0 - 1e-9
+    roll[locked] = 0.0
+    yaw[locked] = np.arctan2(-R[locked, 0, 1], R[locked, 1, 1])
+    return np.stack([roll, pitch, yaw], axis=1)
+
+
+def primitive_matrices(params):
+    """
+    Computes the linear part scale * diag(a) R^T of every primitive transformation.
+
+    Points are row vectors, so a primitive point v maps to v @ M + t.
+
+    :param params: Parameter arrays from pack_fitting_info.
+    :return: (K, 3, 3) array of matrices M.
+    """
+    R = rotation_matrices(*params['angles'].T)
+    return (params['axes'] * params['scale'][:, None])[:, :, None] * R.transpose(0, 2, 1)
+
+
+@traced('transform', points='result')
+def transform_primitives(vertices, params, out=None):
+    """
+    Transforms the points of K primitives into place in a single pass.
+
+    :param vertices: (K, N, 3) array of untransformed primitive points, or a list of K (N_k, 3)
+                     arrays. Equally sized primitives are transformed by one batched matmul.
+    :param params: Parameter arrays from pack_fitting_info, one entry per primitive.
+    :param out: Optional preallocated (sum N_k, 3) output buffer.
+    :return: Tuple (points (sum N_k, 3), labels (sum N_k,)) where labels holds the index of the
+             primitive every point belongs to.
+    """
+    M = primitive_matrices(params)
+    translation = params['translation']
+    counts = np.array([len(v) for v in vertices], dtype=np.int64)
+    total = int(counts.sum())
+    if out is None:
+        out = np.empty((total, 3))
+
+    if len(counts) and np.all(counts == counts[0]):
+        stacked = vertices if isinstance(vertices, np.ndarray) else np.stack(vertices)
+        out_view = out.reshape(len(counts), counts[0], 3)
+        np.matmul(stacked, M, out=out_view)
+        out_view += translation[:, None, :]
+    else:
+        offset = 0
+        for k, (v, count) in enumerate(zip(vertices, counts)):
+            np.matmul(v, M[k], out=out[offset:offset + count])
+            out[offset:offset + count] += translation[k]
+            offset += count
+
+    labels = np.repeat(np.arange(len(counts)), counts)
+    return out, labels
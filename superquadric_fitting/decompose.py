@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from reconstruct import load_point_cloud
+from superquadric_fitter import (fit_superquadric_params, fitting_info_to_params, params_to_fitting_info, radial_distance,
+                                 save_fitting_info)
+
+
+def split_part(points):
+    """
+    Splits a part in two at its centroid, across its longest principal axis.
+
+    :return: Boolean mask of the points on one side.
+    """
+    centered = points - points.mean(axis=0)
+    _, eigvecs = np.linalg.eigh(np.cov(centered.T))
+    return np.dot(centered, eigvecs[:, -1]) > 0
+
+
+def assign_points(points, parts):
+    """
+    Assigns every point to the primitive whose surface is closest.
+
+    :param parts: List of parameter vectors.
+    :return: Tuple (labels (N,), distance of every point to its primitive (N,)).
+    """
+    distances = np.stack([radial_distance(points, params) for params in parts], axis=1)
+    labels = np.argmin(distances, axis=1)
+    return labels, distances[np.arange(len(points)), labels]
+
+
+class _Decomposition:
+    """
+    State of one decomposition run: the fitted parts, their primitive names and the time budget.
+    """
+
+    def __init__(self, points, deadline, min_points, fit_kwargs):
+        self.points = points
+        self.deadline = deadline
+        self.min_points = min_points
+        self.fit_kwargs = fit_kwargs
+        self.parts = []
+        self.primitives = []
+
+    def out_of_time(self):
+        return time.perf_counter() > self.deadline
+
+    def fit(self, selection, x0=None):
+        params, primitive, _ = fit_superquadric_params(self.points[selection], x0=x0, **self.fit_kwargs)
+        return params, primitive
+
+    def refine(self, iterations):
+        """
+        Hard EM: reassigns the points to their closest primitive and refits every part from its
+        current parameters. Parts left with fewer than min_points points are dropped.
+
+        :return: Tuple (labels, distances) of the final assignment.
+        """
+        labels, distances = assign_points(self.points, self.parts)
+        for _ in range(iterations):
+            if self.out_of_time():
+                break
+            counts = np.bincount(labels, minlength=len(self.parts))
+            keep = [k for k in range(len(self.parts)) if counts[k] >= self.min_points] or [int(np.argmax(counts))]
+            if len(keep) < len(self.parts):
+                self.parts = [self.parts[k] for k in keep]
+                self.primitives = [self.primitives[k] for k in keep]
+                labels, distances = assign_points(self.points, self.parts)
+
+            for k in range(len(self.parts)):
+                self.parts[k], self.primitives[k] = self.fit(labels == k, x0=self.parts[k])
+            new_labels, distances = assign_points(self.points, self.parts)
+            converged = np.array_equal(new_labels, labels)
+            labels = new_labels
+            if converged:
+                break
+        return labels, distances
+
+    def snapshot(self):
+        return list(self.parts), list(self.primitives)
+
+    def restore(self, snapshot):
+        self.parts, self.primitives = list(snapshot[0]), list(snapshot[1])
+
+
+def decompose(points, object_id, max_primitives=6, tolerance=0.01, time_budget=30.0, em_iterations=3,
+              min_points=100, sample_points=10000, seed=0, **fit_kwargs):
+    """
+    Decomposes an object point cloud into several superquadrics by split-and-merge.
+
+    Starting from a single primitive, the part with the largest total residual is split in two
+    across its longest axis, both halves are refitted, and the assignment of points to primitives
+    is refined by a few hard EM iterations. A split is kept only if it lowers the mean distance.
+    This repeats until every part is within tolerance, max_primitives is reached or the time
+    budget runs out. Finally, neighbouring parts are merged again where a single primitive fits
+    their union within tolerance.
+
+    :param points: (N, 3) array of object points, e.g. from load_point_cloud.
+    :param object_id: Object ID stored in the 'object' field of the records.
+    :param max_primitives: Maximum number of primitives.
+    :param tolerance: Acceptable mean distance of a part to its primitive, relative to the
+                      largest extent of the object.
+    :param time_budget: Seconds after which no further fit is started, so a run ends at most one
+                        fit later.
+    :param em_iterations: Number of reassignment iterations after every split.
+    :param min_points: Parts with fewer points are not split further, and dropped if they shrink
+                       below it during reassignment.
+    :param sample_points: The object is randomly subsampled to this many points.
+    :param seed: Seed for the subsampling.
+    :param fit_kwargs: Passed on to fit_superquadric_params, e.g. continuous_eps or max_iterations.
+    :return: List of fitting info records, one per primitive.
+    """
+    deadline = time.perf_counter() + time_budget
+    points = np.asarray(points, dtype=float)
+    if points.shape[0] > sample_points:
+        rng = np.random.default_rng(seed)
+        points = points[rng.choice(points.shape[0], sample_points, replace=False)]
+    threshold = tolerance * np.ptp(points, axis=0).max()
+    fit_kwargs.setdefault('seed', seed)
+
+    state = _Decomposition(points, deadline, min_points, fit_kwargs)
+    params, primitive = state.fit(np.ones(len(points), dtype=bool))
+    state.parts, state.primitives = [params], [primitive]
+    labels, distances = assign_points(points, state.parts)
+
+    # Split; parts whose split did not help are skipped until another split succeeds
+    unsplittable = set()
+    while len(state.parts) < max_primitives and not state.out_of_time():
+        counts = np.bincount(labels, minlength=len(state.parts))
+        errors = np.bincount(labels, weights=distances, minlength=len(state.parts))
+        candidates = [k for k in np.argsort(-errors)
+                      if counts[k] >= 2 * min_points and errors[k] > threshold * counts[k] and k not in unsplittable]
+        if not candidates:
+            break
+        k = candidates[0]
+
+        snapshot = state.snapshot()
+        indices = np.flatnonzero(labels == k)
+        side = split_part(points[indices])
+        state.parts[k], state.primitives[k] = state.fit(indices[side])
+        params, primitive = state.fit(indices[~side])
+        state.parts.append(params)
+        state.primitives.append(primitive)
+        new_labels, new_distances = state.refine(em_iterations)
+
+        if new_distances.mean() < distances.mean():
+            labels, distances = new_labels, new_distances
+            unsplittable.clear()
+        else:
+            state.restore(snapshot)
+            unsplittable.add(k)
+
+    # Merge
+    merged = True
+    while merged and len(state.parts) > 1 and not state.out_of_time():
+        merged = False
+        centers = np.array([params[3:6] for params in state.parts])
+        pairs = [(np.linalg.norm(centers[i] - centers[j]), i, j)
+                 for i in range(len(state.parts)) for j in range(i + 1, len(state.parts))]
+        for _, i, j in sorted(pairs):
+            if state.out_of_time():
+                break
+            mask = (labels == i) | (labels == j)
+            larger = i if np.sum(labels == i) >= np.sum(labels == j) else j
+            params, primitive = state.fit(mask, x0=state.parts[larger])
+            if radial_distance(points[mask], params).mean() <= threshold:
+                state.parts[i], state.primitives[i] = params, primitive
+                del state.parts[j], state.primitives[j]
+                labels, distances = assign_points(points, state.parts)
+                merged = True
+                break
+
+    continuous_eps = fit_kwargs.get('continuous_eps', False)
+    return [params_to_fitting_info(params, primitive, object_id, continuous_eps)
+            for params, primitive in zip(state.parts, state.primitives)]
+
+
+def refine_fitting(points, object_id, fitting_info, em_iterations=3, min_points=100, sample_points=10000, seed=0,
+                   time_budget=30.0, **fit_kwargs):
+    """
+    Refits an existing fitting to a changed point cloud of the same object.
+
+    Every primitive starts from its stored parameters instead of the PCA guesses, and the points
+    are reassigned to the primitives by hard EM as in decompose. The number of primitives is kept,
+    except that parts left with fewer than min_points points are dropped.
+
+    :param fitting_info: List of fitting info records of the previous fitting.
+    :param fit_kwargs: Passed on to fit_superquadric_params, e.g. continuous_eps or max_iterations.
+    :return: List of fitting info records, one per primitive.
+    """
+    deadline = time.perf_counter() + time_budget
+    points = np.asarray(points, dtype=float)
+    if points.shape[0] > sample_points:
+        rng = np.random.default_rng(seed)
+        points = points[rng.choice(points.shape[0], sample_points, replace=False)]
+    fit_kwargs.setdefault('seed', seed)
+
+    state = _Decomposition(points, deadline, min(min_points, len(points)), fit_kwargs)
+    state.parts = [fitting_info_to_params(info) for info in fitting_info]
+    state.primitives = [info['primitive'] for info in fitting_info]
+    state.refine(max(em_iterations, 1))
+
+    continuous_eps = fit_kwargs.get('continuous_eps', False)
+    return [params_to_fitting_info(params, primitive, object_id, continuous_eps)
+            for params, primitive in zip(state.parts, state.primitives)]
+
+
+def decompose_object(object_ply_path, fitting_info_directory, **kwargs):
+    """
+    Loads an object point cloud, decomposes it into superquadrics and saves the fitting info to
+    the store of fitting_info_directory.
+
+    :return: Revision number of the saved fitting.
+    """
+    object_name = os.path.splitext(os.path.basename(object_ply_path))[0]
+    object_id = object_name.split('_')[0]
+
+    start = time.perf_counter()
+    fitting_info = decompose(load_point_cloud(object_ply_path), object_id, **kwargs)
+    print(f"Decomposed {object_name} into {len(fitting_info)} primitives in {time.perf_counter() - start:.1f} s")
+    return save_fitting_info(fitting_info, object_ply_path, fitting_info_directory)
+
+
+def _decompose_job(job):
+    object_ply_path, fitting_info_directory, kwargs = job
+    try:
+        return decompose_object(object_ply_path, fitting_info_directory, **kwargs)
+    except Exception as e:
+        print(f"Failed to decompose {object_ply_path}: {e}")
+        return None
+
+
+def decompose_directory(point_cloud_directory, fitting_info_directory, pattern='*_obj.ply', num_workers=None,
+                        **kwargs):
+    """
+    Decomposes every object point cloud of a directory in a process pool.
+
+    :return: List of saved revision numbers, None for objects that failed.
+    """
+    os.makedirs(fitting_info_directory, exist_ok=True)
+    object_ply_paths = sorted(glob.glob(os.path.join(point_cloud_directory, pattern)))
+    jobs = [(path, fitting_info_directory, kwargs) for path in object_ply_paths]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(_decompose_job, jobs))
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    point_cloud_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+
+    decompose_directory(point_cloud_directory, fitting_info_directory)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+from batch_transform import PARAMETER_KEYS, primitive_matrices
+from superquadric_sampler import EPS_SHARP, LIBRARY_RADIUS, sample_superquadric, surface_radius
+from fit_store import STORE_FILE, FitStore
+
+# Features of one primitive in the packed parameter array, in column order
+FEATURE_KEYS = PARAMETER_KEYS + ('eps1', 'eps2')
+
+# Points of the cached unit surface sample that lends its directions to batch samples, per shape
+BANK_POINTS = 4096
+
+# Step of the shape grid whose cached samples are used for every shape, see sample_batch
+SHAPE_STEP = 0.1
+
+# Exponent of Thomsen's approximation of the ellipsoid area, used to share samples among primitives
+AREA_EXPONENT = 1.6
+
+
+def pack_fit_dataset(fitting_source, output_path, object_ids=None, k_max=None):
+    """
+    Packs the latest fitting of every object into fixed-shape padded arrays in one .npz file.
+
+    The file holds 'params' (N, k_max, len(FEATURE_KEYS)) float32, 'mask' (N, k_max) bool with
+    the valid primitives, 'primitive' (N, k_max) library file names, and 'object' and 'revision'
+    (N,). Padded slots are zero.
+
+    :param fitting_source: Fit store file, or a fitting info directory holding one. Fitting info
+                           JSON files can be added to a store with fit_store.import_fitting_files.
+    :param output_path: Path of the .npz file to write.
+    :param object_ids: Objects to pack; all stored objects if None.
+    :param k_max: Primitive slots per object; defaults to the largest fitting. Objects with more
+                  primitives are left out with a warning.
+    :return: Number of objects packed.
+    """
+    store_path = os.path.join(fitting_source, STORE_FILE) if os.path.isdir(fitting_source) else fitting_source
+    with FitStore(store_path) as store:
+        arrays = store.load_arrays(object_ids)
+    for object_id in arrays['missing']:
+        print(f"Warning: no fitting of object {object_id} in {store_path}")
+
+    offsets = arrays['offsets']
+    counts = np.diff(offsets)
+    if k_max is None:
+        k_max = int(counts.max()) if len(counts) else 1
+    keep = counts <= k_max
+    for object_id in arrays['object'][offsets[:-1][~keep]]:
+        print(f"Warning: object {object_id} has more than {k_max} primitives and is left out")
+
+    # Slot of every primitive row: object index and position within the object
+    rows = np.repeat(np.arange(len(counts)), counts)
+    slots = np.arange(len(rows)) - np.repeat(offsets[:-1], counts)
+    selected = keep[rows]
+    object_index = np.cumsum(keep)[rows[selected]] - 1
+
+    num_objects = int(keep.sum())
+    params = np.zeros((num_objects, k_max, len(FEATURE_KEYS)), dtype=np.float32)
+    features = np.column_stack([arrays[key] for key in PARAMETER_KEYS] + [arrays['eps']])
+    params[object_index, slots[selected]] = features[selected]
+    mask = np.zeros((num_objects, k_max), dtype=bool)
+    mask[object_index, slots[selected]] = True
+    primitive = np.full((num_objects, k_max), '', dtype=arrays['primitive'].dtype)
+    primitive[object_index, slots[selected]] = arrays['primitive'][selected]
+
+    first = offsets[:-1][keep]
+    np.savez(output_path, params=params, mask=mask, primitive=primitive, object=arrays['object'][first],
+             revision=arrays['revision'][first], feature_keys=np.array(FEATURE_KEYS))
+    print(f"Packed {num_objects} objects with up to {k_max} primitives into {output_path}")
+    return num_objects
+
+
+class FitDataset:
+    """
+    Padded superquadric parameters of a packed dataset file, see pack_fit_dataset.
+
+    Batches are gathered with array indexing only, and surface samples are drawn for all
+    primitives of a batch at once, so a batch costs a few vectorized passes however large it is
+    and however many distinct shapes it holds.
+
+        dataset = FitDataset('fits.npz')
+        batch = dataset.batch(np.arange(64), samples=2048, seed=0)
+    """
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        with np.load(dataset_path) as data:
+            self.params = data['params']
+            self.mask = data['mask']
+            self.primitive = data['primitive']
+            self.object = data['object']
+            self.revision = data['revision']
+        self.feature_keys = FEATURE_KEYS
+        self.k_max = self.params.shape[1]
+
+    def __len__(self):
+        return len(self.params)
+
+    def __getitem__(self, index):
+        return {'params': self.params[index], 'mask': self.mask[index], 'object': self.object[index]}
+
+    def batch(self, indices, samples=0, seed=None):
+        """
+        Gathers a batch of objects.
+
+        :param indices: Object indices of the batch.
+        :param samples: Surface points to draw per object, spread over its primitives in proportion
+                        to their approximate area; 0 for parameters only.
+        :param seed: Seed of the sampling, so that a batch can be reproduced.
+        :return: Dictionary with 'params' (B, k_max, F), 'mask' (B, k_max), 'object' (B,) and, with
+                 samples, 'points' (B, samples, 3) float32 and 'labels' (B, samples) with the
+                 primitive slot of every point.
+        """
+        indices = np.asarray(indices)
+        batch = {'params': self.params[indices], 'mask': self.mask[indices], 'object': self.object[indices]}
+        if samples:
+            batch['points'], batch['labels'] = sample_batch(batch['params'], batch['mask'], samples,
+                                                            np.random.default_rng(seed))
+        return batch
+
+
+# Cached unit samples of the grid shapes, see sample_batch: the row block of every shape in one
+# (shapes * BANK_POINTS, 3) array, kept together so that batches index it without copying. Loader
+# threads share it, so it is only read and grown under _bank_lock
+_bank_rows = {}
+_bank = np.empty((0, 3))
+_bank_lock = threading.Lock()
+
+
+def _bank_blocks(shapes):
+    """
+    Returns the bank holding every (eps1, eps2) grid shape, sampling new shapes once, and the
+    first row of every shape in it. The bank is replaced, never changed, when shapes are added,
+    so the returned array stays valid for the caller.
+    """
+    global _bank
+    with _bank_lock:
+        new = [(eps1, eps2) for eps1, eps2 in shapes if (eps1, eps2) not in _bank_rows]
+        if new:
+            _bank = np.concatenate([_bank] + [sample_superquadric(eps1, eps2, BANK_POINTS) / LIBRARY_RADIUS
+                                              for eps1, eps2 in new])
+            for eps1, eps2 in new:
+                _bank_rows[(eps1, eps2)] = len(_bank_rows) * BANK_POINTS
+        return _bank, np.array([_bank_rows[(eps1, eps2)] for eps1, eps2 in shapes], dtype=np.int64)
+
+
+def sample_batch(params, mask, samples, rng):
+    """
+    Draws surface points of a batch of padded fittings, see FitDataset.batch.
+    """
+    params = params.astype(float)
+    batch_size, k_max, _ = params.shape
+    axes = params[:, :, 0:3] * params[:, :, 3:4]
+
+    # Approximate area of every primitive, as an ellipsoid; padded slots get none
+    p = AREA_EXPONENT
+    area = ((axes[:, :, 0] * axes[:, :, 1]) ** p + (axes[:, :, 0] * axes[:, :, 2]) ** p
+            + (axes[:, :, 1] * axes[:, :, 2]) ** p) ** (1 / p)
+    area = np.where(mask, area, 0.0)
+    area[area.sum(axis=1) == 0, 0] = 1.0
+    cumulative = np.cumsum(area, axis=1)
+    cumulative /= cumulative[:, -1:]
+    # One search over all rows, each shifted by its row index so that rows do not overlap
+    shift = np.arange(batch_size)[:, None]
+    u = rng.random((batch_size, samples))
+    labels = np.searchsorted((cumulative + shift).ravel(), (u + shift).ravel(), side='right').reshape(u.shape)
+    labels = np.minimum(labels - shift * k_max, k_max - 1)
+
+    # Only primitives of the fittings are sampled; objects without any get zero points
+    slot = np.arange(batch_size)[:, None] * k_max + labels
+    flat = params.reshape(-1, params.shape[2])
+    valid = mask.reshape(-1)[slot]
+    chosen = slot[valid]
+
+    # Points are drawn from the unit sample of the nearest shape on a SHAPE_STEP grid, which is
+    # spread by area; off-grid shapes are projected radially onto their exact surface, which
+    # only costs one radius per point
+    eps = flat[:, 10:12]
+    grid = np.round(np.round(eps / SHAPE_STEP) * SHAPE_STEP, 6)
+    shapes, shape_index = np.unique(grid[mask.reshape(-1)], axis=0, return_inverse=True)
+    bank, blocks = _bank_blocks(shapes.tolist())
+    slot_block = np.zeros(len(flat), dtype=np.int64)
+    slot_block[mask.reshape(-1)] = blocks[shape_index.reshape(-1)]
+    unit = bank[slot_block[chosen] + rng.integers(0, BANK_POINTS, len(chosen))]
+    off_grid = np.flatnonzero((np.abs(eps - grid) > 1e-6).any(axis=1)[chosen])
+    if off_grid.size:
+        directions = unit[off_grid] / np.linalg.norm(unit[off_grid], axis=1)[:, None]
+        off_eps = np.maximum(eps[chosen[off_grid]], EPS_SHARP)
+        unit[off_grid] = directions * surface_radius(directions, off_eps[:, 0], off_eps[:, 1])[:, None]
+
+    M = primitive_matrices({'axes': flat[:, 0:3], 'scale': flat[:, 3] * LIBRARY_RADIUS, 'angles': flat[:, 7:10]})
+    points = np.zeros((batch_size, samples, 3), dtype=np.float32)
+    points[valid] = np.einsum('ni,nij->nj', unit, M[chosen]) + flat[chosen, 4:7]
+    return points, labels
+
+
+# Dataset of a loader worker process, opened once per process
+_worker_dataset = None
+
+
+def _open_worker_dataset(dataset_path):
+    global _worker_dataset
+    _worker_dataset = FitDataset(dataset_path)
+
+
+def _worker_batch(indices, samples, seed):
+    return _worker_dataset.batch(indices, samples, seed)
+
+
+class FitLoader:
+    """
+    Iterates over a FitDataset in batches prepared ahead of time by background workers.
+
+    Every epoch shuffles the objects with its own seed, and every batch draws its samples with a
+    seed derived from (seed, epoch, batch), so results do not depend on the number of workers or
+    the backend. Threads suit most cases, since the batch work is in NumPy; processes open the
+    dataset file once each and only exchange indices and finished batches.
+
+        loader = FitLoader(FitDataset('fits.npz'), batch_size=64, samples=2048, workers=4)
+        for batch in loader:
+            ...
+    """
+
+    def __init__(self, dataset, batch_size=64, shuffle=True, drop_last=False, samples=0, seed=0, workers=2,
+                 prefetch=2, backend='thread'):
+        """
+        :param dataset: FitDataset to iterate over.
+        :param batch_size: Objects per batch.
+        :param shuffle: Shuffle the objects every epoch.
+        :param drop_last: Leave out the last batch if it is smaller than batch_size.
+        :param samples: Surface points per object, see FitDataset.batch; 0 for parameters only.
+        :param seed: Seed of the shuffling and sampling.
+        :param workers: Number of worker threads or processes; 0 prepares batches on demand.
+        :param prefetch: Batches prepared ahead per worker.
+        :param backend: 'thread' or 'process'.
+        """
+        if backend not in ('thread', 'process'):
+            raise ValueError(f"Unknown backend {backend!r}, expected 'thread' or 'process'")
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.samples = samples
+        self.seed = seed
+        self.workers = workers
+        self.prefetch = prefetch
+        self.backend = backend
+        self.epoch = 0
+        self._executor = None
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.dataset) // self.batch_size
+        return -(-len(self.dataset) // self.batch_size)
+
+    def _executor_for_backend(self):
+        if self._executor is None and self.workers > 0:
+            if self.backend == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_open_worker_dataset,
+                                                     initargs=(self.dataset.dataset_path,))
+        return self._executor
+
+    def _submit(self, executor, indices, seed):
+        if self.backend == 'thread':
+            return executor.submit(self.dataset.batch, indices, self.samples, seed)
+        return executor.submit(_worker_batch, indices, self.samples, seed)
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        order = np.arange(len(self.dataset))
+        if self.shuffle:
+            np.random.default_rng([self.seed, epoch]).shuffle(order)
+        batches = [(order[start:start + self.batch_size], [self.seed, epoch, i])
+                   for i, start in enumerate(range(0, len(self.dataset), self.batch_size))]
+        if self.drop_last and batches and len(batches[-1][0]) < self.batch_size:
+            batches.pop()
+
+        executor = self._executor_for_backend()
+        if executor is None:
+            for indices, seed in batches:
+                yield self.dataset.batch(indices, self.samples, seed)
+            return
+
+        pending = deque()
+        batches = iter(batches)
+        for indices, seed in batches:
+            pending.append(self._submit(executor, indices, seed))
+            if len(pending) >= self.workers * self.prefetch:
+                break
+        while pending:
+            batch = pending.popleft().result()
+            for indices, seed in batches:
+                pending.append(self._submit(executor, indices, seed))
+                break
+            yield batch
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    dataset_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fits.npz'
+
+    pack_fit_dataset(fitting_info_directory, dataset_path)
+    with FitLoader(FitDataset(dataset_path), batch_size=64, samples=2048, workers=4) as loader:
+        start = time.perf_counter()
+        objects = sum(len(batch['params']) for batch in loader)
+        print(f"Loaded {objects} objects in {time.perf_counter() - start:.2f} s")
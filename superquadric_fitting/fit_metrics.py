@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import glob
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.spatial import cKDTree
+from scipy.ndimage import binary_dilation, binary_erosion, binary_fill_holes
+
+from reconstruct import load_point_cloud
+from superquadric_sampler import sample_primitive
+from superquadric_fitter import inside_outside
+from batch_transform import pack_fitting_info, transform_primitives
+from sdf_query import SuperquadricAssembly
+
+# Columns of the CSV report
+REPORT_FIELDS = ['file', 'object', 'primitives', 'chamfer', 'object_coverage', 'min_primitive_coverage',
+                 'primitive_coverage', 'iou', 'status']
+
+
+def object_occupancy(object_vertices, grid_shape, voxel_size, lower, spacing):
+    """
+    Approximates the solid occupied by an object from its surface cloud.
+
+    Surface voxels are dilated far enough to bridge the gaps between neighbouring points, the
+    enclosed interior is filled, and the result is eroded by the same amount to undo the dilation.
+
+    :param spacing: Typical distance between neighbouring object points.
+    :return: Boolean array of grid_shape, True for voxels inside the object.
+    """
+    keys = np.floor((object_vertices - lower) / voxel_size).astype(int)
+    keys = np.clip(keys, 0, np.array(grid_shape) - 1)
+    surface = np.zeros(grid_shape, dtype=bool)
+    surface[keys[:, 0], keys[:, 1], keys[:, 2]] = True
+
+    iterations = max(1, int(np.ceil(spacing / voxel_size)))
+    # Pad so that the dilation never touches the border, which would seal off the outside
+    surface = np.pad(surface, iterations + 1)
+    solid = binary_fill_holes(binary_dilation(surface, iterations=iterations))
+    solid = binary_erosion(solid, iterations=iterations)
+    return solid[tuple(slice(iterations + 1, -(iterations + 1)) for _ in range(3))]
+
+
+def volumetric_iou(object_vertices, fitting_info, resolution=64, spacing=0.0):
+    """
+    Intersection over union of the object solid and the union of the fitted superquadrics.
+
+    Both are evaluated on a voxel grid over their common bounding box: the fit through the
+    inside-outside function of each primitive, the object by filling its voxelized surface.
+
+    :param object_vertices: (N, 3) array of object surface points.
+    :param fitting_info: List of fitting info records.
+    :param resolution: Number of voxels along the longest side of the bounding box.
+    :param spacing: Typical distance between neighbouring object points, used to close the surface.
+    """
+    # Bound each primitive by the world-aligned box of its rotated |x| <= a box
+    assembly = SuperquadricAssembly(fitting_info)
+    params = assembly.params
+    lower = np.minimum(object_vertices.min(axis=0), assembly.lower.min(axis=0))
+    upper = np.maximum(object_vertices.max(axis=0), assembly.upper.max(axis=0))
+
+    voxel_size = (upper - lower).max() / resolution
+    grid_shape = tuple(np.ceil((upper - lower) / voxel_size).astype(int) + 1)
+    axes = [lower[i] + (np.arange(grid_shape[i]) + 0.5) * voxel_size for i in range(3)]
+    grid_points = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    inside_fit = np.zeros(len(grid_points), dtype=bool)
+    for p in params:
+        inside_fit |= inside_outside(grid_points, p) <= 1.0
+    inside_object = object_occupancy(object_vertices, grid_shape, voxel_size, lower, spacing).ravel()
+
+    union = np.count_nonzero(inside_fit | inside_object)
+    return np.count_nonzero(inside_fit & inside_object) / union if union else 0.0
+
+
+def fit_metrics(object_vertices, fitting_info, n_points=2000, threshold=0.005, resolution=64):
+    """
+    Compares a fitting with the object cloud it was fitted to.
+
+    :param object_vertices: (N, 3) array of object points.
+    :param fitting_info: List of fitting info records.
+    :param n_points: Surface samples per primitive.
+    :param threshold: Distance below which a point counts as covered.
+    :param resolution: Voxels along the longest side for the IoU.
+    :return: Dictionary with 'chamfer' (mean of both directions), 'object_coverage' (fraction of
+             object points within threshold of the fit), 'primitive_coverage' (per primitive,
+             fraction of its surface within threshold of the object) and 'iou'.
+    """
+    object_vertices = np.asarray(object_vertices, dtype=float)
+    object_tree = cKDTree(object_vertices)
+    # Largest gaps of the object surface, from the 8th nearest neighbours of a subset of its points
+    neighbours, _ = object_tree.query(object_vertices[::max(1, len(object_vertices) // 2000)], k=[8])
+    spacing = np.percentile(neighbours, 99)
+
+    vertices = [sample_primitive(info, n_points) for info in fitting_info]
+    points, labels = transform_primitives(vertices, pack_fitting_info(fitting_info))
+
+    fit_to_object, _ = object_tree.query(points)
+    object_to_fit, _ = cKDTree(points).query(object_vertices)
+    covered = fit_to_object <= threshold
+    primitive_coverage = np.bincount(labels, weights=covered, minlength=len(fitting_info)) / \
+        np.bincount(labels, minlength=len(fitting_info))
+
+    return {
+        'chamfer': float(0.5 * (fit_to_object.mean() + object_to_fit.mean())),
+        'object_coverage': float(np.mean(object_to_fit <= threshold)),
+        'primitive_coverage': [float(c) for c in primitive_coverage],
+        'iou': float(volumetric_iou(object_vertices, fitting_info, resolution, spacing)),
+    }
+
+
+def object_cloud_path(fitting_info_path, fitting_info, point_cloud_directory):
+    """
+    Locates the <id>_obj.ply cloud a fitting was made for.
+    """
+    if fitting_info and 'object' in fitting_info[0]:
+        object_id = fitting_info[0]['object']
+    else:
+        object_id = os.path.basename(fitting_info_path).split('_')[0]
+    return os.path.join(point_cloud_directory, f'{object_id}_obj.ply')
+
+
+def evaluate_fitting_file(fitting_info_path, point_cloud_directory, **kwargs):
+    """
+    Computes the metrics of one fitting info JSON; never raises, errors go to the 'status' field.
+    """
+    row = {'file': os.path.basename(fitting_info_path)}
+    try:
+        with open(fitting_info_path, 'r') as f:
+            fitting_info = json.load(f)
+        object_ply_path = object_cloud_path(fitting_info_path, fitting_info, point_cloud_directory)
+        row['object'] = os.path.basename(object_ply_path)
+        row['primitives'] = len(fitting_info)
+
+        metrics = fit_metrics(load_point_cloud(object_ply_path), fitting_info, **kwargs)
+    except Exception as e:
+        row['status'] = f'error: {e}'
+        return row
+
+    row.update(metrics)
+    row['min_primitive_coverage'] = min(metrics['primitive_coverage'])
+    row['primitive_coverage'] = ';'.join(f'{c:.3f}' for c in metrics['primitive_coverage'])
+    row['status'] = 'ok'
+    return row
+
+
+def _evaluate_job(job):
+    fitting_info_path, point_cloud_directory, kwargs = job
+    return evaluate_fitting_file(fitting_info_path, point_cloud_directory, **kwargs)
+
+
+def evaluate_directory(fitting_info_directory, point_cloud_directory, report_path,
+                       pattern='*_fitting_info*.json', num_workers=None, **kwargs):
+    """
+    Evaluates every fitting of a directory in a process pool and writes a CSV report.
+
+    Rows are sorted by Chamfer distance, worst first, followed by files that failed.
+
+    :return: List of report rows.
+    """
+    fitting_info_paths = sorted(glob.glob(os.path.join(fitting_info_directory, pattern)))
+    jobs = [(path, point_cloud_directory, kwargs) for path in fitting_info_paths]
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        rows = list(executor.map(_evaluate_job, jobs))
+
+    rows.sort(key=lambda row: -row['chamfer'] if row['status'] == 'ok' else np.inf)
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Evaluated {len(rows)} fittings, report saved to {report_path}")
+    return rows
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    point_cloud_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'
+    report_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/fit_metrics.csv'
+
+    evaluate_directory(fitting_info_directory, point_cloud_directory, report_path)
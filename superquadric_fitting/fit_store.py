@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import time
+import hashlib
+import sqlite3
+import numpy as np
+
+from batch_transform import PARAMETER_KEYS
+from superquadric_sampler import primitive_eps
+
+# Store file kept in the fitting info directory
+STORE_FILE = 'fitting_store.sqlite'
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS fits (
+    object TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    source TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (object, revision)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS fits_source ON fits (source);
+CREATE TABLE IF NOT EXISTS primitives (
+    object TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    primitive TEXT NOT NULL,
+    {', '.join(f'{key} REAL NOT NULL' for key in PARAMETER_KEYS)},
+    eps1 REAL,
+    eps2 REAL,
+    extra TEXT,
+    PRIMARY KEY (object, revision, position)
+);
+CREATE TABLE IF NOT EXISTS clouds (
+    object TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    sha1 TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    revision INTEGER NOT NULL
+);
+"""
+
+# Columns of the clouds table describing a point cloud file
+_CLOUD_COLUMNS = ('path', 'sha1', 'mtime_ns', 'size')
+
+# Record fields stored in their own columns; any other field goes to the 'extra' JSON column
+_COLUMNS = ('primitive',) + PARAMETER_KEYS + ('eps1', 'eps2')
+
+
+class FitStore:
+    """
+    Keeps every fitting of every object in one SQLite file, indexed by object ID and revision.
+
+    Saving appends a new revision of the object; loading returns the latest revision unless one
+    is given. Use as a context manager:
+
+        with FitStore(os.path.join(fitting_info_directory, STORE_FILE)) as store:
+            revision = store.save('8', fitting_info)
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        # Workers of a process pool may write concurrently; SQLite serializes them
+        self._connection = sqlite3.connect(store_path, timeout=60)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def save(self, object_id, fitting_info, source=None):
+        """
+        Appends a fitting as the next revision of an object.
+
+        :param object_id: Object ID, e.g. '8'.
+        :param fitting_info: List of fitting info records.
+        :param source: Optional label of where the fitting came from, e.g. the imported file name.
+                       Sources are unique, so importing the same file twice is a no-op.
+        :return: The new revision number, or the existing one if source was already stored.
+        """
+        object_id = str(object_id)
+        with self._connection:
+            # Take the write lock before reading the last revision, so concurrent saves get distinct ones
+            self._connection.execute('BEGIN IMMEDIATE')
+            if source is not None:
+                row = self._connection.execute('SELECT revision FROM fits WHERE source = ?', (source,)).fetchone()
+                if row is not None:
+                    return row[0]
+            row = self._connection.execute('SELECT MAX(revision) FROM fits WHERE object = ?', (object_id,)).fetchone()
+            revision = 0 if row[0] is None else row[0] + 1
+
+            self._connection.execute('INSERT INTO fits VALUES (?, ?, ?, ?)', (object_id, revision, source, time.time()))
+            rows = []
+            for position, info in enumerate(fitting_info):
+                extra = {key: value for key, value in info.items() if key not in _COLUMNS}
+                rows.append((object_id, revision, position) + tuple(info.get(key) for key in _COLUMNS)
+                            + (json.dumps(extra),))
+            self._connection.executemany(f"INSERT INTO primitives VALUES ({', '.join('?' * (len(_COLUMNS) + 4))})", rows)
+        return revision
+
+    def has_source(self, source):
+        return self._connection.execute('SELECT 1 FROM fits WHERE source = ?', (source,)).fetchone() is not None
+
+    def objects(self):
+        """
+        Returns the IDs of all stored objects.
+        """
+        return [row[0] for row in self._connection.execute('SELECT DISTINCT object FROM fits ORDER BY object')]
+
+    def revisions(self, object_id):
+        """
+        Returns (revision, source, created) tuples of an object, oldest first.
+        """
+        return self._connection.execute('SELECT revision, source, created FROM fits WHERE object = ? ORDER BY revision',
+                                        (str(object_id),)).fetchall()
+
+    def load(self, object_id, revision=None):
+        """
+        Loads one fitting in the fitting info record schema.
+
+        :param revision: Revision to load; the latest if None.
+        :return: List of fitting info records, or None if the object or revision is not stored.
+        """
+        object_id = str(object_id)
+        if revision is None:
+            revision = self._connection.execute('SELECT MAX(revision) FROM fits WHERE object = ?',
+                                                (object_id,)).fetchone()[0]
+            if revision is None:
+                return None
+        rows = self._connection.execute(f"SELECT {', '.join(_COLUMNS)}, extra FROM primitives "
+                                        'WHERE object = ? AND revision = ? ORDER BY position',
+                                        (object_id, revision)).fetchall()
+        if not rows and self._connection.execute('SELECT 1 FROM fits WHERE object = ? AND revision = ?',
+                                                 (object_id, revision)).fetchone() is None:
+            return None
+
+        fitting_info = []
+        for row in rows:
+            info = {key: value for key, value in zip(_COLUMNS, row[:-1]) if value is not None}
+            info.update(json.loads(row[-1]))
+            fitting_info.append(info)
+        return fitting_info
+
+    def cloud(self, object_id):
+        """
+        Returns the point cloud the latest recorded fitting of an object was made against.
+
+        :return: Dictionary with 'path', 'sha1', 'mtime_ns', 'size' and 'revision', or None.
+        """
+        row = self._connection.execute(f"SELECT {', '.join(_CLOUD_COLUMNS)}, revision FROM clouds WHERE object = ?",
+                                       (str(object_id),)).fetchone()
+        return None if row is None else dict(zip(_CLOUD_COLUMNS + ('revision',), row))
+
+    def record_cloud(self, object_id, entry, revision):
+        """
+        Records that a revision of an object was fitted to a point cloud, see cloud_entry.
+        """
+        with self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO clouds VALUES (?, ?, ?, ?, ?, ?)',
+                                     (str(object_id),) + tuple(entry[key] for key in _CLOUD_COLUMNS) + (revision,))
+
+    def load_arrays(self, object_ids=None):
+        """
+        Loads the primitives of the latest revision of many objects with one query, as flat arrays.
+
+        :param object_ids: Objects to load, in this order; all stored objects if None, in the
+                           order of objects().
+        :return: Dictionary with 'object', 'revision' and 'primitive' (K,) arrays, one float array
+                 per parameter key, 'eps' (K, 2), 'offsets' (number of objects + 1,), where the
+                 primitives of the i-th loaded object are offsets[i]:offsets[i + 1], and 'missing',
+                 the list of requested objects without a fitting, which are left out. The 'axes',
+                 'scale', 'translation' and 'angles' entries match pack_fitting_info, so the result
+                 can be passed to transform_primitives directly.
+        """
+        query = (f"SELECT p.object, p.revision, {', '.join('p.' + key for key in _COLUMNS)} FROM primitives p "
+                 'JOIN (SELECT object, MAX(revision) AS revision FROM fits GROUP BY object) latest '
+                 'ON p.object = latest.object AND p.revision = latest.revision')
+        arguments = ()
+        if object_ids is not None:
+            # Each requested object once, in the order of its first request
+            object_ids = list(dict.fromkeys(str(object_id) for object_id in object_ids))
+            arguments = tuple(object_ids)
+            query += f" WHERE p.object IN ({', '.join('?' * len(arguments))})"
+        rows = self._connection.execute(query + ' ORDER BY p.object, p.position', arguments).fetchall()
+
+        # Rows come grouped by object in text order; regroup them in the requested order
+        groups = {}
+        for i, row in enumerate(rows):
+            groups.setdefault(row[0], []).append(i)
+        missing = []
+        if object_ids is not None:
+            missing = [object_id for object_id in object_ids if object_id not in groups]
+            rows = [rows[i] for object_id in object_ids for i in groups.get(object_id, ())]
+            counts = [len(groups[object_id]) for object_id in object_ids if object_id in groups]
+        else:
+            counts = [len(indices) for indices in groups.values()]
+
+        columns = list(zip(*rows)) if rows else [()] * (len(_COLUMNS) + 2)
+        arrays = {'object': np.array(columns[0], dtype=str), 'revision': np.array(columns[1], dtype=np.int64),
+                  'primitive': np.array(columns[2], dtype=str), 'missing': missing}
+        for i, key in enumerate(PARAMETER_KEYS):
+            arrays[key] = np.array(columns[3 + i], dtype=float)
+        # Continuous exponents where stored, otherwise those of the library primitive
+        arrays['eps'] = np.array([(eps1, eps2) if eps1 is not None else primitive_eps({'primitive': primitive})
+                                  for primitive, eps1, eps2 in zip(columns[2], columns[-2], columns[-1])],
+                                 dtype=float).reshape(-1, 2)
+
+        arrays['offsets'] = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        arrays['axes'] = np.stack([arrays['a1'], arrays['a2'], arrays['a3']], axis=1)
+        arrays['translation'] = np.stack([arrays['tx'], arrays['ty'], arrays['tz']], axis=1)
+        arrays['angles'] = np.stack([arrays['roll'], arrays['pitch'], arrays['yaw']], axis=1)
+        return arrays
+
+
+def cloud_entry(cloud_path, previous=None):
+    """
+    Describes a point cloud file by its content hash.
+
+    :param previous: Entry of the same file from an earlier call or FitStore.cloud; its hash is
+                     reused without reading the file if mtime and size are unchanged.
+    :return: Dictionary with 'path', 'sha1', 'mtime_ns' and 'size'.
+    """
+    stat = os.stat(cloud_path)
+    if previous and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+        sha1 = previous['sha1']
+    else:
+        digest = hashlib.sha1()
+        with open(cloud_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        sha1 = digest.hexdigest()
+    return {'path': os.path.abspath(cloud_path), 'sha1': sha1, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def import_fitting_files(store, fitting_info_directory, pattern='*.json'):
+    """
+    Imports existing fitting info JSON files, e.g. 8_obj_fitting_info.json, 8_obj_fitting_info_01.json,
+    8_obj_fitting.json or 8_obj_fitting_info_true.json.
+
+    Files become revisions of their object in modification time order, with the file name as
+    source; files imported before are skipped, so the import can be rerun as files are added.
+    The object ID is taken from the 'object' field, or else from the file name prefix.
+
+    :param store: FitStore to import into.
+    :return: Number of newly imported files.
+    """
+    paths = sorted(glob.glob(os.path.join(fitting_info_directory, pattern)), key=lambda path: (os.path.getmtime(path), path))
+    imported = 0
+    for path in paths:
+        source = os.path.basename(path)
+        if store.has_source(source):
+            continue
+        try:
+            with open(path, 'r') as f:
+                fitting_info = json.load(f)
+            if not isinstance(fitting_info, list) or (fitting_info and 'primitive' not in fitting_info[0]):
+                continue
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+
+        if fitting_info and 'object' in fitting_info[0]:
+            object_id = fitting_info[0]['object']
+        else:
+            object_id = source.split('_')[0]
+        store.save(object_id, fitting_info, source=source)
+        imported += 1
+    print(f"Imported {imported} of {len(paths)} fitting info files into {store.store_path}")
+    return imported
+
+
+if __name__ == "__main__":
+    # Example usage path
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+
+    with FitStore(os.path.join(fitting_info_directory, STORE_FILE)) as store:
+        import_fitting_files(store, fitting_info_directory)
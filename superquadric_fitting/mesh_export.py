@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import os
+import json
+from functools import lru_cache
+import numpy as np
+
+from superquadric_sampler import LIBRARY_RADIUS, EPS_SHARP, primitive_eps
+from batch_transform import pack_fitting_info, transform_primitives
+from batch_reconstruct import find_fitting_files
+from ply_writer import write_ply
+
+# Longitude segments per primitive for each level of detail; latitude uses half as many
+LOD_RESOLUTIONS = {'low': 16, 'medium': 32, 'high': 64}
+
+# Colors of the primitives, as in reconstruct.py
+COLORS = np.array([
+    [255, 0, 0],  # Red
+    [0, 255, 0],  # Green
+    [0, 0, 255],  # Blue
+    [255, 255, 0],  # Yellow
+    [255, 0, 255],  # Magenta
+    [0, 255, 255]  # Cyan
+], dtype=np.uint8)
+
+
+def _signed_power(values, exponent):
+    return np.sign(values) * np.abs(values) ** exponent
+
+
+@lru_cache(maxsize=256)
+def unit_mesh(eps1, eps2, resolution):
+    """
+    Triangulates a superquadric with unit axes on a latitude/longitude grid.
+
+    The poles are single vertices and the longitude wraps around, so the mesh is closed. Vertices
+    are scaled by LIBRARY_RADIUS like the library primitives, so they take the same transformation.
+    Results are cached and read-only, and shared by every primitive with the same shape.
+
+    :param eps1: Exponent along the z-axis (latitude).
+    :param eps2: Exponent in the xy-plane (longitude).
+    :param resolution: Number of longitude segments; latitude gets resolution // 2.
+    :return: Tuple (vertices (V, 3) float array, faces (F, 3) int32 array), faces wound outwards.
+    """
+    eps1, eps2 = max(eps1, EPS_SHARP), max(eps2, EPS_SHARP)
+    n_lon = max(3, resolution)
+    n_lat = max(2, resolution // 2)
+
+    eta = np.pi / 2 - np.pi * np.arange(1, n_lat) / n_lat
+    omega = 2 * np.pi * np.arange(n_lon) / n_lon
+    cos_eta = _signed_power(np.cos(eta), eps1)[:, None]
+    ring = np.stack([cos_eta * _signed_power(np.cos(omega), eps2),
+                     cos_eta * _signed_power(np.sin(omega), eps2),
+                     np.repeat(_signed_power(np.sin(eta), eps1)[:, None], n_lon, axis=1)], axis=-1)
+    vertices = np.concatenate([[[0.0, 0.0, 1.0]], ring.reshape(-1, 3), [[0.0, 0.0, -1.0]]]) * LIBRARY_RADIUS
+
+    # Vertex index of ring r, longitude j; rings run from the north to the south pole
+    def index(r, j):
+        return 1 + r * n_lon + j % n_lon
+
+    j = np.arange(n_lon)
+    south = len(vertices) - 1
+    faces = [np.stack([np.zeros(n_lon, dtype=int), index(0, j), index(0, j + 1)], axis=1)]
+    for r in range(n_lat - 2):
+        faces.append(np.stack([index(r, j), index(r + 1, j), index(r + 1, j + 1)], axis=1))
+        faces.append(np.stack([index(r, j), index(r + 1, j + 1), index(r, j + 1)], axis=1))
+    faces.append(np.stack([index(n_lat - 2, j), np.full(n_lon, south), index(n_lat - 2, j + 1)], axis=1))
+    faces = np.concatenate(faces).astype(np.int32)
+
+    vertices.flags.writeable = False
+    faces.flags.writeable = False
+    return vertices, faces
+
+
+def fitting_mesh(fitting_info, resolution=LOD_RESOLUTIONS['medium']):
+    """
+    Builds one merged triangle mesh of every primitive of a fitting.
+
+    :param fitting_info: List of fitting info records.
+    :param resolution: Longitude segments per primitive, see LOD_RESOLUTIONS.
+    :return: Tuple (vertices (V, 3), faces (F, 3), labels (V,)) where labels holds the index of
+             the primitive every vertex belongs to.
+    """
+    meshes = [unit_mesh(*primitive_eps(info), resolution) for info in fitting_info]
+    vertices, labels = transform_primitives([mesh[0] for mesh in meshes], pack_fitting_info(fitting_info))
+
+    offsets = np.cumsum([0] + [len(mesh[0]) for mesh in meshes[:-1]])
+    faces = np.concatenate([mesh[1] + offset for mesh, offset in zip(meshes, offsets)]) if meshes \
+        else np.empty((0, 3), dtype=np.int32)
+    return vertices, faces, labels
+
+
+def write_obj(file_path, vertices, faces):
+    """
+    Writes a triangle mesh to a Wavefront .obj file.
+    """
+    with open(file_path, 'w') as f:
+        np.savetxt(f, vertices, fmt='v %.9g %.9g %.9g')
+        np.savetxt(f, faces + 1, fmt='f %d %d %d')
+
+
+def export_mesh(fitting_info, output_path, resolution=LOD_RESOLUTIONS['medium'], binary=True):
+    """
+    Saves the merged mesh of a fitting as .ply (colored per primitive) or .obj, by file extension.
+
+    :param binary: Write binary little-endian PLY; set to False for ASCII output.
+    :return: Tuple (number of vertices, number of faces).
+    """
+    vertices, faces, labels = fitting_mesh(fitting_info, resolution)
+    if output_path.endswith('.obj'):
+        write_obj(output_path, vertices, faces)
+    else:
+        write_ply(output_path, vertices, COLORS[labels % len(COLORS)], faces, binary=binary)
+    return len(vertices), len(faces)
+
+
+def export_fitting_file(fitting_info_path, output_directory, resolution=LOD_RESOLUTIONS['medium'],
+                        file_format='ply', binary=True):
+    """
+    Exports the mesh of one fitting info JSON, e.g. 8_obj_fitting_info.json to 8_obj_mesh.ply.
+
+    :return: Path of the written mesh.
+    """
+    with open(fitting_info_path, 'r') as f:
+        fitting_info = json.load(f)
+    stem = os.path.splitext(os.path.basename(fitting_info_path))[0]
+    output_path = os.path.join(output_directory, f"{stem.replace('_fitting_info', '_mesh')}.{file_format}")
+    num_vertices, num_faces = export_mesh(fitting_info, output_path, resolution, binary)
+    print(f"Saved {num_vertices} vertices, {num_faces} faces to {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    output_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/mesh_lib'
+
+    os.makedirs(output_directory, exist_ok=True)
+    for fitting_info_path in find_fitting_files(fitting_info_directory):
+        export_fitting_file(fitting_info_path, output_directory, LOD_RESOLUTIONS['medium'])
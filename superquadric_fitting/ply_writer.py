@@ -0,0 +1,144 @@
+import numpy as np
+from plyfile import PlyData, PlyElement
+
+from profiling import traced
+
+# Vertex layouts of the point clouds written by this project
+VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+COLORED_VERTEX_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                                 ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')])
+NORMAL_FIELDS = [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+FACE_DTYPE = np.dtype([('count', 'u1'), ('vertex_indices', '<i4', (3,))])
+
+# Width of the zero-padded vertex count, so a streamed header can be patched in place
+COUNT_WIDTH = 12
+
+
+def _header(vertex_dtype, vertex_count, face_count=0, count_width=None, binary=True):
+    count = str(vertex_count).zfill(count_width) if count_width else str(vertex_count)
+    encoding = 'binary_little_endian' if binary else 'ascii'
+    lines = ['ply', f'format {encoding} 1.0', f'element vertex {count}']
+    for name in vertex_dtype.names:
+        lines.append(f"property {'float' if vertex_dtype[name].kind == 'f' else 'uchar'} {name}")
+    if face_count:
+        lines += [f'element face {face_count}', 'property list uchar int vertex_indices']
+    lines.append('end_header')
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+
+def fill_vertices(out, points, color=None, normals=None):
+    """
+    Fills a structured vertex array in place from an (N, 3) array and an optional RGB color.
+
+    :param out: Structured array of VERTEX_DTYPE or COLORED_VERTEX_DTYPE with N entries, with the
+                NORMAL_FIELDS after the coordinates if normals are given.
+    :param points: (N, 3) array of coordinates.
+    :param color: RGB triple applied to every vertex, or an (N, 3) array of per-vertex colors.
+    :param normals: Optional (N, 3) array of normals.
+    """
+    out['x'] = points[:, 0]
+    out['y'] = points[:, 1]
+    out['z'] = points[:, 2]
+    if normals is not None:
+        out['nx'] = normals[:, 0]
+        out['ny'] = normals[:, 1]
+        out['nz'] = normals[:, 2]
+    if color is not None:
+        color = np.asarray(color)
+        if color.ndim == 1:
+            out['red'], out['green'], out['blue'] = color
+        else:
+            out['red'] = color[:, 0]
+            out['green'] = color[:, 1]
+            out['blue'] = color[:, 2]
+    elif 'red' in out.dtype.names:
+        out['red'] = out['green'] = out['blue'] = 0
+
+
+@traced('write_ply', written='file_path', points='points')
+def write_ply(file_path, points, colors=None, faces=None, binary=True, normals=None):
+    """
+    Writes a point cloud, optionally with colors and triangle faces, to a .ply file.
+
+    :param file_path: Path of the .ply file to write.
+    :param points: (N, 3) array of vertex coordinates.
+    :param colors: Optional (N, 3) array of uint8 RGB colors.
+    :param faces: Optional (M, 3) array of triangle vertex indices.
+    :param binary: Write binary little-endian PLY; set to False for ASCII output.
+    :param normals: Optional (N, 3) array of normals, written as the nx, ny, nz vertex properties.
+    """
+    vertex_dtype = VERTEX_DTYPE if colors is None else COLORED_VERTEX_DTYPE
+    if normals is not None:
+        vertex_dtype = np.dtype(vertex_dtype.descr[:3] + NORMAL_FIELDS + vertex_dtype.descr[3:])
+    vertices = np.empty(len(points), dtype=vertex_dtype)
+    fill_vertices(vertices, points, colors, normals)
+
+    face_array = None
+    if faces is not None and len(faces):
+        face_array = np.empty(len(faces), dtype=FACE_DTYPE)
+        face_array['count'] = 3
+        face_array['vertex_indices'] = faces
+
+    if not binary:
+        elements = [PlyElement.describe(vertices, 'vertex')]
+        if face_array is not None:
+            faces_list = np.empty(len(faces), dtype=[('vertex_indices', 'O')])
+            faces_list['vertex_indices'] = list(np.asarray(faces, dtype=np.int32))
+            elements.append(PlyElement.describe(faces_list, 'face'))
+        PlyData(elements, text=True).write(file_path)
+        return
+
+    with open(file_path, 'wb') as f:
+        f.write(_header(vertex_dtype, len(vertices), 0 if face_array is None else len(face_array)))
+        vertices.tofile(f)
+        if face_array is not None:
+            face_array.tofile(f)
+
+
+class PlyStreamWriter:
+    """
+    Writes a point cloud .ply incrementally, one block of points at a time.
+
+    The vertex count in the header is patched when the writer is closed, so the total number of
+    points does not need to be known up front. Use as a context manager:
+
+        with PlyStreamWriter(path, colored=True) as writer:
+            writer.write(points, color=[255, 0, 0])
+    """
+
+    def __init__(self, file_path, colored=False, binary=True):
+        self.file_path = file_path
+        self.vertex_dtype = COLORED_VERTEX_DTYPE if colored else VERTEX_DTYPE
+        self.binary = binary
+        self.vertex_count = 0
+        self._buffer = np.empty(0, dtype=self.vertex_dtype)
+        self._file = open(file_path, 'wb')
+        self._file.write(_header(self.vertex_dtype, 0, count_width=COUNT_WIDTH, binary=binary))
+
+    def write(self, points, color=None):
+        """
+        Appends points, with an RGB triple or (N, 3) colors if the writer is colored.
+        """
+        count = len(points)
+        if count > len(self._buffer):
+            self._buffer = np.empty(count, dtype=self.vertex_dtype)
+        block = self._buffer[:count]
+        fill_vertices(block, points, color)
+        if self.binary:
+            block.tofile(self._file)
+        else:
+            np.savetxt(self._file, block, fmt=['%.9g'] * 3 + ['%d'] * (len(self.vertex_dtype) - 3))
+        self.vertex_count += count
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._file.write(_header(self.vertex_dtype, self.vertex_count, count_width=COUNT_WIDTH, binary=self.binary))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
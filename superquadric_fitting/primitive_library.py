@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import numpy as np
+from plyfile import PlyData
+
+# Cache files written into the library directory
+CACHE_POINTS_FILE = '.primitive_cache.npy'
+CACHE_INDEX_FILE = '.primitive_cache.json'
+
+# Loaded libraries, keyed by real path of the library directory: (index, library, mtime_ns of the
+# directory when the library was last checked against its files)
+_loaded_libraries = {}
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _library_files(superquadric_library_path):
+    return sorted(f for f in os.listdir(superquadric_library_path) if f.endswith('.ply'))
+
+
+def read_ply_vertices(file_path):
+    """
+    Reads only the x, y and z vertex properties of a .ply file, ignoring colors and faces.
+
+    :return: (N, 3) float32 array.
+    """
+    vertex = PlyData.read(file_path)['vertex']
+    return np.stack([vertex['x'], vertex['y'], vertex['z']], axis=1).astype(np.float32)
+
+
+def _is_stale(superquadric_library_path, index):
+    """
+    Checks the manifest of a cache against the PLY files currently in the library.
+
+    Files whose mtime or size changed are re-hashed, so touching a file without changing its
+    content does not force a rebuild. Returns True if the cache has to be rebuilt.
+    """
+    manifest = index['manifest']
+    files = _library_files(superquadric_library_path)
+    if files != sorted(manifest):
+        return True
+
+    for filename in files:
+        entry = manifest[filename]
+        stat = os.stat(os.path.join(superquadric_library_path, filename))
+        if stat.st_mtime_ns == entry['mtime_ns'] and stat.st_size == entry['size']:
+            continue
+        if _file_hash(os.path.join(superquadric_library_path, filename)) != entry['sha1']:
+            return True
+        entry['mtime_ns'] = stat.st_mtime_ns
+    return False
+
+
+def build_library_cache(superquadric_library_path):
+    """
+    Packs every .ply file of a primitive library into one contiguous float32 array.
+
+    Writes CACHE_POINTS_FILE, holding all points back to back, and CACHE_INDEX_FILE, holding the
+    offset and count of every primitive, the mtime/size/hash manifest of its source file and the
+    mtime/size of the points file it belongs to. The index is published last, so an interrupted
+    build leaves an index that no longer matches the points file, see load_library.
+
+    :param superquadric_library_path: Directory containing the primitive .ply files.
+    :return: The index dictionary.
+    """
+    files = _library_files(superquadric_library_path)
+    vertices_list = []
+    primitives = {}
+    manifest = {}
+    offset = 0
+
+    for filename in files:
+        file_path = os.path.join(superquadric_library_path, filename)
+        vertices = read_ply_vertices(file_path)
+        vertices_list.append(vertices)
+        primitives[filename] = [offset, vertices.shape[0]]
+        offset += vertices.shape[0]
+
+        stat = os.stat(file_path)
+        manifest[filename] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': _file_hash(file_path)}
+
+    points = np.concatenate(vertices_list) if vertices_list else np.empty((0, 3), dtype=np.float32)
+
+    # Write to temporary files first so that concurrent readers never see a partial cache; renaming
+    # keeps the mtime, so the index can record the points file before it is in place
+    points_path = os.path.join(superquadric_library_path, CACHE_POINTS_FILE)
+    index_path = os.path.join(superquadric_library_path, CACHE_INDEX_FILE)
+    pid = os.getpid()
+    with open(f'{points_path}.{pid}.tmp', 'wb') as f:
+        np.save(f, points)
+    stat = os.stat(f'{points_path}.{pid}.tmp')
+    index = {'primitives': primitives, 'manifest': manifest,
+             'points': {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}}
+    with open(f'{index_path}.{pid}.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(f'{points_path}.{pid}.tmp', points_path)
+    os.replace(f'{index_path}.{pid}.tmp', index_path)
+
+    print(f"Cached {len(files)} primitives ({offset} points) from {superquadric_library_path}")
+    return index
+
+
+def _matches_points_file(index, points_path):
+    # Indexes from before the points file was recorded never match, and are rebuilt once
+    stat = os.stat(points_path)
+    return index.get('points') == {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def load_library(superquadric_library_path):
+    """
+    Loads a primitive library through its binary cache, building or rebuilding the cache if needed.
+
+    Within a process, the library files are only checked again when the directory's mtime
+    changed, i.e. files were added, removed or replaced by renaming; a file rewritten in place
+    is noticed by the next process.
+
+    :param superquadric_library_path: Directory containing the primitive .ply files.
+    :return: Dictionary mapping primitive file names to read-only (N, 3) float32 views into the
+             memory-mapped cache.
+    """
+    key = os.path.realpath(superquadric_library_path)
+    index_path = os.path.join(superquadric_library_path, CACHE_INDEX_FILE)
+    points_path = os.path.join(superquadric_library_path, CACHE_POINTS_FILE)
+
+    directory_mtime = os.stat(superquadric_library_path).st_mtime_ns
+    loaded = _loaded_libraries.get(key)
+    if loaded is not None and loaded[2] == directory_mtime:
+        return loaded[1]
+    if loaded is not None and not _is_stale(superquadric_library_path, loaded[0]):
+        _loaded_libraries[key] = (loaded[0], loaded[1], directory_mtime)
+        return loaded[1]
+
+    index = None
+    if os.path.exists(index_path) and os.path.exists(points_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if not _matches_points_file(index, points_path) or _is_stale(superquadric_library_path, index):
+            index = None
+    if index is None:
+        index = build_library_cache(superquadric_library_path)
+
+    points = np.load(points_path, mmap_mode='r')
+    library = {name: points[offset:offset + count] for name, (offset, count) in index['primitives'].items()}
+    # Taken after a build, whose own cache files change the directory
+    _loaded_libraries[key] = (index, library, os.stat(superquadric_library_path).st_mtime_ns)
+    return library
+
+
+def library_manifest(superquadric_library_path):
+    """
+    Returns the SHA-1 of every .ply file of a library, as recorded by its up-to-date cache.
+
+    :return: Dictionary mapping primitive file names to hex digests.
+    """
+    load_library(superquadric_library_path)
+    index = _loaded_libraries[os.path.realpath(superquadric_library_path)][0]
+    return {name: entry['sha1'] for name, entry in index['manifest'].items()}
+
+
+def load_library_primitive(superquadric_library_path, primitive):
+    """
+    Returns the points of a single library primitive as a zero-copy view into the cache.
+
+    :param superquadric_library_path: Directory containing the primitive .ply files.
+    :param primitive: Primitive file name, e.g. '0.5_1.0.ply'.
+    """
+    library = load_library(superquadric_library_path)
+    if primitive not in library:
+        raise FileNotFoundError(f"File not found: {os.path.join(superquadric_library_path, primitive)}")
+    return library[primitive]
+
+
+if __name__ == "__main__":
+    # Build the cache once ahead of batch jobs
+    superquadric_library_path = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+    build_library_cache(superquadric_library_path)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import inspect
+import resource
+import functools
+import threading
+import multiprocessing
+
+# Set to a trace file path to profile a run, e.g. SQ_PROFILE=trace.json python reconstruct.py
+PROFILE_ENV = 'SQ_PROFILE'
+
+# Trace file of the current run, or None while profiling is disabled
+_trace_path = None
+
+
+def enable(trace_path):
+    """
+    Turns profiling on for this process and its worker processes.
+
+    At exit, the process that enabled profiling merges the stages recorded by all processes into
+    a Chrome trace at trace_path (open it in chrome://tracing or Perfetto) and prints a summary.
+    Setting the SQ_PROFILE environment variable has the same effect.
+    """
+    global _trace_path
+    _trace_path = os.path.abspath(trace_path)
+    # Worker processes, forked or spawned, pick profiling up from the environment
+    os.environ[PROFILE_ENV] = _trace_path
+    for part in glob.glob(f'{_trace_path}.*.part'):
+        os.remove(part)
+    atexit.register(_write_trace, os.getpid())
+
+
+def _peak_rss():
+    # Peak resident set size in bytes; ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _size(value):
+    # Tuple results, e.g. (points, labels), are counted by their first element
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    try:
+        return len(value) if hasattr(value, '__len__') else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _file_size(path):
+    # Lists of paths, or of tuples starting with a path, are summed
+    if isinstance(path, (list, tuple)):
+        sizes = [_file_size(item[0] if isinstance(item, (list, tuple)) else item) for item in path]
+        return sum(size for size in sizes if size is not None)
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+def traced(stage, read=None, written=None, points=None):
+    """
+    Decorates a pipeline stage so that every call is recorded while profiling is enabled.
+
+    A disabled stage costs one global lookup per call. Each recorded call stores its wall time,
+    the peak resident memory of the process after the call, and optionally:
+
+    :param stage: Name of the stage in the trace and summary.
+    :param read: Name of the argument holding the path of the file read; its size is recorded.
+    :param written: Name of the argument holding the path of the file written. For this and read,
+                    the argument may also hold a list of paths, or of tuples starting with a
+                    path, whose sizes are summed.
+    :param points: 'result' to count the length (or value) of the return value, or of its first
+                   element if it is a tuple, or the name of an argument whose length is the
+                   number of points handled.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            duration = time.perf_counter() - start
+
+            arguments = signature.bind(*args, **kwargs).arguments
+            event = {'name': stage, 'ph': 'X', 'ts': (time.time() - duration) * 1e6, 'dur': duration * 1e6,
+                     'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {'peak_rss': _peak_rss()}}
+            if read is not None:
+                event['args']['bytes_read'] = _file_size(arguments.get(read))
+            if written is not None:
+                event['args']['bytes_written'] = _file_size(arguments.get(written))
+            if points is not None:
+                event['args']['points'] = _size(result if points == 'result' else arguments.get(points))
+            _record(event)
+            return result
+        return wrapper
+    return decorator
+
+
+def _record(event):
+    # Every process appends to its own part file, since pool workers exit without running atexit
+    with open(f'{_trace_path}.{os.getpid()}.part', 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+
+def _write_trace(owner_pid):
+    if os.getpid() != owner_pid:
+        return
+    events = []
+    for part in sorted(glob.glob(f'{_trace_path}.*.part')):
+        with open(part, 'r') as f:
+            events.extend(json.loads(line) for line in f if line.strip())
+        os.remove(part)
+    with open(_trace_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    print_summary(events)
+    print(f"Trace with {len(events)} events saved to {_trace_path}")
+
+
+def print_summary(events):
+    """
+    Prints calls, time, points, bytes and peak memory per stage.
+    """
+    stages = {}
+    for event in events:
+        stage = stages.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'points': 0, 'read': 0,
+                                                  'written': 0, 'peak_rss': 0})
+        args = event['args']
+        stage['calls'] += 1
+        stage['seconds'] += event['dur'] / 1e6
+        stage['points'] += args.get('points') or 0
+        stage['read'] += args.get('bytes_read') or 0
+        stage['written'] += args.get('bytes_written') or 0
+        stage['peak_rss'] = max(stage['peak_rss'], args['peak_rss'])
+
+    print(f"{'stage':<28} {'calls':>7} {'total s':>9} {'mean ms':>9} {'points':>12} {'MB read':>9} "
+          f"{'MB written':>10} {'peak MB':>8}")
+    for name, stage in sorted(stages.items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name:<28} {stage['calls']:>7} {stage['seconds']:>9.3f} {1000 * stage['seconds'] / stage['calls']:>9.2f} "
+              f"{stage['points']:>12} {stage['read'] / 1e6:>9.2f} {stage['written'] / 1e6:>10.2f} "
+              f"{stage['peak_rss'] / 1e6:>8.1f}")
+
+
+if os.environ.get(PROFILE_ENV):
+    if multiprocessing.parent_process() is None:
+        enable(os.environ[PROFILE_ENV])
+    else:
+        _trace_path = os.environ[PROFILE_ENV]
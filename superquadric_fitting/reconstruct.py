@@ -1,19 +1,40 @@
 #!/usr/bin/env python3
 
 import os
-import json
 import numpy as np
-import trimesh
-from plyfile import PlyData, PlyElement
+from plyfile import PlyData
+from superquadric_sampler import sample_primitive
+from primitive_library import load_library_primitive
+from ply_writer import PlyStreamWriter
+from batch_transform import pack_fitting_info, transform_primitives
+from fit_store import STORE_FILE, FitStore
+from profiling import traced
 
 
+@traced('load_point_cloud', read='file_path', points='result')
 def load_point_cloud(file_path):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
-    mesh = trimesh.load_mesh(file_path)
+    # Imported here, since trimesh takes about half a second to import and only loading needs it
+    import trimesh
+
+    # trimesh.load returns a PointCloud for face-less PLY files, load_mesh an empty Trimesh
+    mesh = trimesh.load(file_path)
     return mesh.vertices
 
 
+def load_point_normals(file_path):
+    """
+    Loads the per-point normals of a .ply point cloud, e.g. from surface sampling in convert_obj_to_ply.
+
+    :return: (N, 3) array of normals in vertex order, or None if the file has none.
+    """
+    vertex = PlyData.read(file_path)['vertex']
+    if not {'nx', 'ny', 'nz'} <= set(vertex.data.dtype.names):
+        return None
+    return np.column_stack([vertex['nx'], vertex['ny'], vertex['nz']]).astype(float)
+
+
 def rotation_matrix(roll, pitch, yaw):
     R_x = np.array([[1, 0, 0],
                     [0, np.cos(roll), -np.sin(roll)],
@@ -36,79 +57,94 @@ def apply_transformation(vertices, info):
     return transformed_vertices
 
 
-def reconstruct_shape(fitting_info, superquadric_library_path, output_ply_path):
-    print("Starting shape reconstruction...")
-
-    all_points = []
-    all_colors = []
+def load_primitive(info, superquadric_library_path=None):
+    """
+    Returns the untransformed primitive points of a fitting info record.
+
+    :param info: Fitting info record.
+    :param superquadric_library_path: Directory of the baked PLY library, read through its binary
+                                      cache. If None, the primitive is sampled analytically from its
+                                      shape exponents instead.
+    """
+    if superquadric_library_path is None:
+        return sample_primitive(info)
+    return load_library_primitive(superquadric_library_path, info['primitive'])
+
+
+@traced('reconstruct_shape', written='output_ply_path', points='result')
+def reconstruct_shape(fitting_info, superquadric_library_path, output_ply_path, binary=True, verbose=True,
+                      library_scale_factor=1):
+    """
+    Transforms every primitive of a fitting into place and saves the combined, colored point cloud.
+
+    All primitives are transformed by one batched kernel and written as a single binary block.
+
+    :param fitting_info: List of fitting info records.
+    :param superquadric_library_path: Directory of the baked PLY library, or None to sample the
+                                      primitives analytically.
+    :param output_ply_path: Path of the .ply file to write.
+    :param binary: Write binary little-endian PLY; set to False for ASCII output.
+    :param verbose: Print progress messages; errors are always printed.
+    :param library_scale_factor: Factor the library coordinates are divided by, e.g. 10 to use the
+                                 unit superquadric_library in place of superquadric_lib_rescale.
+                                 It is folded into the batched transform, so the memory-mapped
+                                 library is used as it is and no rescaled copy is made.
+    :return: Number of points written, or None if the file could not be saved.
+    """
+    if verbose:
+        print("Starting shape reconstruction...")
 
     # Define some distinct colors for the primitives
-    colors = [
+    colors = np.array([
         [255, 0, 0],  # Red
         [0, 255, 0],  # Green
         [0, 0, 255],  # Blue
         [255, 255, 0],  # Yellow
         [255, 0, 255],  # Magenta
         [0, 255, 255]  # Cyan
-    ]
+    ], dtype=np.uint8)
 
+    vertices = []
+    indices = []
     for i, info in enumerate(fitting_info):
         primitive = info['primitive']
-        superquadric_path = os.path.join(superquadric_library_path, primitive)
-        print(f"Processing primitive: {primitive}")
+        if verbose:
+            print(f"Processing primitive: {primitive}")
 
         try:
-            vertices = load_point_cloud(superquadric_path)
+            vertices.append(load_primitive(info, superquadric_library_path))
+            indices.append(i)
         except FileNotFoundError as e:
             print(f"Error: {e}. Skipping this primitive.")
-            continue
-
-        transformed_vertices = apply_transformation(vertices, info)
 
-        color = colors[i % len(colors)]  # Assign a color to each primitive
-        colors_for_primitive = np.tile(color, (transformed_vertices.shape[0], 1))
-
-        all_points.append(transformed_vertices)
-        all_colors.append(colors_for_primitive)
-
-    # Combine all points and colors
-    all_points = np.vstack(all_points)
-    all_colors = np.vstack(all_colors)
-
-    vertices_with_color = np.empty(all_points.shape[0],
-                                   dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('red', 'u1'), ('green', 'u1'),
-                                          ('blue', 'u1')])
-    vertices_with_color['x'] = all_points[:, 0]
-    vertices_with_color['y'] = all_points[:, 1]
-    vertices_with_color['z'] = all_points[:, 2]
-    vertices_with_color['red'] = all_colors[:, 0]
-    vertices_with_color['green'] = all_colors[:, 1]
-    vertices_with_color['blue'] = all_colors[:, 2]
-
-    # Save to .ply
     try:
-        ply_element = PlyElement.describe(vertices_with_color, 'vertex')
-        PlyData([ply_element], text=True).write(output_ply_path)
-        print(f"Reconstructed shape successfully saved to: {output_ply_path}")
+        # Transform all primitives in one pass, then assign a color to each primitive
+        params = pack_fitting_info([fitting_info[i] for i in indices])
+        if superquadric_library_path is not None:
+            params['scale'] /= library_scale_factor
+        points, labels = transform_primitives(vertices, params)
+        with PlyStreamWriter(output_ply_path, colored=True, binary=binary) as writer:
+            writer.write(points, colors[np.asarray(indices, dtype=int)[labels] % len(colors)])
+        if verbose:
+            print(f"Reconstructed shape successfully saved to: {output_ply_path}")
+        return writer.vertex_count
     except Exception as e:
         print(f"Failed to save .ply file: {e}")
+        return None
 
 
 if __name__ == "__main__":
     # Example usage paths
-    fitting_info_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting/8_obj_fitting_info.json'
-    superquadric_library_path = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    object_id = '8'
+    superquadric_library_path = None  # Sample primitives analytically; or the superquadric_lib_rescale path
     output_ply_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/reconstruct_lib/8_reconstruct.ply'
 
-    # Load the fitting information
-    try:
-        with open(fitting_info_path, 'r') as f:
-            fitting_info = json.load(f)
-    except FileNotFoundError:
-        print(f"Error: Fitting info file not found at: {fitting_info_path}")
-        exit(1)
-    except json.JSONDecodeError:
-        print(f"Error: Failed to decode JSON from: {fitting_info_path}")
+    # Load the latest fitting of the object from the fit store
+    with FitStore(os.path.join(fitting_info_directory, STORE_FILE)) as store:
+        fitting_info = store.load(object_id)
+    if fitting_info is None:
+        print(f"Error: No fitting of object {object_id} in {fitting_info_directory}")
         exit(1)
 
     # Perform the reconstruction
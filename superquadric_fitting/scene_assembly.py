@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import json
+import time
+import numpy as np
+
+from batch_transform import pack_fitting_info, rotation_matrices, rotation_angles, transform_primitives
+from superquadric_sampler import primitive_eps, sample_primitive
+from primitive_library import load_library_primitive
+from fit_store import STORE_FILE, FitStore
+from ply_writer import write_ply
+
+# Colors of the object instances in a scene cloud, as in reconstruct.py
+COLORS = np.array([
+    [255, 0, 0],  # Red
+    [0, 255, 0],  # Green
+    [0, 0, 255],  # Blue
+    [255, 255, 0],  # Yellow
+    [255, 0, 255],  # Magenta
+    [0, 255, 255]  # Cyan
+], dtype=np.uint8)
+
+
+class SceneAssembler:
+    """
+    Places the fitted primitives of every object of a scene with the object poses of its
+    scene_gt.json, in camera coordinates.
+
+    The primitives of an object are loaded the first time the object appears and kept in flat
+    arrays shared by all scenes, so that after warm-up a scene costs one JSON parse and one
+    batched matrix pass, whatever the number of views and objects.
+
+        assembler = SceneAssembler(fitting_info_directory, translation_unit=0.001)
+        assembly = assembler.assemble_scene('scene_0001/scene_gt.json')
+    """
+
+    def __init__(self, fitting_source, translation_unit=1.0):
+        """
+        :param fitting_source: Fit store file, or a directory holding a fit store or
+                               <obj_id>_obj_fitting_info.json files.
+        :param translation_unit: Factor converting cam_t_m2c to the units of the fittings, e.g.
+                                 0.001 for translations in millimeters and fittings in meters.
+        """
+        self.translation_unit = translation_unit
+        self.store_path = None
+        self.fitting_info_directory = None
+        if os.path.isdir(fitting_source):
+            store_path = os.path.join(fitting_source, STORE_FILE)
+            if os.path.exists(store_path):
+                self.store_path = store_path
+            else:
+                self.fitting_info_directory = fitting_source
+        else:
+            self.store_path = fitting_source
+
+        # Slot of every loaded object, and the per-slot parameter arrays before concatenation
+        self._slots = {}
+        self._parts = []
+        self._counts = np.empty(0, dtype=np.int64)
+        self._offsets = np.empty(0, dtype=np.int64)
+        self._flat = None
+
+    def _object_parts(self, object_ids):
+        """
+        Loads the primitives of objects, as parameter arrays plus 'eps' and 'primitive'.
+        """
+        if self.store_path is not None:
+            with FitStore(self.store_path) as store:
+                arrays = store.load_arrays(object_ids)
+            parts = {}
+            for i, object_id in enumerate(arrays['object'][arrays['offsets'][:-1]]):
+                rows = slice(arrays['offsets'][i], arrays['offsets'][i + 1])
+                parts[object_id] = {key: arrays[key][rows] for key in
+                                    ('axes', 'scale', 'translation', 'angles', 'eps', 'primitive')}
+            return [parts.get(object_id) for object_id in object_ids]
+
+        parts = []
+        for object_id in object_ids:
+            fitting_info_path = os.path.join(self.fitting_info_directory, f'{object_id}_obj_fitting_info.json')
+            if not os.path.exists(fitting_info_path):
+                parts.append(None)
+                continue
+            with open(fitting_info_path, 'r') as f:
+                fitting_info = json.load(f)
+            part = pack_fitting_info(fitting_info)
+            part['eps'] = np.array([primitive_eps(info) for info in fitting_info], dtype=float).reshape(-1, 2)
+            part['primitive'] = np.array([info['primitive'] for info in fitting_info], dtype=str)
+            parts.append(part)
+        return parts
+
+    def _load(self, object_ids):
+        missing = [object_id for object_id in object_ids if object_id not in self._slots]
+        if not missing:
+            return
+        for object_id, part in zip(missing, self._object_parts(missing)):
+            if part is None:
+                print(f"Warning: no fitting of object {object_id}, it is left out of the scenes")
+                part = {'axes': np.empty((0, 3)), 'scale': np.empty(0), 'translation': np.empty((0, 3)),
+                        'angles': np.empty((0, 3)), 'eps': np.empty((0, 2)), 'primitive': np.empty(0, dtype=str)}
+            self._slots[object_id] = len(self._parts)
+            self._parts.append(part)
+
+        self._counts = np.array([len(part['scale']) for part in self._parts], dtype=np.int64)
+        self._offsets = np.cumsum(self._counts) - self._counts
+        self._flat = {key: np.concatenate([part[key] for part in self._parts])
+                      for key in ('axes', 'scale', 'translation', 'eps', 'primitive')}
+        angles = np.concatenate([part['angles'] for part in self._parts])
+        self._flat['rotation'] = rotation_matrices(*angles.T)
+
+    def assemble_views(self, views):
+        """
+        Places the primitives of every object instance of several views in one batched pass.
+
+        :param views: Dictionary mapping view IDs to lists of scene_gt entries, each with 'obj_id',
+                      'cam_R_m2c' (9 values, row-major) and 'cam_t_m2c' (3 values).
+        :return: Dictionary of primitive arrays in camera coordinates, all views back to back:
+                 'axes' (K, 3), 'scale' (K,), 'translation' (K, 3), 'angles' (K, 3) and
+                 'rotation' (K, 3, 3) matrices, 'eps' (K, 2), 'primitive' (K,) file names,
+                 'object' (K,) object IDs and 'instance' (K,) entry index within the view. The
+                 primitives of view i are offsets[i]:offsets[i + 1], and 'views' lists the view
+                 IDs. The parameter keys match pack_fitting_info, so the result can be passed to
+                 transform_primitives directly.
+        """
+        view_ids = list(views)
+        entries = [entry for view_id in view_ids for entry in views[view_id]]
+        object_ids = [str(entry['obj_id']) for entry in entries]
+        self._load(list(dict.fromkeys(object_ids)))
+
+        slots = np.array([self._slots[object_id] for object_id in object_ids], dtype=np.int64)
+        R_object = np.array([entry['cam_R_m2c'] for entry in entries], dtype=float).reshape(-1, 3, 3)
+        t_object = np.array([entry['cam_t_m2c'] for entry in entries], dtype=float).reshape(-1, 3)
+        t_object *= self.translation_unit
+
+        # Index of the entry and of the cached primitive for every placed primitive
+        counts = self._counts[slots]
+        entry_index = np.repeat(np.arange(len(entries)), counts)
+        first = np.cumsum(counts) - counts
+        primitive_index = np.arange(counts.sum()) - np.repeat(first - self._offsets[slots], counts)
+
+        # x_cam = R_o x_obj + t_o with x_obj = R_k (a * v) + t_k gives R = R_o R_k and t = R_o t_k + t_o
+        R_entry = R_object[entry_index]
+        rotation = np.matmul(R_entry, self._flat['rotation'][primitive_index])
+        translation = np.einsum('kij,kj->ki', R_entry, self._flat['translation'][primitive_index])
+        translation += t_object[entry_index]
+
+        view_lengths = np.array([len(views[view_id]) for view_id in view_ids], dtype=np.int64)
+        view_starts = np.cumsum(view_lengths) - view_lengths
+        entry_offsets = np.append(first, counts.sum())
+        return {
+            'axes': self._flat['axes'][primitive_index],
+            'scale': self._flat['scale'][primitive_index],
+            'translation': translation,
+            'angles': rotation_angles(rotation),
+            'rotation': rotation,
+            'eps': self._flat['eps'][primitive_index],
+            'primitive': self._flat['primitive'][primitive_index],
+            'object': np.array(object_ids, dtype=str)[entry_index],
+            'instance': entry_index - np.repeat(view_starts, view_lengths)[entry_index],
+            'offsets': entry_offsets[np.append(view_starts, len(entries))],
+            'views': np.array(view_ids, dtype=str),
+        }
+
+    def assemble_scene(self, scene_gt_path):
+        """
+        Assembles every view of a scene_gt.json, see assemble_views.
+        """
+        with open(scene_gt_path, 'r') as f:
+            return self.assemble_views(json.load(f))
+
+
+def view_assembly(assembly, view):
+    """
+    Returns the primitive arrays of one view of an assembly, as views into its arrays.
+
+    :param view: View index into assembly['views'].
+    """
+    rows = slice(assembly['offsets'][view], assembly['offsets'][view + 1])
+    return {key: value[rows] for key, value in assembly.items() if key not in ('offsets', 'views')}
+
+
+def assembly_to_fitting_info(assembly):
+    """
+    Converts the primitives of one view to fitting info records, e.g. for mesh_export or sdf_query.
+    """
+    fitting_info = []
+    for k in range(len(assembly['scale'])):
+        info = {'primitive': str(assembly['primitive'][k])}
+        info.update(zip(('a1', 'a2', 'a3'), assembly['axes'][k].tolist()))
+        info['scale'] = float(assembly['scale'][k])
+        info.update(zip(('tx', 'ty', 'tz'), assembly['translation'][k].tolist()))
+        info.update(zip(('roll', 'pitch', 'yaw'), assembly['angles'][k].tolist()))
+        info.update(zip(('eps1', 'eps2'), assembly['eps'][k].tolist()))
+        info['object'] = str(assembly['object'][k])
+        fitting_info.append(info)
+    return fitting_info
+
+
+def scene_cloud(assembly, superquadric_library_path=None, library_scale_factor=1):
+    """
+    Builds the merged point cloud of one view.
+
+    :param assembly: Primitive arrays of a single view, see view_assembly.
+    :param superquadric_library_path: Directory of the baked PLY library, or None to sample the
+                                      primitives analytically from their exponents.
+    :param library_scale_factor: Factor the library coordinates are divided by, see reconstruct_shape.
+    :return: Tuple (points (N, 3), labels (N,)) with the primitive index of every point.
+    """
+    params = dict(assembly)
+    if superquadric_library_path is None:
+        vertices = [sample_primitive({'primitive': primitive, 'eps1': eps1, 'eps2': eps2})
+                    for primitive, (eps1, eps2) in zip(assembly['primitive'], assembly['eps'])]
+    else:
+        vertices = [load_library_primitive(superquadric_library_path, primitive) for primitive in assembly['primitive']]
+        params['scale'] = assembly['scale'] / library_scale_factor
+    return transform_primitives(vertices, params)
+
+
+def write_scene_cloud(output_ply_path, assembly, superquadric_library_path=None, library_scale_factor=1,
+                      binary=True):
+    """
+    Saves the merged point cloud of one view, colored by object instance.
+
+    :return: Number of points written.
+    """
+    points, labels = scene_cloud(assembly, superquadric_library_path, library_scale_factor)
+    write_ply(output_ply_path, points, COLORS[assembly['instance'][labels] % len(COLORS)], binary=binary)
+    return len(points)
+
+
+def assemble_dataset(dataset_root, fitting_source, output_directory, translation_unit=1.0, clouds=False,
+                     superquadric_library_path=None):
+    """
+    Assembles every scene below a MetaGraspNet dataset root into one <scene>_primitives.npz each,
+    and optionally a <scene>_<view>.ply cloud per view.
+
+    :return: Number of scenes assembled.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    assembler = SceneAssembler(fitting_source, translation_unit)
+    scene_gt_paths = sorted(glob.glob(os.path.join(dataset_root, '**', 'scene_gt.json'), recursive=True))
+
+    start = time.perf_counter()
+    for scene_gt_path in scene_gt_paths:
+        scene = os.path.basename(os.path.dirname(scene_gt_path))
+        assembly = assembler.assemble_scene(scene_gt_path)
+        np.savez(os.path.join(output_directory, f'{scene}_primitives.npz'), **assembly)
+        if clouds:
+            for view, view_id in enumerate(assembly['views']):
+                write_scene_cloud(os.path.join(output_directory, f'{scene}_{view_id}.ply'),
+                                  view_assembly(assembly, view), superquadric_library_path)
+    elapsed = time.perf_counter() - start
+    print(f"Assembled {len(scene_gt_paths)} scenes in {elapsed:.2f} s "
+          f"({60 * len(scene_gt_paths) / max(elapsed, 1e-9):.0f} scenes per minute)")
+    return len(scene_gt_paths)
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    dataset_root = '/home/yifeng/PycharmProjects/Diffusion/general_case/gt_label'
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    output_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/scene_primitives'
+
+    assemble_dataset(dataset_root, fitting_info_directory, output_directory)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import numpy as np
+
+from superquadric_sampler import parse_primitive, sample_superquadric
+from primitive_library import load_library, library_manifest
+
+# Descriptor index written into the library directory
+DESCRIPTOR_FILE = '.primitive_descriptors.json'
+
+# Bins of the histogram of whitened point radii, relative to their mean
+RADIAL_BINS = np.linspace(0.0, 2.0, 13)
+
+# Points a segment is subsampled to before computing its descriptor
+DESCRIPTOR_POINTS = 2000
+
+# Voxels along the longest side when evening out the point density of a segment
+DESCRIPTOR_VOXELS = 32
+
+# Exponents of the analytic index, the same grid the PLY library is baked at
+ANALYTIC_EPS = [0.0, 0.5, 1.0, 1.5, 2.0]
+
+# Indices built in this process, keyed by real path of the library directory (None: analytic)
+_loaded_indices = {}
+
+
+def uniform_subset(points):
+    """
+    Keeps one point per occupied voxel, so that descriptors do not depend on how densely each
+    region was sampled; the PLY library is denser near the poles than area-uniform clouds.
+    """
+    voxel_size = np.ptp(points, axis=0).max() / DESCRIPTOR_VOXELS + 1e-12
+    keys = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    return points[np.sort(first)]
+
+
+def _frame_descriptor(local):
+    """
+    Describes points given in a frame whose z-axis plays the role of the eps1 axis.
+
+    Coordinates are whitened per axis, which removes size and aspect ratio. The features are the
+    fourth moment along z, the mean fourth moment in x and y, the mixed moments E[x^2 y^2] and
+    E[(x^2 + y^2) z^2] / 2, and the histogram of the whitened radii.
+    """
+    local = local - local.mean(axis=0)
+    u = local / (local.std(axis=0) + 1e-12)
+    u2 = u ** 2
+    moments = [np.mean(u2[:, 2] ** 2), 0.5 * np.mean(u2[:, 0] ** 2 + u2[:, 1] ** 2),
+               np.mean(u2[:, 0] * u2[:, 1]), 0.5 * np.mean((u2[:, 0] + u2[:, 1]) * u2[:, 2])]
+    radius = np.sqrt(u2.sum(axis=1))
+    histogram, _ = np.histogram(radius / radius.mean(), bins=RADIAL_BINS)
+    return np.concatenate([moments, histogram / len(radius)])
+
+
+def segment_descriptors(points):
+    """
+    Computes the descriptor of a segment once for every principal axis taken as the z-axis.
+
+    :param points: (N, 3) array of segment points in any pose.
+    :return: (3, D) array; row i uses the i-th principal axis (ascending variance) as z, the same
+             order as the guesses of superquadric_fitter.initial_guesses.
+    """
+    points = np.asarray(points, dtype=float)
+    if points.shape[0] > DESCRIPTOR_POINTS:
+        points = points[np.linspace(0, points.shape[0] - 1, DESCRIPTOR_POINTS).astype(int)]
+    points = uniform_subset(points)
+    centered = points - points.mean(axis=0)
+    _, eigvecs = np.linalg.eigh(np.cov(centered.T))
+    local = np.dot(centered, eigvecs)
+    return np.stack([_frame_descriptor(local[:, [(z_axis + 1) % 3, (z_axis + 2) % 3, z_axis]])
+                     for z_axis in range(3)])
+
+
+def build_shape_index(superquadric_library_path=None):
+    """
+    Computes the descriptor of every library primitive in its own axes.
+
+    Library primitives are axis aligned, so no principal axes are needed and the descriptor is
+    the one of their true eps1 axis. Features are standardized over the library so that moments
+    and histogram bins weigh alike. With a library path the index is saved as DESCRIPTOR_FILE in
+    the library directory, together with the hashes of the files it was computed from.
+
+    :param superquadric_library_path: Directory of the baked PLY library, or None to describe
+                                      analytic samples of the library exponent grid.
+    :return: The index dictionary.
+    """
+    if superquadric_library_path is None:
+        shapes = {f"{'0' if e1 == 0 else e1}_{'0' if e2 == 0 else e2}.ply": sample_superquadric(e1, e2)
+                  for e1 in ANALYTIC_EPS for e2 in ANALYTIC_EPS}
+    else:
+        shapes = load_library(superquadric_library_path)
+
+    names = sorted(shapes)
+    descriptors = np.stack([_frame_descriptor(uniform_subset(np.asarray(shapes[name], dtype=float)))
+                            for name in names])
+    index = {
+        'primitives': names,
+        'eps': [parse_primitive(name) for name in names],
+        'descriptors': descriptors.tolist(),
+        'mean': descriptors.mean(axis=0).tolist(),
+        'std': (descriptors.std(axis=0) + 1e-9).tolist(),
+    }
+
+    if superquadric_library_path is not None:
+        index['manifest'] = library_manifest(superquadric_library_path)
+        index_path = os.path.join(superquadric_library_path, DESCRIPTOR_FILE)
+        with open(f'{index_path}.{os.getpid()}.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(f'{index_path}.{os.getpid()}.tmp', index_path)
+        print(f"Indexed {len(names)} primitives of {superquadric_library_path}")
+    return index
+
+
+def load_shape_index(superquadric_library_path=None):
+    """
+    Loads the descriptor index of a library, rebuilding it if the library changed.
+
+    :return: Index dictionary with the descriptors already standardized as an (M, D) array under
+             'features'.
+    """
+    key = None if superquadric_library_path is None else os.path.realpath(superquadric_library_path)
+    index = _loaded_indices.get(key)
+    if index is not None and (key is None or index['manifest'] == library_manifest(superquadric_library_path)):
+        return index
+
+    index = None
+    if key is not None:
+        index_path = os.path.join(superquadric_library_path, DESCRIPTOR_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('manifest') != library_manifest(superquadric_library_path):
+                index = None
+    if index is None:
+        index = build_shape_index(superquadric_library_path)
+
+    index['mean'] = np.array(index['mean'])
+    index['std'] = np.array(index['std'])
+    index['features'] = (np.array(index['descriptors']) - index['mean']) / index['std']
+    _loaded_indices[key] = index
+    return index
+
+
+def query_shape_index(index, points, k=3):
+    """
+    Ranks the library primitives by descriptor distance to a segment.
+
+    :param index: Index dictionary from load_shape_index.
+    :param points: (N, 3) array of segment points in any pose.
+    :param k: Number of candidates to return.
+    :return: List of up to k tuples (primitive name, eps1, eps2, z_axis, distance), best first,
+             where z_axis is the principal axis of the segment that matched the eps1 axis.
+    """
+    query = (segment_descriptors(points) - index['mean']) / index['std']
+    # (M, 3) distances of every primitive to every choice of z-axis
+    distances = np.linalg.norm(index['features'][:, None, :] - query[None, :, :], axis=2)
+    z_axes = np.argmin(distances, axis=1)
+    best = distances[np.arange(len(z_axes)), z_axes]
+    order = np.argsort(best)[:k]
+    return [(index['primitives'][m], index['eps'][m][0], index['eps'][m][1], int(z_axes[m]), float(best[m]))
+            for m in order]
+
+
+if __name__ == "__main__":
+    # Build the index once beside the library
+    superquadric_library_path = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+    build_shape_index(superquadric_library_path)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+import os
+import numpy as np
+from scipy.optimize import least_squares
+
+from reconstruct import load_point_cloud, rotation_matrix
+from superquadric_sampler import LIBRARY_RADIUS, primitive_eps
+from shape_index import query_shape_index
+from fit_store import STORE_FILE, FitStore, cloud_entry
+
+# Shape exponents the library is baked at, and the range the optimizer may explore
+EPS_GRID = np.array([0.0, 0.5, 1.0, 1.5, 2.0])
+EPS_MIN = 0.1
+EPS_MAX = 2.0
+
+# Parameter vector layout: a1 a2 a3 tx ty tz roll pitch yaw eps1 eps2
+N_PARAMS = 11
+
+# Library shapes refined per fit when a descriptor index is given
+SHAPE_CANDIDATES = 2
+
+
+def rotation_matrix_derivatives(roll, pitch, yaw):
+    """
+    Partial derivatives of R = R_z(yaw) R_y(pitch) R_x(roll) with respect to each angle.
+
+    :return: Tuple (dR/droll, dR/dpitch, dR/dyaw) of 3x3 arrays.
+    """
+    cr, sr = np.cos(roll), np.sin(roll)
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+
+    R_x = np.array([[1, 0, 0], [0, cr, -sr], [0, sr, cr]])
+    R_y = np.array([[cp, 0, sp], [0, 1, 0], [-sp, 0, cp]])
+    R_z = np.array([[cy, -sy, 0], [sy, cy, 0], [0, 0, 1]])
+    dR_x = np.array([[0, 0, 0], [0, -sr, -cr], [0, cr, -sr]])
+    dR_y = np.array([[-sp, 0, cp], [0, 0, 0], [-cp, 0, -sp]])
+    dR_z = np.array([[-sy, -cy, 0], [cy, -sy, 0], [0, 0, 0]])
+
+    return R_z @ R_y @ dR_x, R_z @ dR_y @ R_x, dR_z @ R_y @ R_x
+
+
+def inside_outside(points, params):
+    """
+    Evaluates the superquadric inside-outside function F for every point.
+
+    F < 1 inside the surface, F = 1 on it and F > 1 outside. Computed in the log
+    domain so that small exponents do not overflow for far away points.
+
+    :param points: (N, 3) array of points in world coordinates.
+    :param params: Parameter vector (a1, a2, a3, tx, ty, tz, roll, pitch, yaw, eps1, eps2),
+                   where a1..a3 are the semi-axes in world units.
+    :return: (N,) array of F values.
+    """
+    a = params[0:3]
+    R = rotation_matrix(*params[6:9])
+    eps1, eps2 = params[9], params[10]
+
+    local = np.dot(points - params[3:6], R)
+    log_xyz = np.log((local / a) ** 2 + 1e-20)
+    log_A = np.logaddexp(log_xyz[:, 0] / eps2, log_xyz[:, 1] / eps2)
+    log_f = np.logaddexp(eps2 / eps1 * log_A, log_xyz[:, 2] / eps1)
+    return np.exp(log_f)
+
+
+def radial_distance(points, params):
+    """
+    Absolute radial distance |q| |1 - F^(-eps1/2)| from every point to the superquadric surface.
+
+    Same distance as radial_residuals, without the Jacobian.
+    """
+    norm = np.linalg.norm(points - params[3:6], axis=1)
+    return norm * np.abs(1.0 - inside_outside(points, params) ** (-0.5 * params[9]))
+
+
+def radial_residuals(params, points, free=None, fixed=None):
+    """
+    Radial Euclidean distance from every point to the superquadric surface, and its Jacobian.
+
+    The distance is d = |q| (1 - F^(-eps1/2)), where q is the point in the primitive frame.
+
+    :param params: Parameter vector, or only its free entries if `free` is given.
+    :param points: (N, 3) array of points in world coordinates.
+    :param free: Optional boolean mask of the parameters being optimized.
+    :param fixed: Full parameter vector supplying the values of the non-free parameters.
+    :return: Tuple (residuals (N,), jacobian (N, number of free parameters)).
+    """
+    if free is not None:
+        full = fixed.copy()
+        full[free] = params
+        params = full
+
+    a = params[0:3]
+    t = params[3:6]
+    roll, pitch, yaw = params[6:9]
+    eps1, eps2 = params[9], params[10]
+
+    R = rotation_matrix(roll, pitch, yaw)
+    dR_roll, dR_pitch, dR_yaw = rotation_matrix_derivatives(roll, pitch, yaw)
+
+    offset = points - t
+    local = np.dot(offset, R)
+    norm = np.sqrt(np.einsum('ij,ij->i', local, local)) + 1e-12
+
+    xyz = (local / a) ** 2 + 1e-20
+    log_xyz = np.log(xyz)
+    log_X, log_Y, log_Z = log_xyz[:, 0], log_xyz[:, 1], log_xyz[:, 2]
+    log_A = np.logaddexp(log_X / eps2, log_Y / eps2)
+    log_P = eps2 / eps1 * log_A
+    log_Q = log_Z / eps1
+    log_f = np.logaddexp(log_P, log_Q)
+
+    # Relative weights of the terms of F and of A; w_P + w_Q = 1, w_X + w_Y = 1
+    w_P = np.exp(log_P - log_f)
+    w_Q = 1.0 - w_P
+    w_X = np.exp(log_X / eps2 - log_A)
+    w_Y = 1.0 - w_X
+
+    G = np.exp(-0.5 * eps1 * log_f)
+    residuals = norm * (1.0 - G)
+
+    # d log F / d log X, d log F / d log Y, d log F / d log Z
+    dlogf_dlog = np.stack([w_P * w_X, w_P * w_Y, w_Q], axis=1) / eps1
+    # d log X / d local_x = 2 local_x / (a1^2 X), and likewise for y and z
+    grad_logf = dlogf_dlog * 2.0 * local / (a ** 2 * xyz)
+
+    scale = norm * G * 0.5 * eps1
+    dr_dlocal = local / norm[:, None] * (1.0 - G)[:, None] + scale[:, None] * grad_logf
+
+    jacobian = np.empty((points.shape[0], N_PARAMS))
+    jacobian[:, 0:3] = scale[:, None] * dlogf_dlog * (-2.0 / a)
+    jacobian[:, 3:6] = -np.dot(dr_dlocal, R.T)
+    jacobian[:, 6] = np.einsum('ij,ij->i', dr_dlocal, np.dot(offset, dR_roll))
+    jacobian[:, 7] = np.einsum('ij,ij->i', dr_dlocal, np.dot(offset, dR_pitch))
+    jacobian[:, 8] = np.einsum('ij,ij->i', dr_dlocal, np.dot(offset, dR_yaw))
+    dlogf_deps1 = -(w_P * eps2 * log_A + w_Q * log_Z) / eps1 ** 2
+    jacobian[:, 9] = norm * G * 0.5 * (log_f + eps1 * dlogf_deps1)
+    dlogf_deps2 = w_P * (log_A - (w_X * log_X + w_Y * log_Y) / eps2) / eps1
+    jacobian[:, 10] = scale * dlogf_deps2
+
+    if free is not None:
+        jacobian = jacobian[:, free]
+    return residuals, jacobian
+
+
+def euler_from_matrix(R):
+    """
+    Recovers (roll, pitch, yaw) such that rotation_matrix(roll, pitch, yaw) == R.
+    """
+    pitch = -np.arcsin(np.clip(R[2, 0], -1.0, 1.0))
+    roll = np.arctan2(R[2, 1], R[2, 2])
+    yaw = np.arctan2(R[1, 0], R[0, 0])
+    return roll, pitch, yaw
+
+
+def initial_guesses(points, candidates=None):
+    """
+    Builds PCA-based starting points, one per choice of principal axis as the primitive z-axis.
+
+    :param points: (N, 3) array of object points.
+    :param candidates: Optional list of (eps1, eps2, z_axis) shapes, e.g. from query_shape_index.
+                       Only these are built, with their exponents instead of ellipsoids.
+    :return: List of parameter vectors.
+    """
+    centroid = points.mean(axis=0)
+    eigvals, eigvecs = np.linalg.eigh(np.cov((points - centroid).T))
+    # Points spread over an ellipsoid surface have variance a^2 / 3 along each axis
+    axes = np.sqrt(3.0 * np.maximum(eigvals, 1e-12))
+
+    if candidates is None:
+        candidates = [(1.0, 1.0, z_axis) for z_axis in range(3)]
+
+    guesses = []
+    for eps1, eps2, z_axis in candidates:
+        order = [(z_axis + 1) % 3, (z_axis + 2) % 3, z_axis]
+        R = eigvecs[:, order]
+        if np.linalg.det(R) < 0:
+            R[:, 0] = -R[:, 0]
+        guess = np.empty(N_PARAMS)
+        guess[0:3] = axes[order]
+        guess[3:6] = centroid
+        guess[6:9] = euler_from_matrix(R)
+        guess[9:11] = eps1, eps2
+        guesses.append(guess)
+    return guesses
+
+
+def _residuals_only(params, points, free, fixed):
+    return radial_residuals(params, points, free, fixed)[0]
+
+
+def _jacobian_only(params, points, free, fixed):
+    return radial_residuals(params, points, free, fixed)[1]
+
+
+def _solve(points, x0, free, lower, upper, max_iterations):
+    result = least_squares(_residuals_only, x0[free], jac=_jacobian_only,
+                           bounds=(lower[free], upper[free]), args=(points, free, x0),
+                           method='trf', x_scale='jac', max_nfev=max_iterations)
+    params = x0.copy()
+    params[free] = result.x
+    return params, 2.0 * result.cost / points.shape[0]
+
+
+def snap_to_library(eps1, eps2):
+    """
+    Rounds continuous shape exponents to the nearest primitive of the PLY library.
+
+    :return: Tuple (primitive file name, snapped eps1, snapped eps2).
+    """
+    snapped = [EPS_GRID[np.argmin(np.abs(EPS_GRID - eps))] for eps in (eps1, eps2)]
+    names = ['0' if eps == 0 else str(float(eps)) for eps in snapped]
+    return f'{names[0]}_{names[1]}.ply', snapped[0], snapped[1]
+
+
+def params_to_fitting_info(params, primitive, object_id, continuous_eps=False):
+    """
+    Converts a parameter vector to a fitting info record in the schema written by the fitting GUI.
+
+    With continuous_eps, the exact exponents are also stored as 'eps1'/'eps2', which the analytic
+    sampler prefers over the nearest library primitive.
+    """
+    semi_axes = params[0:3] / LIBRARY_RADIUS
+    scale = float(np.cbrt(np.prod(semi_axes)))
+    roll, pitch, yaw = (float(np.arctan2(np.sin(angle), np.cos(angle))) for angle in params[6:9])
+    info = {
+        'primitive': primitive,
+        'a1': float(semi_axes[0] / scale),
+        'a2': float(semi_axes[1] / scale),
+        'a3': float(semi_axes[2] / scale),
+        'scale': scale,
+        'tx': float(params[3]),
+        'ty': float(params[4]),
+        'tz': float(params[5]),
+        'roll': roll,
+        'pitch': pitch,
+        'yaw': yaw,
+        'object': object_id
+    }
+    if continuous_eps:
+        info['eps1'] = float(params[9])
+        info['eps2'] = float(params[10])
+    return info
+
+
+def fitting_info_to_params(info):
+    """
+    Converts a fitting info record to a parameter vector, the inverse of params_to_fitting_info.
+
+    Exponents are taken from 'eps1'/'eps2' if present, otherwise from the primitive file name,
+    and clamped to EPS_MIN so that sharp library primitives stay well defined.
+    """
+    params = np.empty(N_PARAMS)
+    params[0:3] = np.array([info['a1'], info['a2'], info['a3']]) * info['scale'] * LIBRARY_RADIUS
+    params[3:6] = info['tx'], info['ty'], info['tz']
+    params[6:9] = info['roll'], info['pitch'], info['yaw']
+    params[9:11] = np.maximum(primitive_eps(info), EPS_MIN)
+    return params
+
+
+def fit_superquadric_params(points, max_points=2000, max_iterations=50, seed=0, continuous_eps=False, x0=None,
+                            shape_index=None):
+    """
+    Fits a single superquadric and returns its parameter vector, see fit_superquadric.
+
+    :param x0: Optional parameter vector to start from instead of the PCA guesses, e.g. a previous
+               fit of the same or a similar part.
+    :param shape_index: Optional descriptor index from shape_index.load_shape_index. Only the
+                        SHAPE_CANDIDATES best matching library shapes are then refined, instead of
+                        starting from an ellipsoid along every principal axis.
+    :return: Tuple (parameter vector, library primitive name, mean squared residual).
+    """
+    points = np.asarray(points, dtype=float)
+    if points.shape[0] > max_points:
+        rng = np.random.default_rng(seed)
+        points = points[rng.choice(points.shape[0], max_points, replace=False)]
+
+    extent = np.ptp(points, axis=0).max()
+    lower = np.concatenate([np.full(3, 1e-3 * extent), points.min(axis=0) - extent,
+                            np.full(3, -2 * np.pi), [EPS_MIN, EPS_MIN]])
+    upper = np.concatenate([np.full(3, 2.0 * extent), points.max(axis=0) + extent,
+                            np.full(3, 2 * np.pi), [EPS_MAX, EPS_MAX]])
+
+    if x0 is not None:
+        guesses = [np.asarray(x0, dtype=float)]
+    elif shape_index is not None:
+        candidates = query_shape_index(shape_index, points, SHAPE_CANDIDATES)
+        guesses = initial_guesses(points, [(eps1, eps2, z_axis) for _, eps1, eps2, z_axis, _ in candidates])
+    else:
+        guesses = initial_guesses(points)
+
+    free = np.ones(N_PARAMS, dtype=bool)
+    best_params, best_cost = None, np.inf
+    for guess in guesses:
+        guess = np.clip(guess, lower, upper)
+        params, cost = _solve(points, guess, free, lower, upper, max_iterations)
+        if cost < best_cost:
+            best_params, best_cost = params, cost
+
+    primitive, eps1, eps2 = snap_to_library(best_params[9], best_params[10])
+    if not continuous_eps:
+        best_params[9] = max(eps1, EPS_MIN)
+        best_params[10] = max(eps2, EPS_MIN)
+        free[9:11] = False
+        best_params, best_cost = _solve(points, best_params, free, lower, upper, max_iterations)
+
+    return best_params, primitive, best_cost
+
+
+def fit_superquadric(points, object_id, max_points=2000, max_iterations=50, seed=0, continuous_eps=False,
+                     shape_index=None):
+    """
+    Fits a single superquadric to a point cloud by least squares on the radial distance.
+
+    The shape exponents are first optimized continuously, then snapped to the nearest library
+    primitive, after which size and pose are refined with the exponents held fixed. With
+    continuous_eps the snapping step is skipped and the exact exponents are stored as well.
+
+    :param points: (N, 3) array of object points, e.g. from load_point_cloud.
+    :param object_id: Object ID stored in the 'object' field of the record.
+    :param max_points: Points are randomly subsampled to this many before optimizing.
+    :param max_iterations: Maximum number of function evaluations per optimization stage.
+    :param seed: Seed for the subsampling.
+    :param continuous_eps: Keep the continuous exponents instead of snapping to the library grid.
+    :param shape_index: Optional descriptor index to start from the best matching library shapes.
+    :return: Fitting info dictionary, in the same schema as save_fitting_info writes.
+    """
+    params, primitive, _ = fit_superquadric_params(points, max_points, max_iterations, seed, continuous_eps,
+                                                   shape_index=shape_index)
+    return params_to_fitting_info(params, primitive, object_id, continuous_eps)
+
+
+def save_fitting_info(fitting_info, object_ply_path, fitting_info_directory, cloud=None):
+    """
+    Saves fitting info as the next revision of the object in the fit store of the directory,
+    together with the content hash of the point cloud it was fitted to, see refit.
+
+    :param cloud: Entry of the object point cloud from cloud_entry, if already computed.
+    :return: Revision number of the saved fitting.
+    """
+    object_name = os.path.splitext(os.path.basename(object_ply_path))[0]
+    object_id = object_name.split('_')[0]
+
+    store_path = os.path.join(fitting_info_directory, STORE_FILE)
+    with FitStore(store_path) as store:
+        revision = store.save(object_id, fitting_info)
+        store.record_cloud(object_id, cloud or cloud_entry(object_ply_path), revision)
+    print(f"Fitting information saved to {store_path} as object {object_id}, revision {revision}")
+    return revision
+
+
+def fit_object(object_ply_path, fitting_info_directory, **kwargs):
+    """
+    Loads an object point cloud, fits a superquadric to it and saves the fitting info to the store.
+
+    :return: Revision number of the saved fitting.
+    """
+    object_name = os.path.splitext(os.path.basename(object_ply_path))[0]
+    object_id = object_name.split('_')[0]
+
+    vertices = load_point_cloud(object_ply_path)
+    fitting_info = [fit_superquadric(vertices, object_id, **kwargs)]
+    return save_fitting_info(fitting_info, object_ply_path, fitting_info_directory)
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    object_ply_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib/8_obj.ply'
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+
+    os.makedirs(fitting_info_directory, exist_ok=True)
+    fit_object(object_ply_path, fitting_info_directory)
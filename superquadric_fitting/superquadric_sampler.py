@@ -0,0 +1,122 @@
+import os
+from functools import lru_cache
+import numpy as np
+
+# Semi-axis length of the primitives in superquadric_lib_rescale (unit library / 10)
+LIBRARY_RADIUS = 0.1
+
+# Number of points per primitive in the PLY library
+DEFAULT_NUM_POINTS = 10000
+
+# Exponents below this are treated as sharp edges; 0 itself would make F undefined
+EPS_SHARP = 0.01
+
+# Candidate directions drawn per output point before area-weighted resampling
+OVERSAMPLING = 4
+
+
+def parse_primitive(primitive):
+    """
+    Parses a library primitive file name such as '0.5_1.0.ply' into its shape exponents.
+
+    :param primitive: Primitive file name, as stored in the 'primitive' field of a fitting info record.
+    :return: Tuple (eps1, eps2).
+    """
+    name = os.path.splitext(os.path.basename(primitive))[0]
+    eps1, eps2 = name.split('_')
+    return float(eps1), float(eps2)
+
+
+def primitive_eps(info):
+    """
+    Returns the shape exponents of a fitting info record.
+
+    Continuous 'eps1'/'eps2' fields take precedence over the library 'primitive' file name.
+    """
+    if 'eps1' in info and 'eps2' in info:
+        return float(info['eps1']), float(info['eps2'])
+    return parse_primitive(info['primitive'])
+
+
+def surface_radius(directions, eps1, eps2):
+    """
+    Distance from the center to the unit superquadric surface along unit directions.
+
+    :param directions: (M, 3) array of unit directions.
+    :param eps1: Exponent along z, a scalar or an (M,) array with one per direction.
+    :param eps2: Exponent in the xy-plane, a scalar or an (M,) array.
+    :return: (M,) array of radii.
+    """
+    log_xyz = np.log(directions ** 2 + 1e-30)
+    log_A = np.logaddexp(log_xyz[:, 0] / eps2, log_xyz[:, 1] / eps2)
+    return np.exp(-0.5 * eps1 * np.logaddexp(eps2 / eps1 * log_A, log_xyz[:, 2] / eps1))
+
+
+def _radial_surface(directions, eps1, eps2):
+    """
+    Projects unit directions radially onto the unit superquadric surface.
+
+    :return: Tuple (radius (M,), area weight (M,)). The weight is the inverse density of the
+             radial projection, r^2 / cos(angle between ray and surface normal).
+    """
+    log_xyz = np.log(directions ** 2 + 1e-30)
+    log_A = np.logaddexp(log_xyz[:, 0] / eps2, log_xyz[:, 1] / eps2)
+    log_P = eps2 / eps1 * log_A
+    log_f = np.logaddexp(log_P, log_xyz[:, 2] / eps1)
+    radius = np.exp(-0.5 * eps1 * log_f)
+
+    # Gradient of log F at the direction; log F is homogeneous of degree 2/eps1 in the point,
+    # so the gradient at the surface point is the gradient at the direction divided by radius
+    w_P = np.exp(log_P - log_f)
+    w_X = np.exp(log_xyz[:, 0] / eps2 - log_A)
+    weights = np.stack([w_P * w_X, w_P * (1.0 - w_X), 1.0 - w_P], axis=1)
+    gradient = weights * 2.0 / eps1 * directions / (directions ** 2 + 1e-30)
+    gradient_norm = np.sqrt(np.einsum('ij,ij->i', gradient, gradient))
+
+    # d . grad(log F) = 2 / eps1 at the direction, which gives cos = 2 / (eps1 |grad|)
+    cos_angle = np.clip(2.0 / (eps1 * gradient_norm), 0.05, 1.0)
+    return radius, radius ** 2 / cos_angle
+
+
+@lru_cache(maxsize=256)
+def _sample_unit(eps1, eps2, n_points, seed):
+    rng = np.random.default_rng(seed)
+    directions = rng.standard_normal((OVERSAMPLING * n_points, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+
+    radius, weights = _radial_surface(directions, max(eps1, EPS_SHARP), max(eps2, EPS_SHARP))
+    selected = rng.choice(directions.shape[0], n_points, replace=False, p=weights / weights.sum())
+
+    vertices = directions[selected] * (radius[selected] * LIBRARY_RADIUS)[:, None]
+    vertices.flags.writeable = False
+    return vertices
+
+
+def sample_superquadric(eps1, eps2, n_points=DEFAULT_NUM_POINTS, seed=0):
+    """
+    Samples points on the surface of a superquadric with continuous shape exponents.
+
+    The surface is (|x|^(2/eps2) + |y|^(2/eps2))^(eps2/eps1) + |z|^(2/eps1) = 1, scaled by
+    LIBRARY_RADIUS so that samples are interchangeable with superquadric_lib_rescale. Points are
+    spread roughly uniformly over the surface area. Results are cached; the returned array is
+    read-only and shared between callers.
+
+    :param eps1: Exponent along z (first number of a library file name).
+    :param eps2: Exponent in the xy-plane (second number of a library file name).
+    :param n_points: Number of surface points.
+    :param seed: Seed of the sampling RNG.
+    :return: (n_points, 3) read-only array of surface points.
+    """
+    return _sample_unit(round(float(eps1), 6), round(float(eps2), 6), int(n_points), int(seed))
+
+
+def sample_primitive(info, n_points=DEFAULT_NUM_POINTS):
+    """
+    Samples the untransformed primitive of a fitting info record.
+
+    :param info: Fitting info record, or a library primitive file name such as '0.5_1.0.ply'.
+    :param n_points: Number of surface points.
+    :return: (n_points, 3) read-only array of surface points.
+    """
+    eps1, eps2 = parse_primitive(info) if isinstance(info, str) else primitive_eps(info)
+    return sample_superquadric(eps1, eps2, n_points)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import math
+import time
+import zlib
+import struct
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from reconstruct import load_point_cloud
+from superquadric_sampler import sample_primitive
+from batch_transform import pack_fitting_info, transform_primitives
+from batch_reconstruct import find_fitting_files, load_fitting, source_label
+from fit_store import STORE_FILE, FitStore, cloud_entry
+
+# Side of one view of a thumbnail in pixels, and the (elevation, azimuth) of its views in degrees
+THUMBNAIL_SIZE = 192
+VIEWS = ((20, 45), (60, -60))
+
+# Surface samples per primitive, and the most object points drawn
+PRIMITIVE_POINTS = 3000
+CLOUD_POINTS = 8000
+
+# Colors: white background, grey object cloud and the primitive colors of reconstruct_shape
+BACKGROUND = np.array([255, 255, 255], dtype=np.uint8)
+CLOUD_COLOR = np.array([150, 150, 150], dtype=np.uint8)
+COLORS = np.array([
+    [255, 0, 0],  # Red
+    [0, 255, 0],  # Green
+    [0, 0, 255],  # Blue
+    [255, 255, 0],  # Yellow
+    [255, 0, 255],  # Magenta
+    [0, 255, 255]  # Cyan
+], dtype=np.uint8)
+
+# 3 x 5 bitmap glyphs for the object ID labels, one row of three bits per string
+GLYPHS = {
+    '0': ('111', '101', '101', '101', '111'), '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'), '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'), '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'), '7': ('111', '001', '010', '010', '010'),
+    '8': ('111', '101', '111', '101', '111'), '9': ('111', '101', '111', '001', '111'),
+    '-': ('000', '000', '111', '000', '000'), '_': ('000', '000', '000', '000', '111'),
+    '.': ('000', '000', '000', '000', '010'), ':': ('000', '010', '000', '010', '000'),
+}
+
+# Thumbnail cache kept next to the contact sheet unless another directory is given
+CACHE_DIRECTORY = '.thumbnails'
+
+
+def write_png(file_path, image):
+    """
+    Writes an (H, W, 3) uint8 image as an 8-bit RGB PNG, with zlib only.
+    """
+    height, width, _ = image.shape
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)], axis=1)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(file_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def read_png(file_path):
+    """
+    Reads a PNG written by write_png back into an (H, W, 3) uint8 array.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    offset, idat = 8, []
+    while offset < len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        body = data[offset + 8:offset + 8 + length]
+        if kind == b'IHDR':
+            width, height, depth, color_type = struct.unpack('>IIBB', body[:10])
+            if (depth, color_type) != (8, 2):
+                raise ValueError(f"Unsupported PNG format in {file_path}")
+        elif kind == b'IDAT':
+            idat.append(body)
+        offset += 12 + length
+    rows = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape(height, 1 + 3 * width)
+    if rows[:, 0].any():
+        raise ValueError(f"Unsupported PNG row filter in {file_path}")
+    return rows[:, 1:].reshape(height, width, 3).copy()
+
+
+def view_matrix(elevation, azimuth):
+    """
+    Returns the rotation whose rows are the screen right, screen up and toward-viewer directions
+    of a camera at the given elevation and azimuth in degrees, with z up.
+    """
+    e, a = np.radians(elevation), np.radians(azimuth)
+    return np.array([[-np.sin(a), np.cos(a), 0.0],
+                     [-np.sin(e) * np.cos(a), -np.sin(e) * np.sin(a), np.cos(e)],
+                     [np.cos(e) * np.cos(a), np.cos(e) * np.sin(a), np.sin(e)]])
+
+
+def render_points(points, colors, size=THUMBNAIL_SIZE, views=VIEWS, splat=1):
+    """
+    Rasterizes colored points into one orthographic view per entry of views, side by side.
+
+    Every point covers a (2 * splat + 1)^2 pixel square. A z-buffer keeps the nearest point per
+    pixel, found by sorting on (pixel, depth), and points are darkened with depth.
+
+    :param points: (N, 3) array of points.
+    :param colors: (N, 3) uint8 array of point colors.
+    :param size: Side of every view in pixels.
+    :param views: (elevation, azimuth) pairs in degrees.
+    :param splat: Half width of the pixel square drawn per point.
+    :return: (size, size * len(views), 3) uint8 image.
+    """
+    image = np.empty((size, size * len(views), 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    if not len(points):
+        return image
+    centered = points - 0.5 * (points.min(axis=0) + points.max(axis=0))
+    # The bounding sphere radius does not depend on the view, so all views share one scale
+    scale = 0.45 * size / max(np.sqrt(np.einsum('ij,ij->i', centered, centered).max()), 1e-12)
+    offsets = np.arange(-splat, splat + 1)
+    dx, dy = (offset.ravel() for offset in np.meshgrid(offsets, offsets))
+
+    for v, (elevation, azimuth) in enumerate(views):
+        camera = centered @ view_matrix(elevation, azimuth).T
+        x = np.round(0.5 * size + scale * camera[:, 0]).astype(np.int64)[:, None] + dx
+        y = np.round(0.5 * size - scale * camera[:, 1]).astype(np.int64)[:, None] + dy
+        depth = np.broadcast_to(camera[:, 2:3], x.shape)
+        inside = (x >= 0) & (x < size) & (y >= 0) & (y < size)
+        pixel = (y * size + x)[inside]
+        depth = depth[inside]
+        point = np.broadcast_to(np.arange(len(points))[:, None], x.shape)[inside]
+
+        # Nearest point first within every pixel
+        order = np.lexsort((-depth, pixel))
+        first = order[np.r_[True, pixel[order[1:]] != pixel[order[:-1]]]]
+        low, high = camera[:, 2].min(), camera[:, 2].max()
+        shade = 0.55 + 0.45 * (depth[first] - low) / max(high - low, 1e-12)
+        view = image[:, v * size:(v + 1) * size].reshape(-1, 3)
+        view[pixel[first]] = (colors[point[first]] * shade[:, None]).astype(np.uint8)
+        image[:, v * size:(v + 1) * size] = view.reshape(size, size, 3)
+    return image
+
+
+def draw_label(image, text, x=4, y=4, scale=2, color=(0, 0, 0)):
+    """
+    Draws text with the GLYPHS bitmap font into an image in place; unknown characters are skipped.
+    """
+    for character in text:
+        glyph = GLYPHS.get(character)
+        if glyph is None:
+            continue
+        bits = np.array([[bit == '1' for bit in row] for row in glyph])
+        block = np.kron(bits, np.ones((scale, scale), dtype=bool))
+        region = image[y:y + block.shape[0], x:x + block.shape[1]]
+        region[block[:region.shape[0], :region.shape[1]]] = color
+        x += 4 * scale
+
+
+def render_fitting(fitting_info, object_vertices=None, size=THUMBNAIL_SIZE, views=VIEWS,
+                   primitive_points=PRIMITIVE_POINTS):
+    """
+    Renders the primitives of a fitting, sampled analytically and colored as in reconstruct_shape,
+    over the grey object cloud.
+
+    :return: (size, size * len(views), 3) uint8 image.
+    """
+    vertices = [sample_primitive(info, primitive_points) for info in fitting_info]
+    points, labels = transform_primitives(vertices, pack_fitting_info(fitting_info))
+    colors = COLORS[labels % len(COLORS)]
+    if object_vertices is not None and len(object_vertices):
+        object_vertices = np.asarray(object_vertices)[::max(1, len(object_vertices) // CLOUD_POINTS)]
+        points = np.concatenate([object_vertices, points])
+        colors = np.concatenate([np.broadcast_to(CLOUD_COLOR, object_vertices.shape), colors])
+    return render_points(points, colors, size, views)
+
+
+def thumbnail_key(fitting_info, cloud_sha1, size=THUMBNAIL_SIZE, views=VIEWS):
+    """
+    Hashes everything a thumbnail depends on: the fitting, the object cloud and the render settings.
+    """
+    content = json.dumps({'fitting': fitting_info, 'cloud': cloud_sha1, 'size': size, 'views': views,
+                          'primitive_points': PRIMITIVE_POINTS}, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _thumbnail_job(job):
+    fitting_info, object_ply_path, thumbnail_path, size, views = job
+    object_vertices = load_point_cloud(object_ply_path) if object_ply_path else None
+    # Written under a temporary name first, so an interrupted job never leaves a cached half file
+    temporary_path = f'{thumbnail_path}.{os.getpid()}.tmp'
+    write_png(temporary_path, render_fitting(fitting_info, object_vertices, size, views))
+    os.replace(temporary_path, thumbnail_path)
+    return thumbnail_path
+
+
+def _run_jobs(jobs, num_workers):
+    """
+    Renders thumbnails in a process pool, or in this process for a single worker, and yields
+    (thumbnail_path, exception or None) as they finish.
+    """
+    if num_workers == 1:
+        for job in jobs:
+            try:
+                _thumbnail_job(job)
+            except Exception as e:
+                yield job[2], e
+                continue
+            yield job[2], None
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_thumbnail_job, job): job[2] for job in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+
+def fitting_sources(fitting_source, object_ids=None, pattern='*_fitting_info*.json'):
+    """
+    Lists the fittings of a fit store file, a directory holding a fit store, or a directory of
+    fitting info JSON files, as the sources taken by batch_reconstruct.load_fitting.
+    """
+    store_path = os.path.join(fitting_source, STORE_FILE) if os.path.isdir(fitting_source) else fitting_source
+    if not os.path.exists(store_path):
+        return find_fitting_files(fitting_source, pattern)
+    with FitStore(store_path) as store:
+        return [(store_path, object_id) for object_id in object_ids or store.objects()]
+
+
+def render_thumbnails(sources, point_cloud_directory=None, cache_directory=CACHE_DIRECTORY, size=THUMBNAIL_SIZE,
+                      views=VIEWS, num_workers=None):
+    """
+    Renders one PNG thumbnail per fitting, reusing cached thumbnails.
+
+    Thumbnails are named by thumbnail_key, so a fitting is only rendered again when its
+    parameters, its object cloud or the render settings changed.
+
+    :param sources: Fitting info JSON paths or (store path, object ID) tuples, see fitting_sources.
+    :param point_cloud_directory: Directory of the <obj_id>_obj.ply clouds drawn under the
+                                  primitives; fittings are drawn alone if None or if missing.
+    :param cache_directory: Directory of the cached thumbnails.
+    :param num_workers: Number of worker processes, defaults to the number of CPUs; with one,
+                        thumbnails are rendered in this process.
+    :return: List of dictionaries with 'source', 'object', 'primitives' and 'thumbnail' (None if
+             rendering failed), in the order of sources.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+    entries, jobs = [], {}
+    for source in sources:
+        entry = {'source': source_label(source), 'object': None, 'primitives': 0, 'thumbnail': None}
+        entries.append(entry)
+        try:
+            fitting_info = load_fitting(source)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: failed to load {source_label(source)}: {e}")
+            continue
+        if isinstance(source, tuple):
+            entry['object'] = str(source[1])
+        elif fitting_info and 'object' in fitting_info[0]:
+            entry['object'] = str(fitting_info[0]['object'])
+        else:
+            entry['object'] = os.path.basename(source).split('_')[0]
+        entry['primitives'] = len(fitting_info)
+
+        object_ply_path = None
+        if point_cloud_directory is not None:
+            object_ply_path = os.path.join(point_cloud_directory, f"{entry['object']}_obj.ply")
+            if not os.path.exists(object_ply_path):
+                object_ply_path = None
+        cloud_sha1 = cloud_entry(object_ply_path)['sha1'] if object_ply_path else None
+        thumbnail_path = os.path.join(cache_directory, f'{thumbnail_key(fitting_info, cloud_sha1, size, views)}.png')
+        entry['thumbnail'] = thumbnail_path
+        # Identical fittings share one thumbnail, rendered once
+        if not os.path.exists(thumbnail_path) and thumbnail_path not in jobs:
+            jobs[thumbnail_path] = (fitting_info, object_ply_path, thumbnail_path, size, tuple(views))
+
+    failed = set()
+    if jobs:
+        for thumbnail_path, error in _run_jobs(list(jobs.values()), min(num_workers or os.cpu_count(), len(jobs))):
+            if error is not None:
+                print(f"Error: failed to render {thumbnail_path}: {error}")
+                failed.add(thumbnail_path)
+    for entry in entries:
+        if entry['thumbnail'] in failed:
+            entry['thumbnail'] = None
+    print(f"Rendered {len(jobs) - len(failed)} thumbnails, {len(entries) - len(jobs)} reused from the cache, {len(failed)} failed")
+    return entries
+
+
+def contact_sheet(entries, output_path, columns=None, gap=4):
+    """
+    Tiles the thumbnails of render_thumbnails into one PNG, labelled with their object IDs, and
+    saves the entries with their grid cells next to it as <output>.json.
+
+    :return: (H, W, 3) uint8 image of the sheet.
+    """
+    thumbnails = [read_png(entry['thumbnail']) if entry['thumbnail'] else None for entry in entries]
+    shape = next((thumbnail.shape for thumbnail in thumbnails if thumbnail is not None), None)
+    if shape is None:
+        raise ValueError("No thumbnails to put on the contact sheet")
+    height, width, _ = shape
+    if columns is None:
+        # About as wide as high
+        columns = max(1, round(math.sqrt(len(entries) * height / width)))
+    rows = -(-len(entries) // columns)
+
+    sheet = np.full((rows * (height + gap) + gap, columns * (width + gap) + gap, 3), 64, dtype=np.uint8)
+    for i, (entry, thumbnail) in enumerate(zip(entries, thumbnails)):
+        row, column = divmod(i, columns)
+        y, x = gap + row * (height + gap), gap + column * (width + gap)
+        cell = sheet[y:y + height, x:x + width]
+        if thumbnail is None:
+            cell[:] = (255, 200, 200)
+        else:
+            cell[:] = thumbnail
+        draw_label(cell, entry['object'] or '-')
+        entry['row'], entry['column'] = row, column
+
+    write_png(output_path, sheet)
+    with open(f'{os.path.splitext(output_path)[0]}.json', 'w') as f:
+        json.dump(entries, f, indent=4)
+    return sheet
+
+
+def render_contact_sheet(fitting_source, output_path, point_cloud_directory=None, cache_directory=None,
+                         object_ids=None, columns=None, size=THUMBNAIL_SIZE, num_workers=None):
+    """
+    Renders a QA contact sheet of every fitting of a fit store or fitting info directory, without
+    a display: thumbnails are rasterized by a NumPy z-buffer in a process pool, cached by
+    thumbnail_key, and tiled into one PNG.
+
+    :param fitting_source: Fit store file, or a directory holding a fit store or fitting info JSONs.
+    :param output_path: Path of the contact sheet PNG.
+    :param point_cloud_directory: Directory of the object clouds drawn under the primitives.
+    :param cache_directory: Thumbnail cache; defaults to .thumbnails next to output_path.
+    :param object_ids: Objects to include from a fit store; all if None.
+    :return: List of the sheet entries, see render_thumbnails.
+    """
+    start = time.perf_counter()
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(os.path.abspath(output_path)), CACHE_DIRECTORY)
+    entries = render_thumbnails(fitting_sources(fitting_source, object_ids), point_cloud_directory,
+                                cache_directory, size, VIEWS, num_workers)
+    contact_sheet(entries, output_path, columns)
+    print(f"Contact sheet of {len(entries)} fittings saved to {output_path} in {time.perf_counter() - start:.1f} s")
+    return entries
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+    point_cloud_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'
+    output_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/fit_contact_sheet.png'
+
+    render_contact_sheet(fitting_info_directory, output_path, point_cloud_directory)
@@ -1,51 +1,197 @@
 import os
-import trimesh
+import sys
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def rescale_ply_vertices(input_file, output_file, scale_factor):
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from ply_writer import write_ply
+from profiling import traced
+
+# Records source hash, scale factor and encoding of every rescaled file in its output directory
+MANIFEST_FILE = '.rescale_manifest.json'
+
+
+def file_sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_entry(input_file, previous):
     """
-    Rescales the vertices of a .ply file by the given scale factor and saves it as an ASCII .ply file.
+    Describes a source .ply file, re-hashing it only if its mtime or size changed.
+    """
+    stat = os.stat(input_file)
+    if previous and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+        sha1 = previous['sha1']
+    else:
+        sha1 = file_sha1(input_file)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': sha1}
+
+
+def load_manifest(output_directory):
+    manifest_path = os.path.join(output_directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_directory, manifest):
+    # Replace atomically, so an interrupted run never leaves a truncated manifest behind
+    manifest_path = os.path.join(output_directory, MANIFEST_FILE)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+@traced('rescale_ply_vertices', read='input_file', written='outputs')
+def _rescale_outputs(input_file, outputs, binary):
+    """
+    Loads a .ply file once and saves it divided by every scale factor of outputs.
+
+    :param outputs: List of (output_file, scale_factor) pairs.
+    """
+    # Load the .ply file; trimesh.load also handles face-less point clouds
+    import trimesh
+    mesh = trimesh.load(input_file)
+
+    # Rescale the vertices, keeping triangle faces if there are any
+    faces = getattr(mesh, 'faces', None)
+    for output_file, scale_factor in outputs:
+        write_ply(output_file, mesh.vertices / scale_factor, faces=faces, binary=binary)
+    return input_file
+
+
+def rescale_ply_vertices(input_file, output_file, scale_factor, binary=True):
+    """
+    Rescales the vertices of a .ply file by the given scale factor and saves it as a .ply file.
 
     :param input_file: Path to the input .ply file.
     :param output_file: Path to save the rescaled .ply file.
     :param scale_factor: The factor by which to divide each vertex coordinate.
+    :param binary: Save as binary little-endian PLY; set to False for ASCII output.
+    """
+    _rescale_outputs(input_file, [(output_file, scale_factor)], binary)
+    print(f"Rescaled and saved {output_file} in {'binary' if binary else 'ASCII'} format")
+
+
+def _run_jobs(jobs, binary, num_workers):
+    """
+    Runs rescale jobs in a process pool, or in this process for a single worker, and yields
+    (input_file, exception or None) as they finish.
     """
-    # Load the .ply file
-    mesh = trimesh.load_mesh(input_file)
+    if num_workers == 1:
+        for input_file, (_, _, outputs) in jobs.items():
+            try:
+                _rescale_outputs(input_file, outputs, binary)
+            except Exception as e:
+                yield input_file, e
+                continue
+            yield input_file, None
+        return
 
-    # Rescale the vertices
-    mesh.vertices /= scale_factor
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(_rescale_outputs, input_file, outputs, binary): input_file
+                   for input_file, (_, _, outputs) in jobs.items()}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
 
-    # Save the rescaled mesh to a new .ply file in ASCII format
-    mesh.export(output_file, file_type='ply', encoding='ascii')
-    print(f"Rescaled and saved {output_file} in ASCII format")
+
+def scale_directory(output_directory, scale_factor):
+    """
+    Returns the subdirectory of a scale variant, e.g. scale_10 for a factor of 10.
+    """
+    return os.path.join(output_directory, f'scale_{scale_factor:g}')
 
 
-def process_directory(input_directory, output_directory, scale_factor=10):
+def process_directory(input_directory, output_directory, scale_factor=10, binary=True, num_workers=None):
     """
     Processes all .ply files in the specified input directory, rescaling their vertices,
     and saving them to the specified output directory.
 
+    Files are rescaled in a process pool. Every output directory keeps a manifest of the source
+    hash, scale factor and encoding of its files, and files whose entry still matches are
+    skipped, so rerunning only rebuilds what changed. Several scale variants are built in one
+    pass, reading every source file once, by passing a list of scale factors; each variant is
+    written to its scale_directory below output_directory.
+
+    Reconstruction can also use the unscaled library directly with a library scale factor, see
+    reconstruct_shape, in which case no rescaled copy is needed at all.
+
     :param input_directory: Path to the directory containing .ply files.
     :param output_directory: Path to the directory where rescaled .ply files will be saved.
-    :param scale_factor: The factor by which to divide each vertex coordinate.
+    :param scale_factor: The factor by which to divide each vertex coordinate, or a list of factors.
+    :param binary: Save as binary little-endian PLY; set to False for ASCII output.
+    :param num_workers: Number of worker processes, defaults to the number of CPUs; with one, files
+                        are rescaled in this process.
+    :return: Dictionary with the lists of 'rescaled', 'skipped' and 'failed' output files.
     """
-    # Ensure the output directory exists
-    os.makedirs(output_directory, exist_ok=True)
+    if isinstance(scale_factor, (list, tuple)):
+        variants = [(scale_directory(output_directory, factor), factor) for factor in scale_factor]
+    else:
+        variants = [(output_directory, scale_factor)]
+    # Normalized, so that the directory of every output file is its variant's manifest key
+    variants = [(os.path.normpath(directory), factor) for directory, factor in variants]
+
+    manifests = {}
+    for directory, _ in variants:
+        # Ensure the output directory exists
+        os.makedirs(directory, exist_ok=True)
+        manifests[directory] = load_manifest(directory)
+
+    summary = {'rescaled': [], 'skipped': [], 'failed': []}
+    jobs = {}
+    for filename in sorted(os.listdir(input_directory)):
+        if not filename.endswith('.ply'):
+            continue
+        input_file = os.path.join(input_directory, filename)
+        previous = next((manifests[directory][filename]['source'] for directory, _ in variants
+                         if filename in manifests[directory]), None)
+        source = _source_entry(input_file, previous)
+
+        outputs = []
+        for directory, factor in variants:
+            output_file = os.path.join(directory, filename)
+            entry = manifests[directory].get(filename)
+            if (entry and os.path.exists(output_file) and entry['source']['sha1'] == source['sha1']
+                    and entry['scale_factor'] == factor and entry['binary'] == binary):
+                summary['skipped'].append(output_file)
+            else:
+                outputs.append((output_file, factor))
+        if outputs:
+            jobs[input_file] = (filename, source, outputs)
+
+    if jobs:
+        for input_file, error in _run_jobs(jobs, binary, min(num_workers or os.cpu_count(), len(jobs))):
+            filename, source, outputs = jobs[input_file]
+            if error is not None:
+                print(f"Error: failed to rescale {input_file}: {error}")
+                summary['failed'].extend(output_file for output_file, _ in outputs)
+                continue
 
-    for filename in os.listdir(input_directory):
-        if filename.endswith('.ply'):
-            input_file = os.path.join(input_directory, filename)
-            output_file = os.path.join(output_directory, filename)
+            for output_file, factor in outputs:
+                directory = os.path.dirname(output_file)
+                manifests[directory][filename] = {'source': source, 'scale_factor': factor, 'binary': binary}
+                summary['rescaled'].append(output_file)
+            for directory in {os.path.dirname(output_file) for output_file, _ in outputs}:
+                save_manifest(directory, manifests[directory])
 
-            # Rescale the .ply file vertices
-            rescale_ply_vertices(input_file, output_file, scale_factor)
+    print(f"Rescaled {len(summary['rescaled'])} files in {'binary' if binary else 'ASCII'} format, "
+          f"{len(summary['skipped'])} up to date, {len(summary['failed'])} failed")
+    return summary
 
 
-# Specify the directory containing the original .ply files
-input_directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_library'
+if __name__ == "__main__":
+    # Specify the directory containing the original .ply files
+    input_directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_library'
 
-# Specify the output directory where rescaled .ply files will be saved
-output_directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+    # Specify the output directory where rescaled .ply files will be saved
+    output_directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
 
-# Process all .ply files in the input directory and save them to the output directory
-process_directory(input_directory, output_directory)
+    # Process all .ply files in the input directory and save them to the output directory
+    process_directory(input_directory, output_directory)
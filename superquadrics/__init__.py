@@ -0,0 +1,5 @@
+"""
+Command-line entry point of the superquadric fitting tools, see superquadrics.cli.
+"""
+
+__version__ = '0.1.0'
@@ -0,0 +1,5 @@
+import sys
+
+from superquadrics.cli import main
+
+sys.exit(main())
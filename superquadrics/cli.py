@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import glob
+import argparse
+
+# Modules of the toolchain live in three script directories, installed next to this package
+PACKAGE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for directory in ('superquadric_fitting', 'superquadrics_fitting_tools', 'superquadric_library'):
+    sys.path.append(os.path.join(PACKAGE_ROOT, directory))
+
+# Every subcommand imports its modules when it runs, so that headless subcommands never load
+# matplotlib, open3d or the Jupyter widgets, and --help returns immediately.
+
+
+def point_cloud_paths(inputs, pattern):
+    """
+    Expands .ply files and directories of .ply files into a sorted list of paths.
+    """
+    paths = []
+    for path in inputs:
+        paths.extend(sorted(glob.glob(os.path.join(path, pattern))) if os.path.isdir(path) else [path])
+    return paths
+
+
+def convert(args):
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 ** 2)
+    if os.path.isdir(args.source):
+        if args.models is None:
+            sys.exit("error: converting a dataset root needs --models, the directory of the .obj files")
+        from transfer_scene2ply import process_dataset_to_ply
+        summary = process_dataset_to_ply(args.source, args.models, args.output, args.samples, args.workers,
+                                         memory_budget, args.sampling)
+        return 1 if summary['failed'] else 0
+
+    from obj_preprocessing import convert_obj_to_ply
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    convert_obj_to_ply(args.source, args.output, num_samples=args.samples, seed=args.seed,
+                       approximate=args.approximate, binary=not args.ascii, memory_budget=memory_budget,
+                       sampling=args.sampling)
+    return 0
+
+
+def rescale(args):
+    from rescale import process_directory
+    scale_factor = args.scale[0] if len(args.scale) == 1 else args.scale
+    summary = process_directory(args.input_dir, args.output_dir, scale_factor, binary=not args.ascii,
+                                num_workers=args.workers)
+    return 1 if summary['failed'] else 0
+
+
+def reconstruct(args, argv):
+    # batch_reconstruct has its own argument parser; all remaining arguments are passed on
+    from batch_reconstruct import main
+    main(argv)
+    return 0
+
+
+def assemble(args):
+    from scene_assembly import assemble_dataset
+    assemble_dataset(args.dataset_root, args.fittings, args.output_dir, args.translation_unit, args.clouds,
+                     args.library)
+    return 0
+
+
+def pack(args):
+    from fit_dataset import pack_fit_dataset
+    pack_fit_dataset(args.fittings, args.output, args.objects, args.k_max)
+    return 0
+
+
+def sheet(args):
+    from thumbnails import render_contact_sheet
+    render_contact_sheet(args.fittings, args.output, args.clouds, args.cache_dir, args.objects, args.columns,
+                         args.size, args.workers)
+    return 0
+
+
+def fit(args):
+    if args.gui:
+        if len(args.inputs) != 1 or args.library is None:
+            sys.exit("error: --gui takes one object .ply file and --library")
+        # The GUI module shares its name with the superquadric_fitting directory; the module wins
+        from superquadric_fitting import run_gui
+        run_gui(args.inputs[0], args.library, args.output_dir)
+        return 0
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.refit:
+        from refit import refit_directory
+        kwargs = {'continuous_eps': True} if args.continuous_eps else {}
+        if args.decompose:
+            kwargs.update(max_primitives=args.max_primitives, time_budget=args.time_budget)
+        failed = []
+        for path in args.inputs:
+            directory, pattern = (path, args.pattern) if os.path.isdir(path) else os.path.split(path)
+            summary = refit_directory(directory, args.output_dir, pattern, args.workers, args.force,
+                                      args.decompose, **kwargs)
+            failed.extend(summary['failed'])
+        return 1 if failed else 0
+
+    if args.decompose:
+        from decompose import decompose_directory, decompose_object
+        kwargs = {'max_primitives': args.max_primitives, 'time_budget': args.time_budget,
+                  'continuous_eps': args.continuous_eps}
+        revisions = []
+        for path in args.inputs:
+            if os.path.isdir(path):
+                revisions.extend(decompose_directory(path, args.output_dir, args.pattern, args.workers, **kwargs))
+            else:
+                revisions.append(decompose_object(path, args.output_dir, **kwargs))
+        return 1 if None in revisions else 0
+
+    from superquadric_fitter import fit_object
+    for path in point_cloud_paths(args.inputs, args.pattern):
+        fit_object(path, args.output_dir, continuous_eps=args.continuous_eps)
+    return 0
+
+
+def view(args):
+    fitting_paths = [path for path in args.paths if path.endswith('.json')]
+    library_paths = [path for path in args.paths if os.path.isdir(path)]
+    ply_paths = [path for path in args.paths if path.endswith('.ply')]
+
+    if fitting_paths:
+        from vis_reconstruct import visualize_fitted_shape
+        for path in fitting_paths:
+            visualize_fitted_shape(path, args.library)
+    if library_paths:
+        from vis_primitive import visualize_superquadric_primitives
+        eps_values = [0, 0.5, 1.0, 1.5, 2.0]
+        for path in library_paths:
+            visualize_superquadric_primitives(eps_values, eps_values, path)
+    if ply_paths and args.samples:
+        from vis_ply import visualize_ply_point_cloud
+        for path in ply_paths:
+            visualize_ply_point_cloud(path, args.samples)
+    elif ply_paths:
+        from vis_ply_noFPS import visualize_multiple_ply_point_clouds
+        limits = (-args.limit, args.limit) if args.limit else None
+        visualize_multiple_ply_point_clouds(ply_paths, limits, limits, limits)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='superquadrics', description='Superquadric fitting tools.')
+    parser.add_argument('--profile', default=None, help='Record a Chrome trace of the pipeline stages to this path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_convert = subparsers.add_parser('convert', help='Convert .obj models to .ply point clouds')
+    parser_convert.add_argument('source', help='An .obj or .ply file, or a dataset root of scene_gt.json files')
+    parser_convert.add_argument('output', help='The .ply file to write, or the output directory for a dataset root')
+    parser_convert.add_argument('--models', default=None, help='Directory of the <obj_id>_obj.obj files of a dataset')
+    parser_convert.add_argument('--samples', type=int, default=8000, help='Number of points of every point cloud')
+    parser_convert.add_argument('--sampling', choices=['vertices', 'surface', 'poisson'], default='vertices',
+                                help='Farthest point sampling of the mesh vertices, area-weighted points on the '
+                                     'faces, or evenly spread (Poisson-disk) points on the faces, with normals')
+    parser_convert.add_argument('--seed', type=int, default=None, help='Seed of the first sampled point')
+    parser_convert.add_argument('--approximate', action='store_true', help='Use the approximate, faster sampling')
+    parser_convert.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser_convert.add_argument('--memory-budget', type=float, default=None,
+                                help='Stream large inputs in this many MB of working memory per process')
+    parser_convert.add_argument('--ascii', action='store_true', help='Write ASCII instead of binary .ply files')
+
+    parser_rescale = subparsers.add_parser('rescale', help='Rescale a directory of .ply primitives')
+    parser_rescale.add_argument('input_dir', help='Directory of the original .ply files')
+    parser_rescale.add_argument('output_dir', help='Directory to write the rescaled .ply files to')
+    parser_rescale.add_argument('--scale', type=float, nargs='+', default=[10],
+                                help='Factor to divide every coordinate by; several factors build one '
+                                     'scale_<factor> subdirectory each')
+    parser_rescale.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser_rescale.add_argument('--ascii', action='store_true', help='Write ASCII instead of binary .ply files')
+
+    # Arguments of batch_reconstruct, see superquadrics reconstruct --help
+    subparsers.add_parser('reconstruct', add_help=False, help='Reconstruct point clouds from fittings')
+
+    parser_assemble = subparsers.add_parser('assemble',
+                                            help='Place the fitted primitives of every scene with its object poses')
+    parser_assemble.add_argument('dataset_root', help='Dataset root searched for scene_gt.json files')
+    parser_assemble.add_argument('fittings', help='Fitting info directory, or a fit store file')
+    parser_assemble.add_argument('output_dir', help='Directory to write <scene>_primitives.npz files to')
+    parser_assemble.add_argument('--translation-unit', type=float, default=1.0,
+                                 help='Factor converting cam_t_m2c to fitting units, e.g. 0.001 for millimeters')
+    parser_assemble.add_argument('--clouds', action='store_true', help='Also write a merged .ply cloud per view')
+    parser_assemble.add_argument('--library', default=None,
+                                 help='superquadric_lib_rescale directory for the clouds; sampled analytically if omitted')
+
+    parser_pack = subparsers.add_parser('pack', help='Pack the fittings into one padded array file for training')
+    parser_pack.add_argument('fittings', help='Fitting info directory, or a fit store file')
+    parser_pack.add_argument('output', help='The .npz file to write, read back with fit_dataset.FitDataset')
+    parser_pack.add_argument('--objects', nargs='+', default=None, help='Object IDs to pack; all if omitted')
+    parser_pack.add_argument('--k-max', type=int, default=None,
+                             help='Primitive slots per object; defaults to the largest fitting')
+
+    parser_sheet = subparsers.add_parser('sheet', help='Render a contact sheet of fitting thumbnails for review')
+    parser_sheet.add_argument('fittings', help='Fitting info directory, or a fit store file')
+    parser_sheet.add_argument('output', help='The .png file to write, with a .json index of its cells next to it')
+    parser_sheet.add_argument('--clouds', default=None, help='point_cloud_lib directory drawn under the primitives')
+    parser_sheet.add_argument('--cache-dir', default=None,
+                              help='Thumbnail cache; defaults to .thumbnails next to the output')
+    parser_sheet.add_argument('--objects', nargs='+', default=None, help='Object IDs of a fit store; all if omitted')
+    parser_sheet.add_argument('--columns', type=int, default=None, help='Thumbnails per row')
+    parser_sheet.add_argument('--size', type=int, default=192, help='Side of one thumbnail view in pixels')
+    parser_sheet.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+
+    parser_fit = subparsers.add_parser('fit', help='Fit superquadrics to object point clouds')
+    parser_fit.add_argument('inputs', nargs='+', help='Object .ply files or directories of them')
+    parser_fit.add_argument('--output-dir', required=True, help='Fitting info directory holding the fit store')
+    parser_fit.add_argument('--pattern', default='*_obj.ply', help='Glob pattern used with input directories')
+    parser_fit.add_argument('--decompose', action='store_true',
+                            help='Fit several primitives per object; with --refit, objects without a fitting')
+    parser_fit.add_argument('--refit', action='store_true',
+                            help='Only refit objects whose cloud changed, starting from their stored fitting')
+    parser_fit.add_argument('--force', action='store_true', help='Refit unchanged objects too with --refit')
+    parser_fit.add_argument('--max-primitives', type=int, default=6, help='Primitive limit with --decompose')
+    parser_fit.add_argument('--time-budget', type=float, default=30.0,
+                            help='Seconds per object with --decompose')
+    parser_fit.add_argument('--continuous-eps', action='store_true',
+                            help='Keep continuous shape exponents instead of snapping to the library grid')
+    parser_fit.add_argument('--workers', type=int, default=None,
+                            help='Number of worker processes for directories with --decompose or --refit')
+    parser_fit.add_argument('--gui', action='store_true', help='Fit one object by hand in the interactive window')
+    parser_fit.add_argument('--library', default=None,
+                            help='superquadric_lib_rescale directory listing the primitives of the GUI')
+
+    parser_view = subparsers.add_parser('view', help='Show point clouds, fittings or a primitive library')
+    parser_view.add_argument('paths', nargs='+',
+                             help='.ply point clouds, fitting info .json files or primitive library directories')
+    parser_view.add_argument('--samples', type=int, default=None,
+                             help='Show each point cloud downsampled to this many points')
+    parser_view.add_argument('--limit', type=float, default=None, help='Axis limits +-limit of point cloud plots')
+    parser_view.add_argument('--library', default=None,
+                             help='superquadric_lib_rescale directory; fittings are sampled analytically if omitted')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, remaining = parser.parse_known_args(argv)
+    if args.command != 'reconstruct' and remaining:
+        parser.error(f"unrecognized arguments: {' '.join(remaining)}")
+
+    if args.profile:
+        from profiling import enable
+        enable(args.profile)
+
+    if args.command == 'reconstruct':
+        return reconstruct(args, remaining)
+    return {'convert': convert, 'rescale': rescale, 'assemble': assemble, 'pack': pack,
+            'sheet': sheet, 'fit': fit, 'view': view}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
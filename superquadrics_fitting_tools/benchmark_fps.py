@@ -0,0 +1,73 @@
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+from fps_sampling import farthest_point_sampling
+
+
+def reference_farthest_point_sampling(vertices, num_samples):
+    """
+    The original implementation previously copied into obj_preprocessing.py and vis_ply.py.
+    """
+    sampled_indices = np.zeros(num_samples, dtype=int)
+    sampled_indices[0] = np.random.randint(len(vertices))
+    distances = np.linalg.norm(vertices - vertices[sampled_indices[0]], axis=1)
+
+    for i in range(1, num_samples):
+        sampled_indices[i] = np.argmax(distances)
+        new_distances = np.linalg.norm(vertices - vertices[sampled_indices[i]], axis=1)
+        distances = np.minimum(distances, new_distances)
+
+    return vertices[sampled_indices]
+
+
+def synthetic_surface(num_vertices, seed=0):
+    """
+    Generates vertices on the surface of an ellipsoid with MetaGraspNet-like dimensions.
+    """
+    rng = np.random.default_rng(seed)
+    directions = rng.standard_normal((num_vertices, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return directions * [0.05, 0.03, 0.08]
+
+
+def coverage_radius(vertices, samples):
+    """
+    Largest distance from any vertex to its nearest sample; lower is a better spread.
+    """
+    return cKDTree(samples).query(vertices)[0].max()
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_benchmark(sizes=(50000, 200000, 1000000), num_samples=8000, reference_limit=200000):
+    """
+    Times the original FPS against the shared exact and approximate implementations.
+
+    :param sizes: Numbers of input vertices to benchmark.
+    :param num_samples: Number of points to sample, as used by transfer_scene2ply.
+    :param reference_limit: The original implementation is skipped above this many vertices.
+    """
+    print(f"{'vertices':>10} {'method':>12} {'seconds':>9} {'speedup':>8} {'coverage':>9}")
+    for num_vertices in sizes:
+        vertices = synthetic_surface(num_vertices)
+        baseline = None
+        if num_vertices <= reference_limit:
+            np.random.seed(0)
+            baseline, _ = time_call(reference_farthest_point_sampling, vertices, num_samples)
+            print(f"{num_vertices:>10} {'reference':>12} {baseline:>9.2f} {1.0:>8.1f} {'':>9}")
+
+        for method, approximate in (('exact', False), ('approximate', True)):
+            seconds, samples = time_call(farthest_point_sampling, vertices, num_samples, seed=0,
+                                         approximate=approximate)
+            speedup = f'{baseline / seconds:.1f}' if baseline else '-'
+            coverage = coverage_radius(vertices[::10], samples)
+            print(f"{num_vertices:>10} {method:>12} {seconds:>9.2f} {speedup:>8} {coverage:>9.4f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,111 @@
+import os
+import sys
+import numpy as np
+
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from profiling import traced
+
+
+def farthest_point_indices(vertices, num_samples, seed=None):
+    """
+    Exact farthest point sampling, returning the indices of the sampled vertices.
+
+    Coordinates are kept as three contiguous float32 columns and every iteration updates the
+    squared distances in preallocated buffers, so the loop does not allocate.
+
+    :param vertices: (N, 3) array of vertices from the point cloud.
+    :param num_samples: Number of points to sample.
+    :param seed: Seed for choosing the first point, or None for a random start.
+    :return: (num_samples,) array of indices into vertices.
+    """
+    num_vertices = len(vertices)
+    num_samples = min(num_samples, num_vertices)
+    columns = np.ascontiguousarray(np.asarray(vertices, dtype=np.float32).T)
+    x, y, z = columns
+
+    sampled_indices = np.empty(num_samples, dtype=np.int64)
+    distances = np.full(num_vertices, np.inf, dtype=np.float32)
+    new_distances = np.empty(num_vertices, dtype=np.float32)
+    buffer = np.empty(num_vertices, dtype=np.float32)
+
+    index = np.random.default_rng(seed).integers(num_vertices)
+    for i in range(num_samples):
+        sampled_indices[i] = index
+        px, py, pz = columns[:, index]
+
+        np.subtract(x, px, out=new_distances)
+        np.multiply(new_distances, new_distances, out=new_distances)
+        np.subtract(y, py, out=buffer)
+        np.multiply(buffer, buffer, out=buffer)
+        np.add(new_distances, buffer, out=new_distances)
+        np.subtract(z, pz, out=buffer)
+        np.multiply(buffer, buffer, out=buffer)
+        np.add(new_distances, buffer, out=new_distances)
+
+        np.minimum(distances, new_distances, out=distances)
+        index = np.argmax(distances)
+
+    return sampled_indices
+
+
+def voxel_grid(vertices, target_count):
+    """
+    Finds a voxel size at which the vertices occupy at least about target_count voxels.
+
+    :param vertices: (N, 3) array of vertices.
+    :param target_count: Approximate number of occupied voxels wanted.
+    :return: Tuple (voxel_size, indices of one vertex per occupied voxel).
+    """
+    vertices = np.asarray(vertices, dtype=np.float32)
+    lower = vertices.min(axis=0)
+    extent = np.maximum(vertices.max(axis=0) - lower, 1e-9)
+
+    # Start from the voxel size of a filled bounding box, then shrink it, since surfaces only
+    # occupy a small fraction of the voxels
+    voxel_size = np.cbrt(np.prod(extent) / target_count)
+    representatives = None
+    for _ in range(8):
+        keys = np.floor((vertices - lower) / voxel_size).astype(np.int64)
+        dims = keys.max(axis=0) + 1
+        flat_keys = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+        _, representatives = np.unique(flat_keys, return_index=True)
+        if len(representatives) >= target_count:
+            break
+        voxel_size *= np.sqrt(len(representatives) / target_count)
+    return voxel_size, representatives
+
+
+def voxel_representatives(vertices, target_count):
+    """
+    Picks one vertex per occupied voxel, with the voxel size chosen to keep about target_count vertices.
+
+    :param vertices: (N, 3) array of vertices.
+    :param target_count: Approximate number of representatives to keep.
+    :return: Array of indices into vertices, one per occupied voxel.
+    """
+    return voxel_grid(vertices, target_count)[1]
+
+
+@traced('farthest_point_sampling', points='vertices')
+def farthest_point_sampling(vertices, num_samples, seed=None, approximate=False, oversampling=4):
+    """
+    Perform farthest point sampling to downsample the point cloud.
+
+    :param vertices: (N, 3) array of vertices from the point cloud.
+    :param num_samples: Number of points to sample.
+    :param seed: Seed for choosing the first point, or None for a random start.
+    :param approximate: Run FPS only over one vertex per voxel, with voxels sized to keep about
+                        oversampling * num_samples candidates. Intended for meshes with millions
+                        of vertices; the result is no longer an exact FPS of the input.
+    :param oversampling: Candidates kept per requested sample in approximate mode.
+    :return: (num_samples, 3) array of sampled vertices.
+    """
+    vertices = np.asarray(vertices)
+    candidates = None
+    if approximate and len(vertices) > oversampling * num_samples:
+        candidates = voxel_representatives(vertices, oversampling * num_samples)
+
+    if candidates is None:
+        return vertices[farthest_point_indices(vertices, num_samples, seed)]
+    return vertices[candidates[farthest_point_indices(vertices[candidates], num_samples, seed)]]
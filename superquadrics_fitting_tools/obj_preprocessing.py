@@ -1,30 +1,21 @@
 import os
+import sys
 import trimesh
-import numpy as np
-import matplotlib.pyplot as plt
 
+from fps_sampling import farthest_point_sampling
+from surface_sampling import sample_surface, poisson_disk_sample
+from stream_preprocessing import stream_convert_to_ply
 
-def farthest_point_sampling(vertices, num_samples):
-    """
-    Perform farthest point sampling to downsample the point cloud.
-
-    :param vertices: (N, 3) array of vertices from the point cloud.
-    :param num_samples: Number of points to sample.
-    :return: (num_samples, 3) array of sampled vertices.
-    """
-    sampled_indices = np.zeros(num_samples, dtype=int)
-    sampled_indices[0] = np.random.randint(len(vertices))
-    distances = np.linalg.norm(vertices - vertices[sampled_indices[0]], axis=1)
-
-    for i in range(1, num_samples):
-        sampled_indices[i] = np.argmax(distances)
-        new_distances = np.linalg.norm(vertices - vertices[sampled_indices[i]], axis=1)
-        distances = np.minimum(distances, new_distances)
-
-    return vertices[sampled_indices]
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from ply_writer import write_ply
+from profiling import traced
 
 
 def visualize_point_cloud(ply_file):
+    # Imported here, so that conversion also runs without a GUI backend
+    import matplotlib.pyplot as plt
+
     fig = plt.figure(figsize=(10, 10))
     ax = fig.add_subplot(111, projection='3d')
 
@@ -42,30 +33,68 @@ def visualize_point_cloud(ply_file):
     plt.show()
 
 
-def convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=None):
+# Point sampling modes of convert_obj_to_ply
+SAMPLING_MODES = ('vertices', 'surface', 'poisson')
+
+
+@traced('convert_obj_to_ply', read='obj_file_path', written='ply_file_path')
+def convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=None, seed=None, approximate=False, binary=True,
+                       memory_budget=None, sampling='vertices'):
+    """
+    Converts a mesh to a .ply point cloud.
+
+    :param num_samples: Number of points to keep; all vertices if None in 'vertices' mode.
+    :param seed: Seed of the sampling.
+    :param approximate: Run FPS over one vertex per voxel, see farthest_point_sampling.
+    :param memory_budget: Stream the vertices through this many bytes of working memory, see
+                          stream_convert_to_ply; only used in 'vertices' mode.
+    :param sampling: 'vertices' keeps mesh vertices by farthest point sampling. 'surface' draws
+                     area-weighted points over the faces, so uneven tessellation does not cluster
+                     them, and 'poisson' thins such points to an evenly spread blue-noise set.
+                     Both write the face normal of every point, see load_point_normals, and fall
+                     back to 'vertices' for inputs without faces.
+    :return: (num_samples, 3) array of point normals in the surface modes, otherwise None.
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling {sampling!r}, expected one of {', '.join(SAMPLING_MODES)}")
+
+    # Meshes too large to load at once are streamed through a bounded buffer instead
+    if memory_budget is not None and sampling == 'vertices':
+        stream_convert_to_ply(obj_file_path, ply_file_path, num_samples, seed, memory_budget, binary=binary)
+        print(f"Converted {obj_file_path} to {ply_file_path}")
+        return None
+
     mesh = trimesh.load_mesh(obj_file_path)
     vertices = mesh.vertices
+    faces = getattr(mesh, 'faces', None)
 
-    if num_samples and num_samples < len(vertices):
-        vertices = farthest_point_sampling(vertices, num_samples)
+    normals = None
+    if sampling != 'vertices' and (faces is None or not len(faces)):
+        print(f"Warning: {obj_file_path} has no faces, sampling its vertices instead")
+    elif sampling != 'vertices':
+        if not num_samples:
+            raise ValueError(f"Sampling mode {sampling!r} needs num_samples")
+        sample = sample_surface if sampling == 'surface' else poisson_disk_sample
+        vertices, normals = sample(vertices, faces, num_samples, seed=seed)
 
-    point_cloud = trimesh.points.PointCloud(vertices)
+    if normals is None and num_samples and num_samples < len(vertices):
+        vertices = farthest_point_sampling(vertices, num_samples, seed=seed, approximate=approximate)
 
-    with open(ply_file_path, 'w') as f:
-        point_cloud.export(f, file_type='ply', encoding='ascii')
+    write_ply(ply_file_path, vertices, binary=binary, normals=normals)
 
     print(f"Converted {obj_file_path} to {ply_file_path}")
+    return normals
 
 
-# Paths
-obj_file_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/model_auto/097_obj.obj'
-output_dir = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'
-custom_ply_file_name = '097_obj.ply'
-ply_file_path = os.path.join(output_dir, custom_ply_file_name)
-
-num_samples = 8000  # Downsample to 5000 points
+if __name__ == "__main__":
+    # Paths
+    obj_file_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/model_auto/097_obj.obj'
+    output_dir = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'
+    custom_ply_file_name = '097_obj.ply'
+    ply_file_path = os.path.join(output_dir, custom_ply_file_name)
 
-os.makedirs(output_dir, exist_ok=True)
-convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=num_samples)
-visualize_point_cloud(ply_file_path)
+    num_samples = 8000  # Downsample to 5000 points
 
+    os.makedirs(output_dir, exist_ok=True)
+    convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=num_samples)
+    visualize_point_cloud(ply_file_path)
@@ -0,0 +1,286 @@
+import os
+import sys
+import mmap
+import tempfile
+from itertools import islice
+import numpy as np
+
+from fps_sampling import farthest_point_indices, voxel_grid
+
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from ply_writer import PlyStreamWriter
+from profiling import traced
+
+# Default working memory of a streaming conversion, in bytes
+MEMORY_BUDGET = 512 * 1024 ** 2
+
+# Working memory per point of a chunk being parsed or voxelized, including text parsing temporaries
+CHUNK_BYTES_PER_POINT = 256
+
+# Working memory per FPS candidate: coordinates, voxel keys and the FPS distance buffers
+CANDIDATE_BYTES_PER_POINT = 64
+
+# NumPy types of the PLY property types
+PLY_TYPES = {'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1', 'short': 'i2', 'int16': 'i2',
+             'ushort': 'u2', 'uint16': 'u2', 'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+             'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8'}
+
+
+def read_ply_header(f):
+    """
+    Reads a PLY header from a file opened in binary mode, leaving the file at the element data.
+
+    :return: Tuple (format, elements) with format 'ascii', 'binary_little_endian' or
+             'binary_big_endian', and elements a list of (name, count, properties) where
+             properties is a list of (name, type), with type None for list properties.
+    """
+    if f.readline().strip() != b'ply':
+        raise ValueError(f"Not a PLY file: {f.name}")
+    encoding, elements = None, []
+    for line in f:
+        words = line.decode('ascii').split()
+        if not words or words[0] in ('comment', 'obj_info'):
+            continue
+        if words[0] == 'end_header':
+            return encoding, elements
+        if words[0] == 'format':
+            encoding = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property':
+            elements[-1][2].append((words[-1], None if words[1] == 'list' else words[1]))
+    raise ValueError(f"Truncated PLY header: {f.name}")
+
+
+def iter_ply_vertices(file_path, chunk_size):
+    """
+    Reads the vertex coordinates of an ASCII or binary .ply file in chunks.
+
+    The vertex element must come first and must not have list properties, as in every point
+    cloud and mesh written by this project.
+
+    :return: Iterator of (n, 3) float32 arrays with n <= chunk_size.
+    """
+    with open(file_path, 'rb') as f:
+        encoding, elements = read_ply_header(f)
+        name, count, properties = elements[0] if elements else (None, 0, [])
+        if name != 'vertex' or any(type is None for _, type in properties):
+            raise ValueError(f"Expected a vertex element of scalar properties first in {file_path}")
+        names = [property_name for property_name, _ in properties]
+        columns = [names.index(axis) for axis in 'xyz']
+
+        if encoding == 'ascii':
+            for start in range(0, count, chunk_size):
+                lines = list(islice(f, min(chunk_size, count - start)))
+                yield np.loadtxt(lines, usecols=columns, dtype=np.float32, ndmin=2)
+            return
+
+        byte_order = '<' if encoding == 'binary_little_endian' else '>'
+        dtype = np.dtype([(property_name, byte_order + PLY_TYPES[type]) for property_name, type in properties])
+        for start in range(0, count, chunk_size):
+            block = np.fromfile(f, dtype=dtype, count=min(chunk_size, count - start))
+            if len(block) == 0:
+                raise ValueError(f"Truncated vertex data in {file_path}")
+            yield np.stack([block['x'], block['y'], block['z']], axis=1).astype(np.float32)
+
+
+def iter_obj_vertices(file_path, chunk_size):
+    """
+    Reads the vertex coordinates of a Wavefront .obj file in chunks, ignoring faces and any
+    per-vertex colors.
+
+    :return: Iterator of (n, 3) float32 arrays with n <= chunk_size.
+    """
+    lines = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.startswith('v '):
+                lines.append(line)
+                if len(lines) == chunk_size:
+                    yield np.loadtxt(lines, usecols=(1, 2, 3), dtype=np.float32, ndmin=2)
+                    lines = []
+    if lines:
+        yield np.loadtxt(lines, usecols=(1, 2, 3), dtype=np.float32, ndmin=2)
+
+
+def iter_vertex_chunks(file_path, chunk_size):
+    """
+    Reads the vertices of an .obj or .ply file in chunks of at most chunk_size vertices.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.obj':
+        return iter_obj_vertices(file_path, chunk_size)
+    if extension == '.ply':
+        return iter_ply_vertices(file_path, chunk_size)
+    raise ValueError(f"Unsupported file type: {file_path}")
+
+
+class VertexBuffer:
+    """
+    Float32 vertex buffer in a temporary file, appended chunk by chunk and read back through a
+    memory map, so that the vertices of an input never have to fit in memory at once. The file
+    is removed when the buffer is closed. Use as a context manager:
+
+        with VertexBuffer(directory) as buffer:
+            for chunk in iter_vertex_chunks(path, chunk_size):
+                buffer.append(chunk)
+            for start, chunk in buffer.chunks(chunk_size):
+                ...
+    """
+
+    def __init__(self, directory=None):
+        descriptor, self.path = tempfile.mkstemp(suffix='.f32', dir=directory)
+        self._file = os.fdopen(descriptor, 'wb')
+        self.count = 0
+        self.lower = np.full(3, np.inf, dtype=np.float32)
+        self.upper = np.full(3, -np.inf, dtype=np.float32)
+
+    def append(self, vertices):
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        if len(vertices) == 0:
+            return
+        vertices.tofile(self._file)
+        self.count += len(vertices)
+        np.minimum(self.lower, vertices.min(axis=0), out=self.lower)
+        np.maximum(self.upper, vertices.max(axis=0), out=self.upper)
+
+    def chunks(self, chunk_size):
+        """
+        Iterates over the buffered vertices in order.
+
+        :return: Iterator of (start index, (n, 3) float32 array) with n <= chunk_size. The arrays
+                 are copies, and the mapped pages are dropped from the resident set once copied.
+        """
+        self._file.flush()
+        if self.count == 0:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, self.count, chunk_size):
+                stop = min(start + chunk_size, self.count)
+                view = np.frombuffer(mapped, dtype=np.float32, count=3 * (stop - start), offset=12 * start)
+                chunk = view.reshape(-1, 3).copy()
+                del view
+                if hasattr(mmap, 'MADV_DONTNEED'):
+                    begin = 12 * start // mmap.PAGESIZE * mmap.PAGESIZE
+                    mapped.madvise(mmap.MADV_DONTNEED, begin, 12 * stop - begin)
+                yield start, chunk
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _voxel_keys(points, lower, upper, voxel_size):
+    dims = np.floor((upper - lower) / voxel_size).astype(np.int64) + 1
+    keys = np.minimum(np.floor((points - lower) / voxel_size).astype(np.int64), dims - 1)
+    return (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+
+
+def voxel_reduce(buffer, target_count, max_count, chunk_size):
+    """
+    Keeps the first vertex of every occupied voxel, in one pass over a VertexBuffer.
+
+    The voxel size is estimated on an evenly strided subset of at most max_count vertices, so
+    that about target_count voxels are occupied. If more than max_count voxels fill up during the
+    pass, the voxel size grows and the kept vertices are merged into the coarser voxels, so the
+    memory used stays bounded by max_count whatever the size of the input.
+
+    :param buffer: VertexBuffer holding the vertices.
+    :param target_count: Approximate number of vertices to keep.
+    :param max_count: Maximum number of vertices to keep, at least target_count.
+    :param chunk_size: Vertices read per chunk.
+    :return: (M, 3) float32 array of the kept vertices, M <= max_count.
+    """
+    stride = -(-buffer.count // max_count)
+    # Copies, since a strided view would keep its whole chunk alive
+    subset = np.concatenate([chunk[(-start) % stride::stride].copy() for start, chunk in buffer.chunks(chunk_size)])
+    voxel_size, _ = voxel_grid(subset, min(target_count, len(subset)))
+    del subset
+
+    kept = np.empty((0, 3), dtype=np.float32)
+    kept_keys = np.empty(0, dtype=np.int64)
+    for _, chunk in buffer.chunks(chunk_size):
+        # Kept vertices come first, so they stay the representatives of their voxels
+        points = np.concatenate([kept, chunk])
+        kept_keys, first = np.unique(np.concatenate([kept_keys, _voxel_keys(chunk, buffer.lower, buffer.upper,
+                                                                             voxel_size)]), return_index=True)
+        kept = points[first]
+        while len(kept) > max_count:
+            # Occupied voxels of a surface scale with the inverse square of the voxel size
+            voxel_size *= max(1.25, np.sqrt(len(kept) / target_count))
+            kept_keys, first = np.unique(_voxel_keys(kept, buffer.lower, buffer.upper, voxel_size), return_index=True)
+            kept = kept[first]
+    return kept
+
+
+@traced('stream_convert_to_ply', read='input_path', written='ply_file_path')
+def stream_convert_to_ply(input_path, ply_file_path, num_samples=None, seed=None, memory_budget=MEMORY_BUDGET,
+                          oversampling=4, buffer_directory=None, binary=True):
+    """
+    Converts an .obj mesh or .ply point cloud of any size to a downsampled .ply point cloud
+    within a fixed memory budget.
+
+    Vertices are read in chunks into a float32 buffer file. When sampling, one pass reduces them
+    to one vertex per voxel, with voxels sized to keep about oversampling * num_samples
+    candidates, and farthest point sampling runs over the candidates, as with
+    farthest_point_sampling(approximate=True). The result is written block by block.
+
+    :param input_path: Path of the .obj or .ply file to convert.
+    :param ply_file_path: Path of the .ply file to write.
+    :param num_samples: Number of points to sample; every vertex is written if None.
+    :param seed: Seed for choosing the first point, or None for a random start.
+    :param memory_budget: Approximate peak working memory in bytes, independent of the input size.
+                          It also caps the number of FPS candidates, and so the samples.
+    :param oversampling: Candidates kept per requested sample.
+    :param buffer_directory: Directory of the temporary buffer file, by default that of the output.
+                             A tmpfs directory such as /tmp on some systems would hold it in memory.
+    :param binary: Write binary little-endian PLY; set to False for ASCII output.
+    :return: Number of points written.
+    """
+    chunk_size = max(1024, memory_budget // 2 // CHUNK_BYTES_PER_POINT)
+    max_candidates = max(1024, memory_budget // 2 // CANDIDATE_BYTES_PER_POINT)
+    if buffer_directory is None:
+        buffer_directory = os.path.dirname(os.path.abspath(ply_file_path))
+
+    with VertexBuffer(buffer_directory) as buffer:
+        for chunk in iter_vertex_chunks(input_path, chunk_size):
+            buffer.append(chunk)
+        if buffer.count == 0:
+            raise ValueError(f"No vertices in {input_path}")
+
+        with PlyStreamWriter(ply_file_path, binary=binary) as writer:
+            if num_samples is None or num_samples >= buffer.count:
+                for _, chunk in buffer.chunks(chunk_size):
+                    writer.write(chunk)
+                return writer.vertex_count
+
+            target_count = min(oversampling * num_samples, max_candidates)
+            if buffer.count <= target_count:
+                candidates = np.concatenate([chunk for _, chunk in buffer.chunks(chunk_size)])
+            else:
+                candidates = voxel_reduce(buffer, target_count, max_candidates, chunk_size)
+            if len(candidates) < num_samples:
+                print(f"Warning: only {len(candidates)} candidates fit the memory budget, "
+                      f"sampling {len(candidates)} of {num_samples} points")
+
+            sampled = candidates[farthest_point_indices(candidates, num_samples, seed)]
+            for start in range(0, len(sampled), chunk_size):
+                writer.write(sampled[start:start + chunk_size])
+            return writer.vertex_count
+
+
+if __name__ == "__main__":
+    # Example usage paths
+    input_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/scene_clouds/scene_0001.ply'
+    ply_file_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib/scene_0001.ply'
+
+    num_points = stream_convert_to_ply(input_path, ply_file_path, num_samples=8000, memory_budget=256 * 1024 ** 2)
+    print(f"Saved {num_points} points to {ply_file_path}")
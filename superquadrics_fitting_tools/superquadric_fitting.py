@@ -1,16 +1,26 @@
 import os
-import json
+import sys
+import time
 import trimesh
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider, Button, RadioButtons
-import ipywidgets as widgets
-from IPython.display import display
+
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from superquadric_sampler import sample_primitive
+from fit_store import STORE_FILE, FitStore, cloud_entry
+
+# Points shown of the dragged superquadric while its slider moves; drawing cost grows with the marker count
+DRAG_POINTS = 1000
+
+# Minimum time between two redraws, about one frame of a 60 Hz display
+REDRAW_INTERVAL = 1 / 60
 
 def load_point_cloud(file_path):
-    # Load the .ply file
-    mesh = trimesh.load_mesh(file_path)
-    return mesh.vertices
+    # Load the .ply file; trimesh.load also handles face-less point clouds
+    mesh = trimesh.load(file_path)
+    return np.asarray(mesh.vertices)
 
 def rotation_matrix(roll, pitch, yaw):
     R_x = np.array([[1, 0, 0],
@@ -27,47 +37,114 @@ def rotation_matrix(roll, pitch, yaw):
     R = np.dot(R_z, np.dot(R_y, R_x))
     return R
 
-def update(val):
-    ax.clear()
+def decimation_indices(num_points):
+    # Fixed random subset, so the decimated cloud does not flicker between redraws
+    if num_points <= DRAG_POINTS:
+        return np.arange(num_points)
+    return np.random.default_rng(0).choice(num_points, DRAG_POINTS, replace=False)
+
+def set_scatter_points(scatter, points):
+    scatter._offsets3d = (points[:, 0], points[:, 1], points[:, 2])
+
+def transformed_superquadric(index):
+    sliders = superquadric_sliders[index]
+    vertices = superquadric_vertices_list[index]
+    if dragging:
+        vertices = vertices[superquadric_decimation[index]]
+
+    a = np.array([sliders['a1'].val, sliders['a2'].val, sliders['a3'].val]) * sliders['scale'].val
+    R = rotation_matrix(sliders['roll'].val, sliders['pitch'].val, sliders['yaw'].val)
+    # Fold the axis scaling into the matrix: (v * a) @ R.T == v @ (a[:, None] * R.T)
+    return np.dot(vertices, a[:, None] * R.T) + [sliders['tx'].val, sliders['ty'].val, sliders['tz'].val]
+
+def flush_updates():
+    global redraw_scheduled, last_redraw
+    redraw_scheduled = False
+    changed = sorted(pending_updates)
+    for index in changed:
+        set_scatter_points(superquadric_scatters[index], transformed_superquadric(index))
+    pending_updates.clear()
+    last_redraw = time.perf_counter()
+    if background is None:
+        fig.canvas.draw_idle()
+        return
+
+    # While dragging, only the moved clouds are drawn over the cached axes background, and the
+    # dragged slider over its own axes; everything else stays on screen as it is
+    fig.canvas.restore_region(background)
+    for index in changed:
+        superquadric_scatters[index].do_3d_projection()
+        ax.draw_artist(superquadric_scatters[index])
+    fig.canvas.blit(ax.bbox)
+    fig.draw_artist(drag_slider.ax)
+    fig.canvas.blit(drag_slider.ax.bbox)
+
+def update(index):
+    # Only the moved superquadric is recomputed; redraws are throttled to REDRAW_INTERVAL
+    global redraw_scheduled
+    pending_updates.add(index)
+    if redraw_scheduled:
+        return
+    wait = REDRAW_INTERVAL - (time.perf_counter() - last_redraw)
+    if wait <= 0:
+        flush_updates()
+    else:
+        redraw_scheduled = True
+        redraw_timer.interval = max(1, int(wait * 1000))
+        redraw_timer.start()
+
+def on_draw(event):
+    # Full redraws, e.g. after a resize, renew the background that drag frames are blitted onto
+    global background
+    if dragging:
+        background = fig.canvas.copy_from_bbox(ax.bbox)
+
+def on_press(event):
+    # Blit decimated clouds while a slider is dragged
+    global dragging, drag_slider
+    for index, sliders in enumerate(superquadric_sliders):
+        for key, slider in sliders.items():
+            if key not in ('primitive', 'eps') and event.inaxes is slider.ax:
+                break
+        else:
+            continue
+        break
+    else:
+        return
+    dragging = True
+    drag_slider = slider
+    # The dragged cloud is left out of the background by animating it, see on_draw
+    superquadric_scatters[index].set_animated(True)
+    fig.canvas.draw()
+    pending_updates.add(index)
+    flush_updates()
+
+def on_release(event):
+    # Restore the full-resolution clouds with one full redraw once the slider is released
+    global dragging, drag_slider, background
+    if not dragging:
+        return
+    dragging = False
+    drag_slider = None
+    background = None
+    for scatter in superquadric_scatters:
+        scatter.set_animated(False)
+    pending_updates.update(range(len(superquadric_sliders)))
+    flush_updates()
 
-    # Plot the object point cloud
-    ax.scatter(object_vertices[:, 0], object_vertices[:, 1], object_vertices[:, 2], label='Object', s=1)
+def add_superquadric(event):
+    create_superquadric(radio.value_selected)
 
-    # Plot the superquadric point clouds with updated position, scale, and shape
-    for i, sliders in enumerate(superquadric_sliders):
-        vertices = superquadric_vertices_list[i]
-        tx = sliders['tx'].val
-        ty = sliders['ty'].val
-        tz = sliders['tz'].val
-        scale = sliders['scale'].val
-        a1 = sliders['a1'].val
-        a2 = sliders['a2'].val
-        a3 = sliders['a3'].val
-        roll = sliders['roll'].val
-        pitch = sliders['pitch'].val
-        yaw = sliders['yaw'].val
-
-        R = rotation_matrix(roll, pitch, yaw)
-        transformed_vertices = np.dot(vertices * [a1, a2, a3] * scale, R.T) + [tx, ty, tz]
-
-        ax.scatter(transformed_vertices[:, 0], transformed_vertices[:, 1], transformed_vertices[:, 2],
-                   label=f'Superquadric {i + 1}', s=1)
-
-    # Set labels and show plot
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
-    ax.set_xlim([-0.2, 0.2])
-    ax.set_ylim([-0.2, 0.2])
-    ax.set_zlim([-0.2, 0.2])
-    ax.legend()
-    plt.draw()
+def create_superquadric(selected_primitive, info=None):
+    # Slider start values come from a stored fitting info record if one is given
+    def initial(key, default):
+        return default if info is None else info[key]
 
-def add_superquadric(event):
-    selected_primitive = radio.value_selected
-    superquadric_path = os.path.join(superquadric_library_path, selected_primitive)
-    vertices = load_point_cloud(superquadric_path)
+    # A stored record keeps its continuous eps1/eps2, which the library name only approximates
+    vertices = sample_primitive(selected_primitive if info is None else info)
     superquadric_vertices_list.append(vertices)
+    superquadric_decimation.append(decimation_indices(len(vertices)))
+    index = len(superquadric_vertices_list) - 1
 
     # Create new sliders for this superquadric
     slider_width = 0.65
@@ -88,27 +165,35 @@ def add_superquadric(event):
     ax_pitch = plt.axes([0.25, base_position + 8 * vertical_spacing, slider_width, slider_height], facecolor=axcolor)
     ax_yaw = plt.axes([0.25, base_position + 9 * vertical_spacing, slider_width, slider_height], facecolor=axcolor)
 
-    slider_tx = Slider(ax_tx, f'Tx {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=0)
-    slider_ty = Slider(ax_ty, f'Ty {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=0)
-    slider_tz = Slider(ax_tz, f'Tz {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=0)
-    slider_scale = Slider(ax_scale, f'Scale {len(superquadric_sliders) + 1}', 0.001, 10.0, valinit=1.0)
-    slider_a1 = Slider(ax_a1, f'a1 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=1.0)
-    slider_a2 = Slider(ax_a2, f'a2 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=1.0)
-    slider_a3 = Slider(ax_a3, f'a3 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=1.0)
-    slider_roll = Slider(ax_roll, f'Roll {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=0)
-    slider_pitch = Slider(ax_pitch, f'Pitch {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=0)
-    slider_yaw = Slider(ax_yaw, f'Yaw {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=0)
-
-    slider_tx.on_changed(update)
-    slider_ty.on_changed(update)
-    slider_tz.on_changed(update)
-    slider_scale.on_changed(update)
-    slider_a1.on_changed(update)
-    slider_a2.on_changed(update)
-    slider_a3.on_changed(update)
-    slider_roll.on_changed(update)
-    slider_pitch.on_changed(update)
-    slider_yaw.on_changed(update)
+    slider_tx = Slider(ax_tx, f'Tx {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=initial('tx', 0))
+    slider_ty = Slider(ax_ty, f'Ty {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=initial('ty', 0))
+    slider_tz = Slider(ax_tz, f'Tz {len(superquadric_sliders) + 1}', -0.5, 0.5, valinit=initial('tz', 0))
+    slider_scale = Slider(ax_scale, f'Scale {len(superquadric_sliders) + 1}', 0.001, 10.0, valinit=initial('scale', 1.0))
+    slider_a1 = Slider(ax_a1, f'a1 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=initial('a1', 1.0))
+    slider_a2 = Slider(ax_a2, f'a2 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=initial('a2', 1.0))
+    slider_a3 = Slider(ax_a3, f'a3 {len(superquadric_sliders) + 1}', 0.1, 5.0, valinit=initial('a3', 1.0))
+    slider_roll = Slider(ax_roll, f'Roll {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=initial('roll', 0))
+    slider_pitch = Slider(ax_pitch, f'Pitch {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=initial('pitch', 0))
+    slider_yaw = Slider(ax_yaw, f'Yaw {len(superquadric_sliders) + 1}', -np.pi, np.pi, valinit=initial('yaw', 0))
+
+    def on_changed(val):
+        update(index)
+
+    # Redraws are left to flush_updates, which blits the slider while it is dragged
+    for slider in (slider_tx, slider_ty, slider_tz, slider_scale, slider_a1, slider_a2, slider_a3, slider_roll,
+                   slider_pitch, slider_yaw):
+        slider.drawon = False
+
+    slider_tx.on_changed(on_changed)
+    slider_ty.on_changed(on_changed)
+    slider_tz.on_changed(on_changed)
+    slider_scale.on_changed(on_changed)
+    slider_a1.on_changed(on_changed)
+    slider_a2.on_changed(on_changed)
+    slider_a3.on_changed(on_changed)
+    slider_roll.on_changed(on_changed)
+    slider_pitch.on_changed(on_changed)
+    slider_yaw.on_changed(on_changed)
 
     superquadric_sliders.append({
         'tx': slider_tx,
@@ -121,9 +206,16 @@ def add_superquadric(event):
         'roll': slider_roll,
         'pitch': slider_pitch,
         'yaw': slider_yaw,
-        'primitive': selected_primitive  # Store the selected primitive in the sliders dictionary
+        'primitive': selected_primitive,  # Store the selected primitive in the sliders dictionary
+        # Continuous shape exponents of a stored fitting, saved back unchanged
+        'eps': {key: info[key] for key in ('eps1', 'eps2') if info is not None and key in info}
     })
 
+    # Create the persistent scatter artist of this superquadric; later updates only move its points
+    superquadric_scatters.append(ax.scatter([], [], [], label=f'Superquadric {index + 1}', s=1))
+    set_scatter_points(superquadric_scatters[index], transformed_superquadric(index))
+    ax.legend()
+
     # Update the dropdown menu with the new superquadric
     dropdown_menu.options = [f'Superquadric {i + 1}' for i in range(len(superquadric_sliders))]
     dropdown_menu.value = dropdown_menu.options[-1]
@@ -134,16 +226,13 @@ def update_active_sliders(change):
     for i, sliders in enumerate(superquadric_sliders):
         visible = (i == active_index)
         for key, slider in sliders.items():
-            slider.ax.set_visible(visible)
+            if key not in ('primitive', 'eps'):
+                slider.ax.set_visible(visible)
     plt.draw()
 
 def save_fitting_info(event):
     fitting_info = []
     for sliders in superquadric_sliders:
-        # Extract the object ID from the filename
-        object_name = os.path.splitext(os.path.basename(object_ply_path))[0]
-        object_id = object_name.split('_')[0]  # Extract the first part before the underscore
-
         info = {
             'primitive': sliders['primitive'],  # Use the stored primitive value
             'a1': sliders['a1'].val,
@@ -158,76 +247,117 @@ def save_fitting_info(event):
             'yaw': sliders['yaw'].val,
             'object': object_id  # Store the extracted object ID here
         }
+        info.update(sliders['eps'])
         fitting_info.append(info)
 
-    # Create a unique filename based on the object being fitted
-    base_output_file = os.path.join(fitting_info_directory, f'{object_name}_fitting_info')
+    # Every save becomes the next revision of the object in the fit store
+    with FitStore(store_path) as store:
+        revision = store.save(object_id, fitting_info)
+        store.record_cloud(object_id, object_cloud, revision)
+    print(f"Fitting information saved to {store_path} as object {object_id}, revision {revision}")
 
-    # Check for existing files and create a new filename with an incremented suffix if necessary
-    output_file = f'{base_output_file}.json'
-    index = 1
-    while os.path.exists(output_file):
-        output_file = f'{base_output_file}_{index:02d}.json'
-        index += 1
-
-    with open(output_file, 'w') as f:
-        json.dump(fitting_info, f, indent=4)
-    print(f"Fitting information saved to {output_file}")
-
-# Paths to your object and superquadric .ply files
-object_ply_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib/8_obj.ply'
-superquadric_library_path = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
-fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
-
-# Ensure the fitting info directory exists
-os.makedirs(fitting_info_directory, exist_ok=True)
-
-# Load the point clouds
-object_vertices = load_point_cloud(object_ply_path)
-superquadric_vertices_list = []
-
-# Create the figure and axis
-fig = plt.figure(figsize=(15, 15))
-ax = fig.add_subplot(111, projection='3d')
-
-# Plot the initial point clouds
-ax.scatter(object_vertices[:, 0], object_vertices[:, 1], object_vertices[:, 2], label='Object', s=1)
-
-# Set labels and show initial plot
-ax.set_xlabel('X')
-ax.set_ylabel('Y')
-ax.set_zlabel('Z')
-ax.set_xlim([-0.2, 0.2])
-ax.set_ylim([-0.2, 0.2])
-ax.set_zlim([-0.2, 0.2])
-ax.legend()
-
-# Create sliders for translation, scaling, and rotation adjustments
+# Figure state, set up by run_gui
 axcolor = 'lightgoldenrodyellow'
+superquadric_vertices_list = []
+superquadric_decimation = []
+superquadric_scatters = []
 superquadric_sliders = []
 
-# Add button to add another superquadric
-ax_add_button = plt.axes([0.8, 0.95, 0.1, 0.04])
-button_add = Button(ax_add_button, 'Add Superquadric')
-button_add.on_clicked(add_superquadric)
-
-# Create radio buttons to select superquadric primitive
-ax_radio = plt.axes([0.01, 0.01, 0.2, 0.9], facecolor=axcolor)
-superquadric_files = [f for f in os.listdir(superquadric_library_path) if f.endswith('.ply')]
-radio = RadioButtons(ax_radio, superquadric_files)
-
-# Create dropdown menu to select the active superquadric
-dropdown_menu = widgets.Dropdown(
-    options=[f'Superquadric {i + 1}' for i in range(len(superquadric_sliders))],
-    value=None,
-    description='Select Superquadric'
-)
-dropdown_menu.observe(update_active_sliders, names='value')
-display(dropdown_menu)
-
-# Add button to save fitting information
-ax_save_button = plt.axes([0.8, 0.9, 0.1, 0.04])
-button_save = Button(ax_save_button, 'Save Fitting')
-button_save.on_clicked(save_fitting_info)
-
-plt.show()
+# Redraw state: superquadrics waiting to be redrawn, and the single-shot timer that throttles redraws;
+# while a slider is dragged, the slider and the axes background without its cloud
+pending_updates = set()
+dragging = False
+drag_slider = None
+background = None
+redraw_scheduled = False
+last_redraw = 0.0
+
+def run_gui(object_ply_path, superquadric_library_path, fitting_info_directory):
+    """
+    Opens the interactive fitting window for one object point cloud.
+
+    :param object_ply_path: Path to the object .ply file, e.g. 8_obj.ply.
+    :param superquadric_library_path: Directory whose .ply file names list the selectable primitives.
+    :param fitting_info_directory: Directory of the fit store that fittings are loaded from and saved to.
+    """
+    global object_id, store_path, object_cloud, object_vertices, fig, ax, object_scatter, redraw_timer
+    global radio, dropdown_menu, button_add, button_save
+
+    # Jupyter widgets are only needed for the superquadric selector
+    import ipywidgets as widgets
+    from IPython.display import display
+
+    # Ensure the fitting info directory exists
+    os.makedirs(fitting_info_directory, exist_ok=True)
+    store_path = os.path.join(fitting_info_directory, STORE_FILE)
+
+    # Extract the object ID from the filename, the first part before the underscore
+    object_name = os.path.splitext(os.path.basename(object_ply_path))[0]
+    object_id = object_name.split('_')[0]
+
+    # Load the point clouds; the content hash tells refit which cloud the saved fittings belong to
+    object_cloud = cloud_entry(object_ply_path)
+    object_vertices = load_point_cloud(object_ply_path)
+
+    # Create the figure and axis
+    fig = plt.figure(figsize=(15, 15))
+    ax = fig.add_subplot(111, projection='3d')
+
+    # Plot the initial point clouds
+    object_scatter = ax.scatter(object_vertices[:, 0], object_vertices[:, 1], object_vertices[:, 2], label='Object', s=1)
+
+    # Set labels and show initial plot
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('Z')
+    ax.set_xlim([-0.2, 0.2])
+    ax.set_ylim([-0.2, 0.2])
+    ax.set_zlim([-0.2, 0.2])
+    ax.legend()
+
+    redraw_timer = fig.canvas.new_timer(interval=int(REDRAW_INTERVAL * 1000))
+    redraw_timer.single_shot = True
+    redraw_timer.add_callback(flush_updates)
+    fig.canvas.mpl_connect('draw_event', on_draw)
+    fig.canvas.mpl_connect('button_press_event', on_press)
+    fig.canvas.mpl_connect('button_release_event', on_release)
+
+    # Add button to add another superquadric
+    ax_add_button = plt.axes([0.8, 0.95, 0.1, 0.04])
+    button_add = Button(ax_add_button, 'Add Superquadric')
+    button_add.on_clicked(add_superquadric)
+
+    # Create radio buttons to select superquadric primitive
+    ax_radio = plt.axes([0.01, 0.01, 0.2, 0.9], facecolor=axcolor)
+    superquadric_files = [f for f in os.listdir(superquadric_library_path) if f.endswith('.ply')]
+    radio = RadioButtons(ax_radio, superquadric_files)
+
+    # Create dropdown menu to select the active superquadric
+    dropdown_menu = widgets.Dropdown(
+        options=[f'Superquadric {i + 1}' for i in range(len(superquadric_sliders))],
+        value=None,
+        description='Select Superquadric'
+    )
+    dropdown_menu.observe(update_active_sliders, names='value')
+    display(dropdown_menu)
+
+    # Add button to save fitting information
+    ax_save_button = plt.axes([0.8, 0.9, 0.1, 0.04])
+    button_save = Button(ax_save_button, 'Save Fitting')
+    button_save.on_clicked(save_fitting_info)
+
+    # Continue from the latest stored fitting of the object, if there is one
+    with FitStore(store_path) as store:
+        stored_fitting_info = store.load(object_id)
+    for info in stored_fitting_info or []:
+        create_superquadric(info['primitive'], info)
+
+    plt.show()
+
+if __name__ == "__main__":
+    # Paths to your object and superquadric .ply files
+    object_ply_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib/8_obj.ply'
+    superquadric_library_path = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+    fitting_info_directory = '/home/yifeng/PycharmProjects/Diffusion/general_case/superquadric_fitting'
+
+    run_gui(object_ply_path, superquadric_library_path, fitting_info_directory)
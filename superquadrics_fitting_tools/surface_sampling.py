@@ -0,0 +1,194 @@
+import os
+import sys
+import math
+import numpy as np
+
+# Shared superquadric modules live next to reconstruct.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'superquadric_fitting'))
+from profiling import traced
+
+# Candidates drawn per requested point before Poisson-disk thinning
+POISSON_OVERSAMPLING = 4
+
+# Fraction of the surface covered by the disks of radius r / 2 after thinning that many candidates,
+# measured on meshes at about 0.36 to 0.40 (0.547 with unlimited candidates); slightly less is
+# used, so that the first radius usually keeps enough points
+PACKING_FRACTION = 0.34
+
+# Offsets of the grid cells that may hold a point closer than the radius, see poisson_disk_indices:
+# the 5 x 5 x 5 block without its corners, which are at least one cell diagonal away
+NEIGHBOR_OFFSETS = np.stack(np.meshgrid(*[np.arange(-2, 3)] * 3, indexing='ij'), axis=-1).reshape(-1, 3)
+NEIGHBOR_OFFSETS = NEIGHBOR_OFFSETS[(np.abs(NEIGHBOR_OFFSETS) < 2).any(axis=1)]
+
+# Largest grid, in cells, whose cell IDs are looked up in a dense table rather than by binary search
+DENSE_GRID_CELLS = 1 << 24
+
+
+def face_areas_normals(vertices, faces):
+    """
+    Returns the area (M,) and unit normal (M, 3) of every triangle; degenerate faces get zero normals.
+    """
+    triangles = np.asarray(vertices, dtype=float)[faces]
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    norms = np.linalg.norm(cross, axis=1)
+    normals = np.divide(cross, norms[:, None], out=np.zeros_like(cross), where=norms[:, None] > 0)
+    return 0.5 * norms, normals
+
+
+@traced('sample_surface', points='num_samples')
+def sample_surface(vertices, faces, num_samples, seed=None):
+    """
+    Draws points uniformly over the surface of a triangle mesh, in one vectorized pass.
+
+    Faces are picked with probability proportional to their area and points are placed uniformly
+    inside them, so the density does not depend on how finely the mesh is tessellated.
+
+    :param vertices: (N, 3) array of mesh vertices.
+    :param faces: (M, 3) array of triangle vertex indices.
+    :param num_samples: Number of points to draw.
+    :param seed: Seed of the sampling, or None for a random one.
+    :return: Tuple (points (num_samples, 3), normals (num_samples, 3)) with the unit normal of the
+             face every point lies on.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    return _sample_faces(vertices, faces, *face_areas_normals(vertices, faces), num_samples,
+                         np.random.default_rng(seed))
+
+
+def _sample_faces(vertices, faces, areas, normals, num_samples, rng):
+    if not areas.sum() > 0:
+        raise ValueError("Mesh has no surface area to sample")
+    cumulative = np.cumsum(areas)
+    face_index = np.searchsorted(cumulative, rng.random(num_samples) * cumulative[-1], side='right')
+    face_index = np.minimum(face_index, len(faces) - 1)
+
+    # Uniform barycentric coordinates: w = (1 - sqrt(u1), sqrt(u1) (1 - u2), sqrt(u1) u2)
+    u = rng.random((num_samples, 2))
+    root = np.sqrt(u[:, 0])
+    weights = np.stack([1.0 - root, root * (1.0 - u[:, 1]), root * u[:, 1]], axis=1)
+    triangles = vertices[faces[face_index]]
+    points = np.einsum('ni,nij->nj', weights, triangles)
+    return points, normals[face_index]
+
+
+def poisson_disk_indices(points, radius, seed=None):
+    """
+    Thins points so that no two kept points are closer than radius (Poisson-disk sampling).
+
+    Points are bucketed in a spatial hash of cells with diagonal radius, so a cell keeps at most
+    one point and conflicts can only come from the NEIGHBOR_OFFSETS cells around it, which are
+    looked up once per cell, in a dense table for grids of up to DENSE_GRID_CELLS cells. Cells whose
+    indices agree modulo 3 are more than radius apart, so each of the 27 such classes is thinned
+    in rounds, testing one random candidate of every open cell of the class at once. The result is
+    maximal: every dropped point lies within radius of a kept one.
+
+    :param points: (N, 3) array of candidate points.
+    :param radius: Minimum distance between kept points.
+    :param seed: Seed of the random candidate order.
+    :return: Array of indices into points of the kept points.
+    """
+    points = np.asarray(points, dtype=float)
+    rng = np.random.default_rng(seed)
+    cell_size = radius / np.sqrt(3)
+    keys = np.floor((points - points.min(axis=0)) / cell_size).astype(np.int64) + 2
+    dims = keys.max(axis=0) + 3
+    grid_cells = math.prod(dims.tolist())
+    if grid_cells >= 2 ** 62:
+        raise ValueError(f"Radius {radius:.3g} is too small for the extent of the points")
+    flat = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+    neighbor_offsets = (NEIGHBOR_OFFSETS[:, 0] * dims[1] + NEIGHBOR_OFFSETS[:, 1]) * dims[2] + NEIGHBOR_OFFSETS[:, 2]
+    color = (keys[:, 0] % 3) * 9 + (keys[:, 1] % 3) * 3 + keys[:, 2] % 3
+
+    # Spatial hash: only cells holding candidates can ever hold a kept point, so they get compact
+    # IDs and a table of their neighboring cells, -1 where a neighbor holds no candidate
+    cells, cell = np.unique(flat, return_inverse=True)
+    neighbors = cells[:, None] + neighbor_offsets[None, :]
+    if grid_cells <= DENSE_GRID_CELLS:
+        lookup = np.full(grid_cells, -1, dtype=np.int32)
+        lookup[cells] = np.arange(len(cells), dtype=np.int32)
+        neighbor_cells = lookup[neighbors]
+        del lookup
+    else:
+        neighbor_cells = np.minimum(np.searchsorted(cells, neighbors), len(cells) - 1).astype(np.int32)
+        neighbor_cells[cells[neighbor_cells] != neighbors] = -1
+    del neighbors
+
+    # Rank of every candidate within its cell, in random order
+    order = np.lexsort((rng.random(len(points)), cell))
+    starts = np.flatnonzero(np.r_[True, cell[order[1:]] != cell[order[:-1]]])
+    rank = np.empty(len(points), dtype=np.int64)
+    rank[order] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+
+    # Every (class, rank) batch is a contiguous run of candidates in distinct, independent cells
+    order = np.lexsort((rank, color))
+    batch = color[order] * (rank.max() + 1) + rank[order]
+    bounds = np.flatnonzero(np.r_[True, batch[1:] != batch[:-1], True])
+
+    # Kept point of every cell, with a sentinel entry that stays -1 for the missing neighbors
+    cell_point = np.full(len(cells) + 1, -1, dtype=np.int64)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        candidates = order[start:stop]
+        # Cells already holding a point are closed
+        candidates = candidates[cell_point[cell[candidates]] < 0]
+        if not candidates.size:
+            continue
+        neighbor_points = cell_point[neighbor_cells[cell[candidates]]]
+        rows, columns = np.nonzero(neighbor_points >= 0)
+        difference = points[neighbor_points[rows, columns]] - points[candidates[rows]]
+        close = np.zeros(len(candidates), dtype=bool)
+        close[rows[np.einsum('nj,nj->n', difference, difference) < radius ** 2]] = True
+        candidates = candidates[~close]
+        cell_point[cell[candidates]] = candidates
+    kept = cell_point[:-1]
+    return kept[kept >= 0]
+
+
+@traced('poisson_disk_sample', points='num_samples')
+def poisson_disk_sample(vertices, faces, num_samples, seed=None, oversampling=POISSON_OVERSAMPLING):
+    """
+    Draws blue-noise points over the surface of a triangle mesh.
+
+    oversampling * num_samples area-weighted candidates are thinned by poisson_disk_indices with
+    the radius at which a saturated sampling of the surface keeps about num_samples points. The
+    radius shrinks until at least num_samples points are kept, drawing twice as many candidates if
+    that takes too long, and random extra points are then dropped, which keeps the minimum
+    distance. If even that keeps too few points, a warning is printed and random candidates fill
+    up the rest.
+
+    The points are spread as evenly as vertex FPS, at a fraction of its cost: on a 40k-vertex
+    ellipsoid at 8000 points, about 0.1 s against 0.5 s for farthest_point_sampling, with the same
+    nearest-neighbor spread. sample_surface takes 0.02 s, but its points cluster.
+
+    :param vertices: (N, 3) array of mesh vertices.
+    :param faces: (M, 3) array of triangle vertex indices.
+    :param num_samples: Number of points to return.
+    :param seed: Seed of the sampling, or None for a random one.
+    :param oversampling: Candidates drawn per requested point.
+    :return: Tuple (points (num_samples, 3), normals (num_samples, 3)), see sample_surface.
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    faces = np.asarray(faces)
+    rng = np.random.default_rng(seed)
+    areas, face_normals = face_areas_normals(vertices, faces)
+    radius = np.sqrt(4.0 * PACKING_FRACTION * areas.sum() / (np.pi * num_samples))
+
+    for _ in range(3):
+        points, normals = _sample_faces(vertices, faces, areas, face_normals, oversampling * num_samples, rng)
+        for _ in range(8):
+            kept = poisson_disk_indices(points, radius, rng)
+            if len(kept) >= num_samples:
+                break
+            radius *= 0.95 * np.sqrt(len(kept) / num_samples)
+        else:
+            # Still too few points; draw twice as many candidates and keep shrinking from here
+            oversampling *= 2
+            continue
+        break
+    else:
+        print(f"Warning: only {len(kept)} of {num_samples} points keep a Poisson-disk distance, the rest "
+              f"are random surface points that may lie closer than {radius:.3g}")
+        others = rng.permutation(np.setdiff1d(np.arange(len(points)), kept))
+        kept = np.r_[kept, others[:num_samples - len(kept)]]
+    kept = rng.choice(kept, num_samples, replace=False) if len(kept) > num_samples else kept
+    return points[kept], normals[kept]
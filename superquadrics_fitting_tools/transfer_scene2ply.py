@@ -1,40 +1,176 @@
 import os
+import glob
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from obj_preprocessing import convert_obj_to_ply
 
+# Records source hash and sample count of every converted object in the output directory
+MANIFEST_FILE = 'conversion_manifest.json'
 
-def process_scene_to_ply(scene_gt_path, obj_base_path, output_dir, num_samples=8000):
-    # Load the scene_gt.json file
-    with open(scene_gt_path, 'r') as f:
-        scene_gt_data = json.load(f)
 
-    # Iterate over all entries in the scene
-    for entry in scene_gt_data["3"]:
-        obj_id = entry["obj_id"]
+def file_sha1(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-        # Construct the paths for the .obj and .ply files
-        obj_file_name = f'{str(obj_id).zfill(3)}_obj.obj'  # Pad the object ID with leading zeros
-        obj_file_path = os.path.join(obj_base_path, obj_file_name)
+
+def find_scene_gt_files(dataset_root):
+    """
+    Finds every scene_gt.json below a MetaGraspNet dataset root.
+
+    :param dataset_root: Directory containing the scene folders.
+    :return: Sorted list of scene_gt.json paths.
+    """
+    return sorted(glob.glob(os.path.join(dataset_root, '**', 'scene_gt.json'), recursive=True))
+
+
+def collect_object_ids(scene_gt_paths):
+    """
+    Collects the distinct object IDs over all views of all given scenes.
+
+    :param scene_gt_paths: List of scene_gt.json paths.
+    :return: Sorted list of integer object IDs.
+    """
+    object_ids = set()
+    for scene_gt_path in scene_gt_paths:
+        with open(scene_gt_path, 'r') as f:
+            scene_gt_data = json.load(f)
+        for entries in scene_gt_data.values():
+            object_ids.update(int(entry["obj_id"]) for entry in entries)
+    return sorted(object_ids)
+
+
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    # Replace atomically, so an interrupted run never leaves a truncated manifest behind
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(f'{manifest_path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def _source_entry(obj_file_path, previous):
+    """
+    Describes an .obj source file, re-hashing it only if its mtime or size changed.
+    """
+    stat = os.stat(obj_file_path)
+    if previous and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size:
+        sha1 = previous['sha1']
+    else:
+        sha1 = file_sha1(obj_file_path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': sha1}
+
+
+def _convert_job(obj_file_path, ply_file_path, num_samples, memory_budget, sampling):
+    convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=num_samples, memory_budget=memory_budget,
+                       sampling=sampling)
+    return ply_file_path
+
+
+def process_scenes_to_ply(scene_gt_paths, obj_base_path, output_dir, num_samples=8000, num_workers=None,
+                          memory_budget=None, sampling='vertices'):
+    """
+    Converts every object referenced by the given scenes to a .ply point cloud, once per object ID.
+
+    Conversions run in a process pool. Objects whose output exists and whose source hash,
+    num_samples, sampling mode and memory budget match the manifest are skipped, and the manifest
+    is updated after every finished conversion, so an interrupted or partially failed run can simply be restarted.
+
+    :param scene_gt_paths: List of scene_gt.json paths.
+    :param obj_base_path: Directory containing the <obj_id>_obj.obj files.
+    :param output_dir: Directory to write the <obj_id>_obj.ply files and the manifest to.
+    :param num_samples: Number of points to keep per object with farthest point sampling.
+    :param num_workers: Number of worker processes, defaults to the number of CPUs.
+    :param memory_budget: Optional working memory per worker in bytes; objects are then streamed
+                          with stream_convert_to_ply instead of loaded whole.
+    :param sampling: Point sampling mode of convert_obj_to_ply.
+    :return: Dictionary with the lists of 'converted', 'skipped', 'missing' and 'failed' object IDs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    summary = {'converted': [], 'skipped': [], 'missing': [], 'failed': []}
+
+    jobs = {}
+    for obj_id in collect_object_ids(scene_gt_paths):
+        # Pad the object ID with leading zeros for the source, strip them for the output
+        obj_file_path = os.path.join(obj_base_path, f'{str(obj_id).zfill(3)}_obj.obj')
+        custom_ply_file_name = f'{obj_id}_obj.ply'
+        ply_file_path = os.path.join(output_dir, custom_ply_file_name)
 
         if not os.path.exists(obj_file_path):
             print(f"Warning: {obj_file_path} not found, skipping...")
+            summary['missing'].append(obj_id)
             continue
 
-        # Define the custom output .ply file name and path
-        # Strip leading zeros from the object ID in the output file name
-        custom_ply_file_name = f'{int(obj_id)}_obj.ply'  # Use int() to strip leading zeros
-        ply_file_path = os.path.join(output_dir, custom_ply_file_name)
+        previous = manifest.get(custom_ply_file_name)
+        source = _source_entry(obj_file_path, previous['source'] if previous else None)
+        if (previous and os.path.exists(ply_file_path) and previous['source']['sha1'] == source['sha1']
+                and previous['num_samples'] == num_samples and previous.get('sampling', 'vertices') == sampling
+                and previous.get('memory_budget') == memory_budget):
+            summary['skipped'].append(obj_id)
+            continue
+        jobs[obj_id] = (obj_file_path, ply_file_path, custom_ply_file_name, source)
+
+    print(f"{len(jobs)} objects to convert, {len(summary['skipped'])} up to date")
+    if jobs:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {executor.submit(_convert_job, obj_file_path, ply_file_path, num_samples, memory_budget,
+                                       sampling): obj_id
+                       for obj_id, (obj_file_path, ply_file_path, _, _) in jobs.items()}
+            for future in as_completed(futures):
+                obj_id = futures[future]
+                _, ply_file_path, custom_ply_file_name, source = jobs[obj_id]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error: failed to convert object {obj_id}: {e}")
+                    summary['failed'].append(obj_id)
+                    continue
+
+                manifest[custom_ply_file_name] = {'source': source, 'num_samples': num_samples, 'sampling': sampling,
+                                                  'memory_budget': memory_budget}
+                save_manifest(output_dir, manifest)
+                summary['converted'].append(obj_id)
+                print(f"Processed and saved: {ply_file_path}")
+
+    print(f"Processing complete! {len(summary['converted'])} converted, {len(summary['skipped'])} skipped, "
+          f"{len(summary['missing'])} missing, {len(summary['failed'])} failed")
+    return summary
+
+
+def process_scene_to_ply(scene_gt_path, obj_base_path, output_dir, num_samples=8000, num_workers=None,
+                         memory_budget=None, sampling='vertices'):
+    """
+    Converts the objects of a single scene_gt.json, over all of its views.
+    """
+    return process_scenes_to_ply([scene_gt_path], obj_base_path, output_dir, num_samples, num_workers, memory_budget,
+                                 sampling)
 
-        # Convert the .obj file to .ply
-        convert_obj_to_ply(obj_file_path, ply_file_path, num_samples=num_samples)
-        print(f"Processed and saved: {ply_file_path}")
 
-    print("Processing complete!")
+def process_dataset_to_ply(dataset_root, obj_base_path, output_dir, num_samples=8000, num_workers=None,
+                           memory_budget=None, sampling='vertices'):
+    """
+    Converts the objects of every scene below a MetaGraspNet dataset root.
+    """
+    scene_gt_paths = find_scene_gt_files(dataset_root)
+    print(f"Found {len(scene_gt_paths)} scenes in {dataset_root}")
+    return process_scenes_to_ply(scene_gt_paths, obj_base_path, output_dir, num_samples, num_workers, memory_budget,
+                                 sampling)
 
 
 if __name__ == "__main__":
     # Paths
-    scene_gt_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/gt_label/scene296/scene_gt.json'  # Replace with your scene_gt.json path
+    dataset_root = '/home/yifeng/PycharmProjects/Diffusion/general_case/gt_label'  # Replace with the directory containing the scene folders
     obj_base_path = '/home/yifeng/PycharmProjects/Diffusion/general_case/model_auto'  # Replace with your base directory for .obj files
     output_dir = '/home/yifeng/PycharmProjects/Diffusion/general_case/point_cloud_lib'  # Replace with your desired output directory
 
@@ -44,5 +180,5 @@ if __name__ == "__main__":
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
-    # Process the scene and convert to .ply
-    process_scene_to_ply(scene_gt_path, obj_base_path, output_dir, num_samples=num_samples)
+    # Convert every object of every scene to .ply
+    process_dataset_to_ply(dataset_root, obj_base_path, output_dir, num_samples=num_samples)
@@ -47,15 +47,16 @@ def visualize_multiple_ply_point_clouds(file_paths, xlim=None, ylim=None, zlim=N
     plt.show()
 
 
-# Example usage
-file_paths = [
-    '/home/yifeng/PycharmProjects/Diffusion/test_case/point_cloud_lib/39_obj.ply',
-    '/home/yifeng/PycharmProjects/Diffusion/test_case/point_cloud_lib/62_obj.ply'
-]
-
-# Example axis limits
-xlim = (-0.05, 0.05)
-ylim = (-0.05, 0.05)
-zlim = (-0.05, 0.05)
-
-visualize_multiple_ply_point_clouds(file_paths, xlim, ylim, zlim)
+if __name__ == "__main__":
+    # Example usage
+    file_paths = [
+        '/home/yifeng/PycharmProjects/Diffusion/test_case/point_cloud_lib/39_obj.ply',
+        '/home/yifeng/PycharmProjects/Diffusion/test_case/point_cloud_lib/62_obj.ply'
+    ]
+
+    # Example axis limits
+    xlim = (-0.05, 0.05)
+    ylim = (-0.05, 0.05)
+    zlim = (-0.05, 0.05)
+
+    visualize_multiple_ply_point_clouds(file_paths, xlim, ylim, zlim)
@@ -48,9 +48,10 @@ def visualize_superquadric_primitives(eps1_values, eps2_values, directory):
     plt.show()
 
 
-# Example usage
-eps1_values = [0, 0.5, 1.0, 1.5]
-eps2_values = [0, 0.5, 1.0, 1.5]
-directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
+if __name__ == "__main__":
+    # Example usage
+    eps1_values = [0, 0.5, 1.0, 1.5]
+    eps2_values = [0, 0.5, 1.0, 1.5]
+    directory = '/home/yifeng/PycharmProjects/Diffusion/superquadric_lib_rescale'
 
-visualize_superquadric_primitives(eps1_values, eps2_values, directory)
+    visualize_superquadric_primitives(eps1_values, eps2_values, directory)
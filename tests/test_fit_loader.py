@@ -0,0 +1,49 @@
+import os
+import sys
+import numpy as np
+
+# Modules of the toolchain live in script directories
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.append(os.path.join(REPOSITORY, 'superquadric_fitting'))
+
+import fit_dataset
+from fit_dataset import FitDataset, FitLoader, pack_fit_dataset
+from fit_store import FitStore
+
+
+def _grid_fitting(rng, num_primitives):
+    eps = ['0.1', '0.5', '1.0', '1.5', '2.0']
+    return [{
+        'primitive': f'{rng.choice(eps)}_{rng.choice(eps)}.ply',
+        'a1': float(rng.uniform(0.5, 2.0)), 'a2': float(rng.uniform(0.5, 2.0)), 'a3': float(rng.uniform(0.5, 2.0)),
+        'scale': float(rng.uniform(0.2, 1.0)),
+        'tx': float(rng.uniform(-0.1, 0.1)), 'ty': float(rng.uniform(-0.1, 0.1)), 'tz': float(rng.uniform(-0.1, 0.1)),
+        'roll': float(rng.uniform(-np.pi, np.pi)), 'pitch': float(rng.uniform(-1.5, 1.5)),
+        'yaw': float(rng.uniform(-np.pi, np.pi)),
+    } for _ in range(num_primitives)]
+
+
+def _loader_points(dataset, workers):
+    # Start every run from a cold sample bank, where concurrent batches add shapes at the same time
+    fit_dataset._bank_rows.clear()
+    fit_dataset._bank = np.empty((0, 3))
+    with FitLoader(dataset, batch_size=64, samples=256, workers=workers, seed=1) as loader:
+        return [(batch['points'], batch['labels']) for batch in loader]
+
+
+def test_threaded_loader_matches_serial(tmp_path):
+    rng = np.random.default_rng(0)
+    store_path = str(tmp_path / 'fitting_store.sqlite')
+    with FitStore(store_path) as store:
+        for i in range(2000):
+            store.save(str(i), _grid_fitting(rng, int(rng.integers(1, 7))))
+    pack_fit_dataset(store_path, str(tmp_path / 'fits.npz'))
+    dataset = FitDataset(str(tmp_path / 'fits.npz'))
+
+    serial = _loader_points(dataset, 0)
+    for workers in (2, 8):
+        threaded = _loader_points(dataset, workers)
+        assert len(threaded) == len(serial)
+        for (points, labels), (serial_points, serial_labels) in zip(threaded, serial):
+            assert np.array_equal(labels, serial_labels)
+            assert np.array_equal(points, serial_points)